@@ -1,17 +1,28 @@
 import streamlit as st
 import datetime
 from datetime import timedelta
-import json
+import functools
 import os
-import pandas as pd
+import importlib.util
+import time
 import uuid
+from collections import Counter
+from nucleo import almacen, exportacion, ia, persistencia
+from nucleo.almacen import op_fijar, op_borrar, op_anadir, op_quitar
+from nucleo.catalogo import Tratamiento, VersionesCatalogo, catalogo_usuario
+from nucleo.planificacion import GENERIC_CARDIO_PARAMS, TAGS_ACTIVIDADES, MOMENTOS, planificar_semana, grupo_de
+from nucleo.indice import IndicesHistorial
+from nucleo.resumenes import ResumenesHistorial, limites_periodo, adherencia_clinica
+from nucleo.cache_ia import CacheIA
+from nucleo.busqueda import BuscadorCatalogo
+from nucleo.trabajos import Ejecutor, ErrorTrabajos
+from concurrent.futures import CancelledError
 
 # --- INTEGRACIÓN GOOGLE GEMINI ---
-try:
-    import google.generativeai as genai
-    HAS_GEMINI = True
-except ImportError:
-    HAS_GEMINI = False
+# Solo se comprueba que está instalado; ia.ClienteGemini lo importa al hacer la primera consulta.
+# pandas (Historial), analitica e importacion (con openpyxl) también se importan donde se usan.
+try: HAS_GEMINI = importlib.util.find_spec("google.generativeai") is not None
+except ModuleNotFoundError: HAS_GEMINI = False  # ni siquiera existe el paquete google
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(
@@ -22,581 +33,93 @@ st.set_page_config(
 
 # --- ARCHIVO DE DATOS ---
 ARCHIVO_DATOS = 'historial_mega_panel_pro.json'
+ARCHIVO_SQLITE = 'historial_mega_panel_pro.sqlite'
+ARCHIVO_CACHE_IA = 'cache_ia_mega_panel_pro.sqlite'
+BACKEND_DATOS = os.environ.get("MEGA_PANEL_BACKEND", "json")  # "json" | "sqlite"
 
 # ==============================================================================
-# 1. CONSTANTES Y CONFIGURACIÓN
+# 1-3. RUTINA, CATÁLOGO Y MODELO: ver nucleo/planificacion.py y nucleo/catalogo.py
 # ==============================================================================
 
-RUTINA_SEMANAL = {
-    "0": ["FULLBODY I"],            # Lunes
-    "1": ["TORSO I"],               # Martes
-    "2": ["PREVENTIVO I"],          # Miércoles
-    "3": ["FULLBODY II"],           # Jueves
-    "4": ["TORSO II / CIRCUITO"],   # Viernes
-    "5": ["PREVENTIVO II"],         # Sábado
-    "6": ["Descanso Total"]         # Domingo
-}
-
-CARDIO_DEFAULTS_BY_DAY = {
-    "0": {"actividad": "Remo Ergómetro", "tiempo": 8, "ritmo": "Intenso"},
-    "2": {"actividad": "Cinta Inclinada", "tiempo": 20, "velocidad": 6.5, "inclinacion": 4.0},
-    "5": {"actividad": "Cinta Inclinada", "tiempo": 15, "velocidad": 6.5, "inclinacion": 4.0}
-}
-
-GENERIC_CARDIO_PARAMS = {
-    "Remo Ergómetro": {"tiempo": 8, "ritmo": "Intenso"},
-    "Cinta Inclinada": {"tiempo": 15, "velocidad": 6.5, "inclinacion": 4.0},
-    "Elíptica": {"tiempo": 15, "velocidad": 6.5},
-    "Andar": {"tiempo": 15},
-    "Andar (Pasos)": {"pasos": 10000},
-    "Descanso Cardio": {}
-}
-
-TAGS_ACTIVIDADES = {
-    "FULLBODY I": ["Upper", "Lower", "Active"], 
-    "TORSO I": ["Upper", "Active"],
-    "PREVENTIVO I": ["Active"], 
-    "FULLBODY II": ["Upper", "Lower", "Active"],
-    "TORSO + CIRCUITO": ["Upper", "Active", "Cardio"], 
-    "PREVENTIVO II": ["Active"],
-    "Descanso Total": [],
-    "Remo Ergómetro": ["Active", "Cardio", "Upper", "Lower"],
-    "Cinta Inclinada": ["Active", "Cardio", "Lower"],
-    "Elíptica": ["Active", "Cardio", "Lower"],
-    "Andar": ["Active", "Lower"],
-    "Andar (Pasos)": ["Active", "Lower"],
-    "Descanso Cardio": []
-}
-
-# Zonas que generan variantes Derecha/Izquierda automáticamente
-ZONAS_SIMETRICAS = ["Codo", "Antebrazo", "Muñeca", "Pierna", "Pie", "Hombro", "Rodilla", "Tobillo", "Brazo", "Mano", "Cadera"]
-
-# ==============================================================================
-# 2. DEFINICIÓN MAESTRA BASE (CATÁLOGO COMPLETO)
-# ==============================================================================
-DB_TRATAMIENTOS_BASE = {
-    "Codo": {
-        "Epicondilitis (Tenista)": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz (Dolor)", "dist": "Contacto", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Reduce inflamación en tendón extensor y alivia dolor agudo.",
-            "sintomas": "Dolor en la cara externa del codo al agarrar o girar.",
-            "posicion": "Sentado, brazo en mesa. Panel lateral tocando zona externa.",
-            "tips_ant": ["Piel limpia"], "tips_des": ["No pinza con dedos", "Hielo si dolor"]
-        },
-        "Epitrocleitis (Golfista)": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz (Dolor)", "dist": "Contacto", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Regeneración para la cara interna del codo.",
-            "sintomas": "Dolor interno al flexionar muñeca.",
-            "posicion": "Brazo en mesa, palma arriba. Panel en cara interna.",
-            "tips_ant": ["Piel limpia"], "tips_des": ["Estirar flexores"]
-        },
-        "Calcificación": {
-            "ondas": "850nm", "energia": "660nm: 0% | 850nm: 100%", 
-            "hz": "50Hz (Analgesia)", "dist": "Contacto", "dur": 12,
-            "frecuencias": [(660, 0), (850, 100)],
-            "descripcion": "Infrarrojo profundo para estimular reabsorción de calcio.",
-            "sintomas": "Dolor punzante y limitación de movimiento.",
-            "posicion": "Panel en contacto directo con la zona calcificada.",
-            "tips_ant": ["Calor previo"], "tips_des": ["Movilidad suave"]
-        },
-        "Bursitis (Apoyo)": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "10Hz (Anti-inflamatorio)", "dist": "5cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Baja la inflamación de la bursa sin contacto directo.",
-            "sintomas": "Hinchazón (bulto) en la punta del codo.",
-            "posicion": "Panel a 5cm del bulto. NO TOCAR.",
-            "tips_ant": ["Zona limpia"], "tips_des": ["No apoyar codo"]
-        }
-    },
-    "Espalda": {
-        "Cervicalgia (Cuello)": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz (Dolor)", "dist": "10cm", "dur": 15,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Relaja tensión cervical y mejora riego sanguíneo.",
-            "sintomas": "Rigidez de cuello y trapecios.",
-            "posicion": "Sentado, panel detrás del cuello.",
-            "tips_ant": ["Sin collar"], "tips_des": ["Movilidad suave"]
-        },
-        "Dorsalgia (Alta)": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz", "dist": "15cm", "dur": 15,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Para zona media-alta de la espalda y postura.",
-            "sintomas": "Dolor entre omóplatos.",
-            "posicion": "Sentado al revés en silla o tumbado.",
-            "tips_ant": ["Postura recta"], "tips_des": ["Estirar pecho"]
-        },
-        "Lumbalgia (Baja)": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz (Dolor)", "dist": "10cm", "dur": 20,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Penetración profunda lumbar para desinflamar discos.",
-            "sintomas": "Dolor en zona baja, dificultad al enderezarse.",
-            "posicion": "Tumbado boca abajo o sentado en taburete.",
-            "tips_ant": ["Calor previo"], "tips_des": ["No cargar peso"]
-        }
-    },
-    "Antebrazo": {
-        "Sobrecarga": {
-            "ondas": "660+850", "energia": "660nm: 80% | 850nm: 80%", 
-            "hz": "10Hz (Relajación)", "dist": "15cm", "dur": 12,
-            "frecuencias": [(660, 80), (850, 80)],
-            "descripcion": "Relajación muscular general del antebrazo.",
-            "sintomas": "Sensación de fatiga, antebrazos duros.",
-            "posicion": "Antebrazo apoyado en mesa. Panel desde arriba.",
-            "tips_ant": ["Quitar sudor"], "tips_des": ["Estirar", "Calor"]
-        },
-        "Tendinitis": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz (Dolor)", "dist": "10cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Tratamiento anti-inflamatorio localizado.",
-            "sintomas": "Dolor puntual en trayecto del tendón.",
-            "posicion": "Panel apuntando directamente al punto de dolor.",
-            "tips_ant": ["Quitar reloj"], "tips_des": ["Reposo"]
-        }
-    },
-    "Muñeca": {
-        "Túnel Carpiano": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "10Hz (Nervio)", "dist": "5cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Enfocado en regeneración nerviosa y desinflamación.",
-            "sintomas": "Hormigueo en dedos, dolor nocturno.",
-            "posicion": "Palma arriba. Panel en base de muñeca.",
-            "tips_ant": ["Palma abierta"], "tips_des": ["Movilidad"]
-        },
-        "Articular": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz", "dist": "5cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Para dolor articular general y rigidez.",
-            "sintomas": "Dolor difuso al mover la muñeca.",
-            "posicion": "Rotar muñeca frente al panel.",
-            "tips_ant": ["Sin muñequera"], "tips_des": ["Hielo"]
-        }
-    },
-    "Pierna": {
-        "Cintilla Iliotibial": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz (Dolor)", "dist": "Contacto", "dur": 12,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Reduce fricción e inflamación en fascia lata.",
-            "sintomas": "Dolor lateral externo rodilla/muslo.",
-            "posicion": "Tumbado de lado, panel en cara externa muslo.",
-            "tips_ant": ["Piel limpia"], "tips_des": ["Estirar TFL"]
-        },
-        "Sobrecarga Femoral": {
-            "ondas": "660+850", "energia": "660nm: 80% | 850nm: 100%", 
-            "hz": "10Hz (Recuperación)", "dist": "10cm", "dur": 15,
-            "frecuencias": [(660, 80), (850, 100)],
-            "descripcion": "Acelera barrido de lactato y recuperación.",
-            "sintomas": "Fatiga, pesadez muscular.",
-            "posicion": "Panel cubriendo el grupo muscular afectado.",
-            "tips_ant": ["Quitar sudor"], "tips_des": ["Estirar"]
-        }
-    },
-    "Pie": {
-        "Fascitis Plantar": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "50Hz", "dist": "5cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Desinflamación del arco plantar.",
-            "sintomas": "Dolor agudo en talón al pisar.",
-            "posicion": "Sentado, panel apuntando a planta del pie.",
-            "tips_ant": ["Sin calcetín"], "tips_des": ["Rodar pelota"]
-        },
-        "Dorsal (Esguince)": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "10Hz (Regeneración)", "dist": "10cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Regeneración de ligamentos.",
-            "sintomas": "Dolor e hinchazón tobillo/empeine.",
-            "posicion": "Panel enfocado a zona hinchada.",
-            "tips_ant": ["Piel limpia"], "tips_des": ["Movilidad"]
-        },
-        "Lateral (Metatarso)": {
-            "ondas": "Todas (Mega)", "energia": "TODO 100%", 
-            "hz": "50Hz (Analgesia)", "dist": "10cm", "dur": 12,
-            "frecuencias": [(660, 100), (850, 100), (810, 100), (830, 100), (630, 100)],
-            "descripcion": "Alivio dolor agudo en 5º metatarsiano.",
-            "sintomas": "Dolor borde exterior del pie bajo dedo pequeño.",
-            "posicion": "Panel de lado en suelo apuntando al lateral del pie.",
-            "tips_ant": ["Pie limpio"], "tips_des": ["Movilidad dedos"]
-        }
-    },
-    "Hombro": {
-        "Tendinitis": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "10-40Hz", "dist": "15cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Para manguito rotador inflamado.",
-            "sintomas": "Dolor al levantar brazo lateralmente.",
-            "posicion": "Sentado, panel lateral apuntando al deltoides.",
-            "tips_ant": ["Sin ropa"], "tips_des": ["Péndulos"]
-        }
-    },
-    "Rodilla": {
-        "Dolor General": {
-            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
-            "hz": "10Hz", "dist": "15cm", "dur": 10,
-            "frecuencias": [(660, 50), (850, 100)],
-            "descripcion": "Mantenimiento articular y meniscos.",
-            "sintomas": "Molestia profunda o chasquidos.",
-            "posicion": "Pierna estirada, panel frontal o lateral.",
-            "tips_ant": ["No hielo antes"], "tips_des": ["Movilidad"]
-        }
-    },
-    "Piel": {
-        "Cicatrices": {
-            "ondas": "630+660", "energia": "660nm: 100% | 850nm: 20%", 
-            "hz": "CW", "dist": "10cm", "dur": 10,
-            "frecuencias": [(660, 100), (850, 20)],
-            "descripcion": "Mejora textura y color de cicatrices.",
-            "sintomas": "Tejido cicatricial reciente o antiguo.",
-            "posicion": "Panel directo a la cicatriz.",
-            "tips_ant": ["Limpio"], "tips_des": ["Rosa Mosqueta"]
-        },
-        "Acné": {
-            "ondas": "630+660", "energia": "660nm: 80% | 850nm: 0%", 
-            "hz": "CW", "dist": "15cm", "dur": 8,
-            "frecuencias": [(660, 80), (850, 0)],
-            "descripcion": "Reduce inflamación bacteriana y rojez.",
-            "sintomas": "Brotes activos, rojez facial.",
-            "posicion": "Frente al rostro (gafas puestas).",
-            "tips_ant": ["Limpio"], "tips_des": ["Hidratar"]
-        },
-        "Quemaduras": {
-            "ondas": "630+660", "energia": "660nm: 50% | 850nm: 0%", 
-            "hz": "CW", "dist": "20cm", "dur": 5,
-            "frecuencias": [(660, 50), (850, 0)],
-            "descripcion": "Regeneración epidérmica sin calor.",
-            "sintomas": "Piel roja o dañada por sol/calor.",
-            "posicion": "Mayor distancia (20-30cm).",
-            "tips_ant": ["Sin cremas"], "tips_des": ["Aloe Vera"]
-        }
-    },
-    "Sistémico": {
-        "Circulación": {
-            "ondas": "660+850", "energia": "100% | 100%", 
-            "hz": "CW", "dist": "30cm", "dur": 20,
-            "frecuencias": [(660, 100), (850, 100)],
-            "descripcion": "Vasodilatación general.",
-            "sintomas": "Piernas cansadas, frío en extremidades.",
-            "posicion": "Panel cubriendo grandes grupos musculares.",
-            "tips_ant": ["Beber agua"], "tips_des": ["Caminar"]
-        },
-        "Energía": {
-            "ondas": "660+850", "energia": "100% | 100%", 
-            "hz": "CW", "dist": "20cm", "dur": 10,
-            "frecuencias": [(660, 100), (850, 100)],
-            "descripcion": "Estimulación mitocondrial.",
-            "sintomas": "Fatiga general, falta de energía.",
-            "posicion": "Panel frente al torso/pecho.",
-            "tips_ant": ["Mañana"], "tips_des": ["Actividad"]
-        }
-    },
-    "Cabeza": {
-        "Migraña": {
-            "ondas": "850nm", "energia": "660nm: 0% | 850nm: 50%", 
-            "hz": "10Hz (Alfa)", "dist": "Contacto Nuca", "dur": 10,
-            "frecuencias": [(660, 0), (850, 50)],
-            "descripcion": "Relajación occipital para tensión vascular.",
-            "sintomas": "Dolor pulsátil, tensión en nuca.",
-            "posicion": "Panel en la nuca (NO ojos).",
-            "tips_ant": ["Oscuridad"], "tips_des": ["Reposo"]
-        },
-        "Salud Cerebral": {
-            "ondas": "810nm", "energia": "0% | 100%", 
-            "hz": "40Hz (Gamma)", "dist": "30cm", "dur": 10,
-            "frecuencias": [(810, 100)],
-            "descripcion": "Neuroprotección y cognitiva.",
-            "sintomas": "Niebla mental, prevención.",
-            "posicion": "Panel a la frente/cabeza. GAFAS OBLIGATORIAS.",
-            "tips_ant": ["Gafas"], "tips_des": ["Tarea cognitiva"]
-        }
-    },
-    "Grasa/Estética": {
-        "Grasa Localizada": {
-            "ondas": "Todas (Mega)", "energia": "TODO AL 100%", 
-            "hz": "CW (Continuo)", "dist": "20-30cm", "dur": 15,
-            "frecuencias": [(660, 100), (850, 100), (810, 100), (830, 100), (630, 100)],
-            "descripcion": "Lipólisis térmica máxima.",
-            "sintomas": "Grasa resistente.",
-            "posicion": "Directo a piel desnuda. EJERCICIO INMEDIATO.",
-            "tips_ant": ["Beber agua"], "tips_des": ["Cardio 30min"],
-            "visual_group": "PRE", "req_tags": ["Active"]
-        },
-        "Facial": {
-            "ondas": "630nm", "energia": "100% | 0%", 
-            "hz": "CW", "dist": "30cm", "dur": 10,
-            "frecuencias": [(630, 100), (660, 50)],
-            "descripcion": "Colágeno superficial.",
-            "sintomas": "Arrugas finas, piel apagada.",
-            "posicion": "Frente al rostro 30cm. GAFAS PUESTAS.",
-            "tips_ant": ["Gafas"], "tips_des": ["Serum"],
-            "visual_group": "FLEX", "momento_txt": "Cualquier hora"
-        }
-    },
-    "Permanente": {
-        "Testosterona": {
-            "ondas": "660+850", "energia": "100% | 100%", 
-            "hz": "CW", "dist": "15cm", "dur": 5,
-            "frecuencias": [(660, 100), (850, 100)],
-            "descripcion": "Estimulación mitocondrial hormonal.",
-            "sintomas": "Optimización hormonal.",
-            "posicion": "Directo a zona testicular.",
-            "tips_ant": ["Limpio"], "tips_des": ["Ducha fría"],
-            "visual_group": "MORNING"
-        },
-        "Sueño": {
-            "ondas": "Solo ROJO", "energia": "Rojo: 30% | NIR: 0%", 
-            "hz": "CW (Continuo)", "dist": ">1 Metro", "dur": 20,
-            "frecuencias": [(630, 30), (660, 30), (810, 0), (830, 0), (850, 0)],
-            "descripcion": "Luz ambiente tenue para melatonina.",
-            "sintomas": "Insomnio, dificultad para desconectar.",
-            "posicion": "Panel lejos, luz indirecta contra pared.",
-            "tips_ant": ["Oscuridad"], "tips_des": ["Dormir"],
-            "visual_group": "NIGHT"
-        }
-    }
-}
-
-# ==============================================================================
-# 3. CLASES Y MODELO DE DATOS
-# ==============================================================================
-class Tratamiento:
-    def __init__(self, id_t, nombre, zona, ondas_txt, config_energia, herzios, distancia, duracion, max_diario, max_semanal, tipo, tags_entreno, default_visual_group, momento_ideal_txt, momentos_prohibidos, tips_antes, tips_despues, incompatible_with=None, fases_config=None, es_custom=False, patologia="", lado_txt="", frecuencias=None, descripcion="", sintomas="", posicion=""):
-        self.id = id_t
-        self.nombre = nombre
-        self.zona = zona
-        self.ondas_txt = ondas_txt          
-        self.config_energia = config_energia 
-        self.herzios = herzios              
-        self.distancia = distancia
-        self.duracion = duracion
-        self.max_diario = max_diario
-        self.max_semanal = max_semanal
-        self.tipo = tipo
-        self.tags_entreno = tags_entreno 
-        self.default_visual_group = default_visual_group 
-        self.momento_ideal_txt = momento_ideal_txt
-        self.momentos_prohibidos = momentos_prohibidos 
-        self.tips_antes = tips_antes
-        self.tips_despues = tips_despues
-        self.incompatible_with = incompatible_with if incompatible_with else []
-        self.fases_config = fases_config if fases_config else []
-        self.es_custom = es_custom
-        self.patologia = patologia
-        self.lado_txt = lado_txt
-        self.frecuencias = frecuencias if frecuencias else []
-        self.descripcion = descripcion
-        self.sintomas = sintomas
-        self.posicion = posicion
-
-    def set_incompatibilidades(self, texto):
-        self.incompatibilidades = texto
-        return self
-
-# --- GENERADOR DE CATÁLOGO ---
-def obtener_catalogo(tratamientos_custom=[], db_usuario=None):
-    fases_lesion = [{"nombre": "🔥 Fase 1: Inflamatoria", "dias_fin": 7}, {"nombre": "🛠️ Fase 2: Proliferación", "dias_fin": 21}, {"nombre": "🧱 Fase 3: Remodelación", "dias_fin": 60}]
-    catalogo = []
-    ids_procesados = set()
-    ocultos = set()
-    if db_usuario:
-        ocultos = set(db_usuario.get("tratamientos_ocultos", []))
-
-    # 1. Custom
-    for c in tratamientos_custom:
-        if c['id'] in ocultos: continue
-        catalogo.append(Tratamiento(
-            c['id'], c['nombre'], c['zona'], c['ondas'], c['energia'], c['hz'], c['dist'], c['dur'], 
-            1, 7, c['tipo'], ['All'], "FLEX", "Personalizado", [], c['tips_ant'], c['tips_des'], 
-            fases_config=c.get('fases', []), es_custom=True,
-            patologia=c['nombre'], lado_txt="Custom", frecuencias=c.get('frecuencias', []), 
-            descripcion=c.get('descripcion', ''), sintomas=c.get('sintomas', ''), posicion=c.get('posicion', '')
-        ))
-        ids_procesados.add(c['id'])
-
-    # 2. Base
-    for zona, patologias in DB_TRATAMIENTOS_BASE.items():
-        for patologia, specs in patologias.items():
-            freqs = specs.get("frecuencias", [(660, 50), (850, 100)])
-            desc = specs.get("descripcion", "")
-            sint = specs.get("sintomas", "")
-            pos = specs.get("posicion", "")
-            v_group = specs.get("visual_group", "FLEX")
-            req_tags = specs.get("req_tags", ['All'])
-            momento_txt = specs.get("momento_txt", "Flexible")
-            
-            lados_a_generar = [("g", "General")] 
-            if zona in ZONAS_SIMETRICAS:
-                lados_a_generar = [("d", "Derecho"), ("i", "Izquierdo")]
-            elif zona == "Abdomen": 
-                if "Frontal" in patologia: lados_a_generar = [("f", "Frontal")]
-            
-            if zona == "Grasa/Estética" and "Grasa Localizada" in patologia:
-                pass 
-            else:
-                for codigo, nombre_lado in lados_a_generar:
-                    base_id = f"{zona[:3]}_{patologia[:4]}_{codigo}".lower().replace(" ", "")
-                    id_t = "".join(ch for ch in base_id if ch.isalnum() or ch=="_")
-                    
-                    if id_t in ocultos: continue
-
-                    nombre_final = f"{zona} {nombre_lado} ({patologia})" if nombre_lado != "General" else f"{zona} ({patologia})"
-                    if id_t not in ids_procesados:
-                        catalogo.append(Tratamiento(
-                            id_t, nombre_final, zona, specs["ondas"], specs["energia"], specs["hz"], specs["dist"], specs["dur"], 
-                            1, 7, "LESION", req_tags, v_group, momento_txt, [], specs.get("tips_ant", []), specs.get("tips_des", []), fases_config=fases_lesion,
-                            patologia=patologia, lado_txt=nombre_lado, frecuencias=freqs, descripcion=desc, sintomas=sint, posicion=pos
-                        ))
-
-    # 3. Inyectar estáticos históricos de Grasa
-    s = DB_TRATAMIENTOS_BASE["Grasa/Estética"]["Grasa Localizada"]
-    for sufijo, nombre, lado in [("front", "Frontal", "Frontal"), ("d", "Flanco D", "Flanco Dcho"), ("i", "Flanco I", "Flanco Izq"), ("glutes", "Glúteos", "General")]:
-        id_t = f"fat_{sufijo}"
-        if id_t in ocultos: continue
-        if id_t not in ids_procesados:
-            catalogo.append(Tratamiento(id_t, f"Grasa {nombre}", "Abdomen", s["ondas"], s["energia"], s["hz"], s["dist"], s["dur"], 1, 7, "GRASA", ["Active"], "PRE", "Pre-Entreno", ["🌙 Noche"], s["tips_ant"], s["tips_des"], patologia="Grasa Localizada", lado_txt=lado, frecuencias=s.get("frecuencias"), descripcion=s.get("descripcion"), sintomas=s.get("sintomas"), posicion=s.get("posicion")))
-
-    # 4. Inyectar facial y permanentes
-    f = DB_TRATAMIENTOS_BASE["Grasa/Estética"]["Facial"]
-    if "face" not in ids_procesados and "face" not in ocultos:
-        catalogo.append(Tratamiento("face", "Facial Rejuv", "Cara", f["ondas"], f["energia"], f["hz"], f["dist"], f["dur"], 1, 7, "PERMANENTE", ['All'], f["visual_group"], f.get("momento_txt", "Cualquier hora"), ["🏋️ Entrenamiento (Pre)"], f["tips_ant"], f["tips_des"], patologia="Facial", lado_txt="General", frecuencias=f.get("frecuencias"), descripcion=f.get("descripcion"), sintomas=f.get("sintomas"), posicion=f.get("posicion")))
-    
-    for k, v in DB_TRATAMIENTOS_BASE["Permanente"].items():
-        id_t = k.lower()
-        if id_t not in ids_procesados and id_t not in ocultos:
-            catalogo.append(Tratamiento(id_t, k, "Cuerpo", v["ondas"], v["energia"], v["hz"], v["dist"], v["dur"], 1, 7, "PERMANENTE", ['All'], v["visual_group"], v.get("momento_txt","FLEX"), [], v["tips_ant"], v["tips_des"], patologia=k, lado_txt="Único", frecuencias=v.get("frecuencias"), descripcion=v.get("descripcion"), sintomas=v.get("sintomas"), posicion=v.get("posicion")))
-
-    return catalogo
-
 # ==============================================================================
 # 4. GESTIÓN DE DATOS Y PERSISTENCIA
 # ==============================================================================
+def obtener_almacen():
+    return persistencia.abrir(BACKEND_DATOS, ARCHIVO_DATOS, ARCHIVO_SQLITE)
+
 def cargar_datos_completos():
-    default_db = {
-        "configuracion_rutina": {"semana": RUTINA_SEMANAL, "tags": TAGS_ACTIVIDADES},
-        "usuario_rutina": {"historial": {}, "meta_diaria": {}, "meta_cardio": {}, "ciclos_activos": {}, "descartados": {}, "planificados_adhoc": {}, "tratamientos_custom": [], "confirmaciones_diarias": {}, "tratamientos_ocultos": []}, 
-        "usuario_libre": {"historial": {}, "meta_diaria": {}, "meta_cardio": {}, "ciclos_activos": {}, "descartados": {}, "planificados_adhoc": {}, "tratamientos_custom": [], "confirmaciones_diarias": {}, "tratamientos_ocultos": []}
-    }
-    if not os.path.exists(ARCHIVO_DATOS): return default_db
-    try:
-        with open(ARCHIVO_DATOS, 'r') as f:
-            datos = json.load(f)
-            if "configuracion_rutina" not in datos: datos["configuracion_rutina"] = default_db["configuracion_rutina"]
-            for user in ["usuario_rutina", "usuario_libre"]:
-                if user not in datos: datos[user] = default_db[user]
-                if "meta_cardio" not in datos[user]: datos[user]["meta_cardio"] = {}
-                if "planificados_adhoc" not in datos[user]: datos[user]["planificados_adhoc"] = {}
-                if "tratamientos_custom" not in datos[user]: datos[user]["tratamientos_custom"] = []
-                if "confirmaciones_diarias" not in datos[user]: datos[user]["confirmaciones_diarias"] = {}
-                if "tratamientos_ocultos" not in datos[user]: datos[user]["tratamientos_ocultos"] = []
-            return datos
-    except: return default_db
+    return persistencia.cargar(obtener_almacen())
 
 def guardar_datos_completos(datos):
-    with open(ARCHIVO_DATOS, 'w') as f:
-        json.dump(datos, f, indent=4)
-
-def obtener_rutina_completa(fecha_obj, db_global, db_usuario):
-    fecha_iso = fecha_obj.isoformat()
-    dia_str = str(fecha_obj.weekday())
-    rutina_manual = db_usuario.get("meta_diaria", {}).get(fecha_iso, None)
-    config_semana = db_global.get("configuracion_rutina", {}).get("semana", RUTINA_SEMANAL)
-    config_tags = db_global.get("configuracion_rutina", {}).get("tags", TAGS_ACTIVIDADES)
-    rutina_fuerza = rutina_manual if rutina_manual is not None else config_semana.get(dia_str, [])
-    es_manual_f = (rutina_manual is not None)
-    cardio_manual = db_usuario.get("meta_cardio", {}).get(fecha_iso, None)
-    if cardio_manual:
-        rutina_cardio = cardio_manual; es_manual_c = True
-    else:
-        rutina_cardio = CARDIO_DEFAULTS_BY_DAY.get(dia_str, {"actividad": "Descanso Cardio"})
-        es_manual_c = False
-    tags = set(['All'])
-    for r in rutina_fuerza:
-        if r in config_tags: tags.update(config_tags[r])
-    act = rutina_cardio.get("actividad", "Descanso Cardio")
-    if act in TAGS_ACTIVIDADES: tags.update(TAGS_ACTIVIDADES[act])
-    # Devuelve lista completa de posibles rutinas para el selector
-    todas_rutinas = list(config_tags.keys())
-    return rutina_fuerza, rutina_cardio, tags, es_manual_f, es_manual_c, todas_rutinas
-
-def procesar_excel_rutina(uploaded_file):
-    try:
-        df_sem = pd.read_excel(uploaded_file, sheet_name='Semana')
-        mapa = {"lunes":"0", "martes":"1", "miércoles":"2", "miercoles":"2", "jueves":"3", "viernes":"4", "sábado":"5", "sabado":"5", "domingo":"6"}
-        nueva_semana = {}
-        for _, row in df_sem.iterrows():
-            d = str(row.iloc[0]).lower().strip()
-            if d in mapa: nueva_semana[mapa[d]] = [x.strip() for x in str(row.iloc[1]).split(',')]
-        return {"semana": nueva_semana, "tags": TAGS_ACTIVIDADES}
-    except: return None
-
-# --- 5. LÓGICA AI (GEMINI) ---
-def consultar_ia(dolencia):
+    obtener_almacen().guardar(datos)
+
+@st.cache_resource
+def datos_compartidos():
+    # Un solo árbol por proceso para todas las sesiones (se recarga si otro proceso escribe)
+    return almacen.DatosCompartidos(obtener_almacen(), cargar_datos_completos)
+
+def mutar(*ops):
+    # Aplica los cambios en memoria y persiste solo esas operaciones
+    datos_compartidos().aplicar(ops)
+
+@st.cache_resource
+def indices_historial():
+    # Fechas ordenadas y días por tratamiento, al día con cada mutar()
+    return IndicesHistorial(datos_compartidos())
+
+@st.cache_resource
+def versiones_catalogo():
+    # Los fragmentos reciben la versión del catálogo y lo reutilizan mientras no cambie
+    return VersionesCatalogo(datos_compartidos())
+
+@st.cache_resource
+def resumenes_historial():
+    # Sesiones, adherencia y descartados por día/semana/mes, al día con cada mutar()
+    return ResumenesHistorial(datos_compartidos())
+
+@st.cache_resource
+def trabajos():
+    # Pool de trabajos en segundo plano del proceso, compartido por todas las sesiones
+    return Ejecutor()
+
+@st.cache_resource
+def analitica():
+    # Tablas de pandas del historial completo; se rehacen tras el siguiente mutar()
+    from nucleo.analitica import Analitica
+    return Analitica(datos_compartidos())
+
+# --- 5. LÓGICA AI (GEMINI): ver nucleo/ia.py ---
+@st.cache_resource
+def cache_ia():
+    return CacheIA(ARCHIVO_CACHE_IA)
+
+@st.cache_resource
+def buscador_catalogo(clave_usuario):
+    # Índice BM25 del catálogo del usuario; se pone al día con cada catálogo nuevo
+    return BuscadorCatalogo()
+
+def cliente_ia():
     api_key = None
     try: api_key = st.secrets["GEMINI_API_KEY"]
     except: pass
     if not api_key and 'api_key_val' in st.session_state: api_key = st.session_state.api_key_val
-    if not api_key: return None
-
-    genai.configure(api_key=api_key)
-    
-    prompt = f"""
-    Actúa como experto en Fotobiomodulación. Usuario: "{dolencia}".
-    Genera una LISTA de posibles tratamientos en formato JSON Array.
-    Cada objeto debe tener:
-    {{
-        "nombre": "Título",
-        "zona": "Parte cuerpo",
-        "descripcion": "Qué hace biológicamente (max 20 palabras)",
-        "sintomas": "Síntomas que confirma (max 20 palabras)",
-        "posicion": "Cómo poner el panel y el cuerpo (max 20 palabras)",
-        "ondas": "660+850",
-        "energia": "Texto resumen",
-        "frecuencias": [[660, 50], [850, 100]],
-        "hz": "Texto Hz",
-        "dist": "Texto dist",
-        "dur": 10,
-        "tips_ant": ["Tip 1"],
-        "tips_des": ["Tip 1"],
-        "es_lesion": true,
-        "tipo": "LESION"
-    }}
-    Devuelve un JSON Array con 1 a 3 opciones.
-    """
-    
-    modelos = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-1.5-flash']
-    for m in modelos:
-        try:
-            model = genai.GenerativeModel(m)
-            response = model.generate_content(prompt)
-            clean = response.text.replace("```json", "").replace("```", "").strip()
-            data = json.loads(clean)
-            if isinstance(data, dict): data = [data]
-            return data
-        except: continue
-    return None
+    return ia.ClienteGemini(api_key) if api_key else None
 
 # --- 6. HELPERS VISUALES ---
+VISUALIZADORES_EN_CACHE = 256
+
+@functools.lru_cache(maxsize=VISUALIZADORES_EN_CACHE)
+def html_visualizador(frecuencias):
+    # Un único bloque HTML por configuración distinta de ondas (son pocas y se repiten mucho)
+    celdas = []
+    for nm, pct in frecuencias:
+        bg, border, txt = ("#ffebee", "#ef5350", "#b71c1c") if pct >= 80 else ("#f5f5f5", "#bdbdbd", "#616161")
+        celdas.append(f"""<div style="flex:1;background-color:{bg};border:1px solid {border};border-radius:5px;padding:5px;text-align:center;font-size:12px;color:{txt};font-weight:bold;">{nm}nm<br>{pct}%</div>""")
+    return f"""<div style="font-size:14px;color:rgba(49,51,63,0.6);margin-bottom:0.5rem;">Configuración Panel:</div><div style="display:flex;gap:1rem;margin-bottom:1rem;">{"".join(celdas)}</div>"""
+
 def mostrar_visualizador_mega(t):
     if not t.frecuencias: return
-    st.caption("Configuración Panel:")
-    cols = st.columns(len(t.frecuencias))
-    for idx, (nm, pct) in enumerate(t.frecuencias):
-        bg = "#ffebee" if pct >= 80 else "#f5f5f5"
-        border = "#ef5350" if pct >= 80 else "#bdbdbd"
-        txt = "#b71c1c" if pct >= 80 else "#616161"
-        cols[idx].markdown(f"""<div style="background-color:{bg};border:1px solid {border};border-radius:5px;padding:5px;text-align:center;font-size:12px;color:{txt};font-weight:bold;">{nm}nm<br>{pct}%</div>""", unsafe_allow_html=True)
+    st.markdown(html_visualizador(t.frecuencias), unsafe_allow_html=True)
 
 def mostrar_ficha_tecnica(t, lista_completa):
     if t.descripcion: st.info(f"ℹ️ **Info:** {t.descripcion}")
@@ -621,30 +144,6 @@ def mostrar_ficha_tecnica(t, lista_completa):
             st.markdown("**Después:**")
             for tip in t.tips_despues: st.caption(f"• {tip}")
 
-def analizar_bloqueos(tratamiento, momento, historial, registros_hoy, fecha_str, tags_dia, clave_usuario):
-    if clave_usuario == "usuario_rutina":
-        if 'Active' in tratamiento.tags_entreno and 'Active' not in tags_dia: return True, "⚠️ FALTA ACTIVIDAD"
-    if momento in tratamiento.momentos_prohibidos: return True, "⛔ HORARIO PROHIBIDO"
-    dias_hechos = 0
-    fecha_dt = datetime.date.fromisoformat(fecha_str)
-    for i in range(7):
-        f = (fecha_dt - timedelta(days=i)).isoformat()
-        if f in historial and tratamiento.id in historial[f]: dias_hechos += 1
-    hecho_hoy = (fecha_str in historial and tratamiento.id in historial[fecha_str])
-    if not hecho_hoy and dias_hechos >= tratamiento.max_semanal: return True, "⛔ MAX SEMANAL"
-    for inc in tratamiento.incompatible_with:
-        if inc in registros_hoy: return True, "⛔ INCOMPATIBLE"
-    return False, ""
-
-def obtener_tratamientos_presentes(fecha_str, db_usuario, lista_tratamientos):
-    presentes = set()
-    presentes.update(db_usuario["historial"].get(fecha_str, {}).keys())
-    presentes.update(db_usuario["planificados_adhoc"].get(fecha_str, {}).keys())
-    for t in lista_tratamientos:
-        ciclo = db_usuario["ciclos_activos"].get(t.id)
-        if ciclo and ciclo.get('activo'): presentes.add(t.id)
-    return presentes
-
 # ==============================================================================
 # 7. UI PRINCIPAL Y LÓGICA DE AÑADIR MANUAL
 # ==============================================================================
@@ -663,10 +162,14 @@ def login_screen():
 
 if not st.session_state.logged_in: login_screen(); st.stop()
 
-if 'db_global' not in st.session_state: st.session_state.db_global = cargar_datos_completos()
+try: db_global = datos_compartidos().obtener()
+except almacen.ErrorAlmacen as e: st.error(f"⚠️ No se pueden leer los datos: {e}"); st.stop()
 clave_usuario = st.session_state.current_user_role
-db_usuario = st.session_state.db_global[clave_usuario]
-lista_tratamientos = obtener_catalogo(db_usuario.get("tratamientos_custom", []), db_usuario)
+db_usuario = db_global[clave_usuario]
+for c in obtener_almacen().tomar_conflictos(clave_usuario):
+    st.warning(f"⚠️ Otra sesión cambió {' › '.join(map(str, c['ruta'][1:]))} a la vez; se ha mantenido su versión.")
+version_catalogo = versiones_catalogo()[clave_usuario]  # antes del catálogo: si cambia entre medias, se recalcula
+lista_tratamientos = catalogo_usuario(db_usuario)
 
 with st.sidebar:
     st.write(f"Hola, **{st.session_state.current_user_name}**")
@@ -679,24 +182,26 @@ with st.sidebar:
             if api_key: st.session_state.api_key_val = api_key
     st.divider()
     if st.button("💾 Guardar Todo"):
-        guardar_datos_completos(st.session_state.db_global); st.success("Guardado.")
-    if st.button("Cerrar Sesión"): st.session_state.logged_in = False; st.rerun()
+        try: obtener_almacen().compactar(); st.success("Guardado.")
+        except almacen.ErrorAlmacen as e: st.error(str(e))
+    if st.button("Cerrar Sesión"):
+        obtener_almacen().vaciar()
+        st.session_state.logged_in = False; st.rerun()
 
 # --- FUNCIÓN MAESTRA DE AÑADIR ---
 def renderizar_seccion_anadir_manual(fecha_obj, db, lista_treats, key_suffix):
     fecha_str = fecha_obj.isoformat()
     with st.expander("➕ Añadir Tratamiento (Planificar)"):
         c1, c2 = st.columns(2)
-        zonas = sorted(list(set(t.zona for t in lista_treats)))
-        z_sel = c1.selectbox("1. Zona:", ["--"] + zonas, key=f"z_{key_suffix}")
+        z_sel = c1.selectbox("1. Zona:", ["--"] + lista_treats.zonas, key=f"z_{key_suffix}")
         
         t_obj = None
         if z_sel != "--":
-            pats = sorted(list(set(t.patologia for t in lista_treats if t.zona == z_sel)))
+            pats = lista_treats.patologias.get(z_sel, [])
             p_sel = c2.selectbox("2. Tratamiento:", ["--"] + pats, key=f"p_{key_suffix}")
             
             if p_sel != "--":
-                vars_objs = [t for t in lista_treats if t.zona == z_sel and t.patologia == p_sel]
+                vars_objs = lista_treats.variantes(z_sel, p_sel)
                 v_sel = st.selectbox("3. Lado/Variante:", [t.nombre for t in vars_objs], key=f"v_{key_suffix}")
                 t_obj = next((t for t in vars_objs if t.nombre == v_sel), None)
 
@@ -706,7 +211,7 @@ def renderizar_seccion_anadir_manual(fecha_obj, db, lista_treats, key_suffix):
             if adhoc:
                 nombres = []
                 for tid in adhoc:
-                    tr = next((x for x in lista_treats if x.id == tid), None)
+                    tr = lista_treats.get(tid)
                     if tr: nombres.append(tr.nombre)
                 st.caption(f"📅 Ya planificado para hoy: {', '.join(nombres)}")
             
@@ -714,27 +219,107 @@ def renderizar_seccion_anadir_manual(fecha_obj, db, lista_treats, key_suffix):
             if t_obj.sintomas: ci.info(f"**Síntomas:** {t_obj.sintomas}")
             if t_obj.posicion: cp.warning(f"**Posición:** {t_obj.posicion}")
             
-            opts = ["🏋️ Entrenamiento (Pre)", "🚿 Post-Entreno / Mañana", "⛅ Tarde", "🌙 Noche"]
+            opts = list(MOMENTOS)
             valid = [o for o in opts if o not in t_obj.momentos_prohibidos]
             momento = st.selectbox("4. Momento Ideal:", valid, key=f"mom_{key_suffix}")
             
             if st.button("Añadir a la Agenda", key=f"add_{key_suffix}", type="primary"):
-                if "planificados_adhoc" not in db: db["planificados_adhoc"] = {}
-                if fecha_str not in db["planificados_adhoc"]: db["planificados_adhoc"][fecha_str] = {}
+                codigo_momento = MOMENTOS.get(momento, "FLEX")
                 
-                mapa_momento = {"🏋️ Entrenamiento (Pre)": "PRE", "🚿 Post-Entreno / Mañana": "POST", "⛅ Tarde": "FLEX", "🌙 Noche": "NIGHT"}
-                codigo_momento = mapa_momento.get(momento, "FLEX")
-                
-                db["planificados_adhoc"][fecha_str][t_obj.id] = codigo_momento
-                guardar_datos_completos(st.session_state.db_global)
+                mutar(op_fijar([clave_usuario, "planificados_adhoc", fecha_str, t_obj.id], codigo_momento))
                 st.success(f"Añadido: {t_obj.nombre} ({momento})")
                 st.rerun()
 
 # --- VISTAS ---
-def renderizar_dia_completo(fecha_obj):
-    fecha_str = fecha_obj.isoformat()
-    rutina_fuerza, rutina_cardio, tags_dia, man_f, man_c, todas_rutinas = obtener_rutina_completa(fecha_obj, st.session_state.db_global, db_usuario)
-    confirmado = db_usuario.get("confirmaciones_diarias", {}).get(fecha_str, False)
+TARJETAS_POR_PAGINA = 15
+
+def paginar(items, clave, por_pagina=TARJETAS_POR_PAGINA):
+    # Grupos largos: solo se envían al navegador las tarjetas de la página elegida
+    if len(items) <= por_pagina: return items
+    paginas = -(-len(items) // por_pagina)
+    k = f"pag_{clave}"
+    if st.session_state.get(k, 1) > paginas: st.session_state[k] = paginas  # el grupo ha encogido
+    pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1, key=k)
+    return items[(pagina - 1) * por_pagina:pagina * por_pagina]
+
+def planificar(fechas, catalogo=None):
+    # Lee el árbol vivo (no los globales del último rerun completo): un fragmento puede llamarla después
+    compartidos = datos_compartidos()
+    datos = compartidos.obtener()
+    version = compartidos.version
+    db_u = datos[clave_usuario]
+    # El historial perezoso basta para una semana (solo se leen sus meses); el índice completo es para el Historial
+    return planificar_semana(fechas, datos, db_u, catalogo or catalogo_usuario(db_u), db_u["historial"], clave_usuario, st.session_state, version)
+
+def repintar():
+    # Vuelve a ejecutar solo el fragmento en curso; si la acción llegó en una ejecución completa, todo
+    try: st.rerun(scope="fragment")
+    except st.errors.StreamlitAPIException: st.rerun()
+
+def vigente(plan, version_cat):
+    # Un fragmento se reejecuta con los argumentos de la última ejecución completa;
+    # su catálogo sigue valiendo si no han cambiado los personalizados ni los ocultos
+    if plan.version == datos_compartidos().version: return plan
+    catalogo = lista_tratamientos if versiones_catalogo()[clave_usuario] == version_cat else None
+    return planificar([plan.fecha], catalogo)[0]
+
+# --- TRABAJOS EN SEGUNDO PLANO (IA, exportaciones, resúmenes) ---
+def cerrar_resultado(futuro):
+    # Un trabajo descartado que aun así llega a terminar deja un temporal que nadie recoge
+    if not futuro.cancelled() and futuro.exception() is None: futuro.result().close()
+
+AL_DESCARTAR = {"exportacion": cerrar_resultado}
+
+def cancelar_trabajo(clave):
+    trabajo = trabajos().obtener(st.session_state.get("trabajos", {}).pop(clave, None))
+    if trabajo is None: return
+    trabajos().cancelar(trabajo.id)
+    if clave in AL_DESCARTAR: trabajo.futuro.add_done_callback(AL_DESCARTAR[clave])
+
+def soltar_exportacion():
+    # El archivo listo para descargar se sustituye por otro: el temporal se borra al cerrarlo
+    anterior = st.session_state.pop("exp_listo", None)
+    if anterior: anterior[0].close()
+
+def calcular_resumenes(clave):
+    # Trabajo en segundo plano: la primera construcción recorre todo el historial del usuario
+    return resumenes_historial()[clave]
+
+def lanzar_trabajo(clave, descripcion, fn, *args):
+    # Uno por clave y sesión: lanzar otro cancela el anterior
+    ids = st.session_state.setdefault("trabajos", {})
+    cancelar_trabajo(clave)
+    try: ids[clave] = trabajos().lanzar(descripcion, fn, *args).id
+    except ErrorTrabajos as e: st.error(str(e))
+
+def recoger_trabajo(clave, espera=0):
+    # -> Trabajo de la sesión para `clave` o None; si ha terminado (tras esperar como mucho
+    # `espera` segundos) se retira, así que el resultado se entrega una sola vez
+    ids = st.session_state.get("trabajos", {})
+    trabajo = trabajos().obtener(ids[clave]) if clave in ids else None
+    if trabajo is not None and espera: trabajo.esperar(espera)
+    if trabajo is None or trabajo.terminado:
+        ids.pop(clave, None)
+        if trabajo is not None: trabajos().retirar(trabajo.id)
+    return trabajo
+
+@st.fragment(run_every=1.0)
+def vigilar_trabajo(clave, cancelable=True):
+    # Solo esto se repinta cada segundo; al terminar, una ejecución completa recoge el resultado
+    ids = st.session_state.get("trabajos", {})
+    trabajo = trabajos().obtener(ids[clave]) if clave in ids else None
+    if trabajo is None or trabajo.terminado: st.rerun()
+    c1, c2 = st.columns([4, 1])
+    c1.info(f"⏳ {trabajo.descripcion} ({trabajo.estado}, {trabajo.segundos:.0f} s)")
+    if cancelable and c2.button("Cancelar", key=f"cancelar_{clave}"):
+        cancelar_trabajo(clave); st.rerun()
+
+@st.fragment
+def renderizar_dia_completo(plan, version_cat):
+    # Fragmento: la rutina y "Registrar Todo" solo repintan este día
+    plan = vigente(plan, version_cat)
+    fecha_obj, fecha_str = plan.fecha, plan.fecha_str
+    rutina_fuerza, rutina_cardio, todas_rutinas, confirmado = plan.rutina_fuerza, plan.rutina_cardio, plan.todas_rutinas, plan.confirmado
 
     if clave_usuario == "usuario_rutina":
         if not confirmado:
@@ -744,8 +329,7 @@ def renderizar_dia_completo(fecha_obj):
                 # Mostrar TODAS las rutinas disponibles en el multiselect para permitir cambios
                 sel_f = st.multiselect("Rutina:", todas_rutinas, default=[x for x in rutina_fuerza if x in todas_rutinas], key=f"sf_{fecha_str}")
                 if set(sel_f) != set(rutina_fuerza):
-                    if "meta_diaria" not in db_usuario: db_usuario["meta_diaria"] = {}
-                    db_usuario["meta_diaria"][fecha_str] = sel_f
+                    mutar(op_fijar([clave_usuario, "meta_diaria", fecha_str], sel_f))
             with c2:
                 st.markdown("**🏃 Cardio**")
                 idx = list(GENERIC_CARDIO_PARAMS.keys()).index(rutina_cardio.get("actividad", "Descanso Cardio")) if rutina_cardio.get("actividad") in GENERIC_CARDIO_PARAMS else 0
@@ -759,165 +343,159 @@ def renderizar_dia_completo(fecha_obj):
                     if "inclinacion" in GENERIC_CARDIO_PARAMS.get(sel_c, {}):
                         params["inclinacion"] = cp2.number_input("Inc %:", value=float(params.get("inclinacion", 0.0)), step=0.5, format="%.1f", key=f"i_{fecha_str}")
                 if params != rutina_cardio:
-                    if "meta_cardio" not in db_usuario: db_usuario["meta_cardio"] = {}
-                    db_usuario["meta_cardio"][fecha_str] = params
-                    guardar_datos_completos(st.session_state.db_global); st.rerun()
+                    mutar(op_fijar([clave_usuario, "meta_cardio", fecha_str], params)); repintar()
             
             if st.button("✅ Confirmar Rutina", key=f"bc_{fecha_str}", type="primary", use_container_width=True):
-                if "confirmaciones_diarias" not in db_usuario: db_usuario["confirmaciones_diarias"] = {}
-                db_usuario["confirmaciones_diarias"][fecha_str] = True
-                guardar_datos_completos(st.session_state.db_global); st.rerun()
+                mutar(op_fijar([clave_usuario, "confirmaciones_diarias", fecha_str], True)); repintar()
         else:
             st.success(f"Rutina: {', '.join(rutina_fuerza)} | {rutina_cardio.get('actividad')}")
             if st.button("✏️ Editar", key=f"ed_{fecha_str}"): 
-                db_usuario["confirmaciones_diarias"][fecha_str] = False; guardar_datos_completos(st.session_state.db_global); st.rerun()
+                mutar(op_fijar([clave_usuario, "confirmaciones_diarias", fecha_str], False)); repintar()
 
     st.divider()
     
     if confirmado or clave_usuario == "usuario_libre":
         renderizar_seccion_anadir_manual(fecha_obj, db_usuario, lista_tratamientos, f"day_{fecha_str}")
 
-    adhoc = db_usuario.get("planificados_adhoc", {}).get(fecha_str, {})
-    presentes = obtener_tratamientos_presentes(fecha_str, db_usuario, lista_tratamientos)
-    registros = db_usuario["historial"].get(fecha_str, {})
-    descartados = db_usuario.get("descartados", {}).get(fecha_str, [])
-    
-    to_show = []
-    for t in lista_tratamientos:
-        if t.id in adhoc or t.id in registros: to_show.append((t, "adhoc"))
-        else:
-            ciclo = db_usuario.get("ciclos_activos", {}).get(t.id)
-            if ciclo and ciclo['activo']: to_show.append((t, "clinica"))
+    to_show, grupos, registros = plan.to_show, plan.grupos, plan.registros
     
     if to_show and st.button("⚡ Registrar Todo lo Planificado", key=f"all_{fecha_str}"):
         now = datetime.datetime.now().strftime('%H:%M')
-        if fecha_str not in db_usuario["historial"]: db_usuario["historial"][fecha_str] = {}
-        for t, origen in to_show:
-            if t.id not in db_usuario["historial"][fecha_str]:
-                db_usuario["historial"][fecha_str][t.id] = []
-                db_usuario["historial"][fecha_str][t.id].append({"hora": now, "detalle": "Batch"})
-        guardar_datos_completos(st.session_state.db_global); st.rerun()
-
-    grupos = {"PRE": [], "POST": [], "MORNING": [], "NIGHT": [], "FLEX": [], "COMPLETED": [], "DISCARDED": [], "HIDDEN": []}
-    mapa_vis = {"PRE": "🏋️ Entrenamiento (Pre)", "POST": "🚿 Post-Entreno / Mañana", "MORNING": "🌞 Mañana", "NIGHT": "🌙 Noche", "FLEX": "Flexible"}
-    
-    for t, origen in to_show:
-        hechos = len(registros.get(t.id, []))
-        if t.id in descartados: grupos["DISCARDED"].append((t, origen))
-        elif hechos >= t.max_diario: grupos["COMPLETED"].append((t, origen))
-        else:
-            planned_code = adhoc.get(t.id, "FLEX")
-            rad_key = f"rad_{t.id}_{fecha_str}"
-            if rad_key in st.session_state:
-                val = st.session_state[rad_key]
-                if "Pre" in val: g = "PRE"
-                elif "Post" in val: g = "POST"
-                elif "Noche" in val: g = "NIGHT"
-                else: g = "FLEX"
-            else:
-                g = planned_code if planned_code in grupos else t.default_visual_group
-            
-            if g in grupos: grupos[g].append((t, origen))
-            else: grupos["FLEX"].append((t, origen))
-
-    def render_card(item):
-        t, origen = item
-        hechos = len(registros.get(t.id, []))
-        icon = "❌" if t.id in descartados else ("✅" if hechos>=t.max_diario else "⬜")
-        info_ex = f" [CLÍNICA]" if origen == "clinica" else (" [PUNTUAL]" if origen == "adhoc" else "")
-        head_xtra = f" | {registros[t.id][-1]['detalle']}" if hechos >= t.max_diario else ""
-        
-        with st.expander(f"{icon} {t.nombre} ({hechos}/{t.max_diario}){info_ex}{head_xtra}"):
-            if t.id in descartados:
-                mostrar_ficha_tecnica(t, lista_tratamientos)
-                if st.button("Recuperar", key=f"rec_{t.id}_{fecha_str}"):
-                    db_usuario["descartados"][fecha_str].remove(t.id)
-                    guardar_datos_completos(st.session_state.db_global); st.rerun()
-                return
-            if hechos >= t.max_diario:
-                st.success("✅ Completado")
-                if st.button("❌ Deshacer", key=f"undo_{t.id}_{fecha_str}"):
-                    del db_usuario["historial"][fecha_str][t.id]
-                    guardar_datos_completos(st.session_state.db_global); st.rerun()
-                return
-            
-            st.success(f"💡 {t.momento_ideal_txt}")
-            mostrar_ficha_tecnica(t, lista_tratamientos)
-            
-            opts = ["🏋️ Entrenamiento (Pre)", "🚿 Post-Entreno / Mañana", "⛅ Tarde", "🌙 Noche"]
-            valid = [o for o in opts if o not in t.momentos_prohibidos]
-            
-            planned = adhoc.get(t.id, "FLEX")
-            idx = 0
-            if planned == "PRE" and len(valid)>0: idx = 0
-            elif planned == "POST" and len(valid)>1: idx = 1
-            elif planned == "NIGHT" and len(valid)>3: idx = 3
-            
-            sel = st.radio("Momento:", valid, index=min(idx, len(valid)-1), key=f"rad_{t.id}_{fecha_str}")
-            
-            c1, c2, c3 = st.columns([2,1,1])
-            bloq, mot = analizar_bloqueos(t, sel, db_usuario["historial"], registros, fecha_str, tags_dia, clave_usuario)
-            if bloq: c1.warning(mot)
-            
-            if c1.button("Registrar", key=f"go_{t.id}_{fecha_str}", disabled=bloq):
-                now = datetime.datetime.now().strftime('%H:%M')
-                if fecha_str not in db_usuario["historial"]: db_usuario["historial"][fecha_str] = {}
-                if t.id not in db_usuario["historial"][fecha_str]: db_usuario["historial"][fecha_str][t.id] = []
-                db_usuario["historial"][fecha_str][t.id].append({"hora": now, "detalle": sel})
-                guardar_datos_completos(st.session_state.db_global); st.rerun()
-            
-            if c2.button("Omitir", key=f"om_{t.id}_{fecha_str}"):
-                if "descartados" not in db_usuario: db_usuario["descartados"] = {}
-                if fecha_str not in db_usuario["descartados"]: db_usuario["descartados"][fecha_str] = []
-                db_usuario["descartados"][fecha_str].append(t.id)
-                guardar_datos_completos(st.session_state.db_global); st.rerun()
-            
-            if origen == "adhoc" and c3.button("🗑️ Quitar", key=f"del_{t.id}_{fecha_str}"):
-                del db_usuario["planificados_adhoc"][fecha_str][t.id]
-                guardar_datos_completos(st.session_state.db_global); st.rerun()
+        ops = [op_fijar([clave_usuario, "historial", fecha_str, t.id], [{"hora": now, "detalle": "Batch"}]) for t, origen in to_show if t.id not in registros]
+        if ops: mutar(*ops)
+        repintar()
 
     for g in ["MORNING", "PRE", "POST", "NIGHT", "FLEX"]:
         if grupos[g]:
             st.subheader(g)
-            for item in grupos[g]: render_card(item)
+            for t, origen in paginar(grupos[g], f"{g}_{fecha_str}"): render_card(plan, t, origen, g, version_cat)
     for g in ["COMPLETED", "DISCARDED"]:
         if grupos[g]:
             st.markdown(f"### {('✅ Completados' if g=='COMPLETED' else '❌ Descartados')}")
-            for item in grupos[g]: render_card(item)
+            for t, origen in paginar(grupos[g], f"{g}_{fecha_str}"): render_card(plan, t, origen, g, version_cat)
+
+@st.fragment
+def render_card(plan, t, origen, grupo, version_cat):
+    # Fragmento: una acción repinta solo esta tarjeta, salvo que la cambie de grupo
+    # (completada, omitida, quitada, otro momento); entonces hay que recolocar el día
+    plan = vigente(plan, version_cat)
+    if all(x.id != t.id for x, _ in plan.to_show) or grupo_de(plan, t, st.session_state) != grupo: st.rerun()
+    fecha_str = plan.fecha_str
+    adhoc, registros, descartados, bloqueos = plan.adhoc, plan.registros, plan.descartados, plan.bloqueos
+    hechos = len(registros.get(t.id, []))
+    icon = "❌" if t.id in descartados else ("✅" if hechos>=t.max_diario else "⬜")
+    info_ex = f" [CLÍNICA]" if origen == "clinica" else (" [PUNTUAL]" if origen == "adhoc" else "")
+    head_xtra = f" | {registros[t.id][-1].get('detalle', '')}" if hechos >= t.max_diario else ""
+    
+    # Plegada solo se envía la cabecera; la ficha y las acciones se construyen al abrirla
+    if not st.toggle(f"{icon} {t.nombre} ({hechos}/{t.max_diario}){info_ex}{head_xtra}", key=f"open_{t.id}_{fecha_str}"): return
+    with st.container(border=True):
+        if t.id in descartados:
+            mostrar_ficha_tecnica(t, lista_tratamientos)
+            if st.button("Recuperar", key=f"rec_{t.id}_{fecha_str}"):
+                mutar(op_quitar([clave_usuario, "descartados", fecha_str], t.id)); repintar()
+            return
+        if hechos >= t.max_diario:
+            st.success("✅ Completado")
+            if st.button("❌ Deshacer", key=f"undo_{t.id}_{fecha_str}"):
+                mutar(op_borrar([clave_usuario, "historial", fecha_str, t.id])); repintar()
+            return
+        
+        st.success(f"💡 {t.momento_ideal_txt}")
+        mostrar_ficha_tecnica(t, lista_tratamientos)
+        
+        opts = list(MOMENTOS)
+        valid = [o for o in opts if o not in t.momentos_prohibidos]
+        
+        planned = adhoc.get(t.id, "FLEX")
+        idx = 0
+        if planned == "PRE" and len(valid)>0: idx = 0
+        elif planned == "POST" and len(valid)>1: idx = 1
+        elif planned == "NIGHT" and len(valid)>3: idx = 3
+        
+        sel = st.radio("Momento:", valid, index=min(idx, len(valid)-1), key=f"rad_{t.id}_{fecha_str}")
+        
+        c1, c2, c3 = st.columns([2,1,1])
+        bloq, mot = bloqueos[(t.id, fecha_str, sel)]
+        if bloq: c1.warning(mot)
+        
+        if c1.button("Registrar", key=f"go_{t.id}_{fecha_str}", disabled=bloq):
+            now = datetime.datetime.now().strftime('%H:%M')
+            mutar(op_anadir([clave_usuario, "historial", fecha_str, t.id], {"hora": now, "detalle": sel})); repintar()
+        
+        if c2.button("Omitir", key=f"om_{t.id}_{fecha_str}"):
+            mutar(op_anadir([clave_usuario, "descartados", fecha_str], t.id)); repintar()
+        
+        if origen == "adhoc" and c3.button("🗑️ Quitar", key=f"del_{t.id}_{fecha_str}"):
+            mutar(op_borrar([clave_usuario, "planificados_adhoc", fecha_str, t.id])); repintar()
 
 
 if menu_navegacion == "📅 Panel Diario":
     st.title("📅 Panel Diario")
     c_f, c_r = st.columns([2,1])
     fecha_seleccionada = c_f.date_input("Fecha", datetime.date.today())
-    renderizar_dia_completo(fecha_seleccionada)
+    renderizar_dia_completo(planificar([fecha_seleccionada])[0], version_catalogo)
 
 elif menu_navegacion == "🗓️ Panel Semanal":
     st.title("🗓️ Panel Semanal")
     d_ref = st.date_input("Semana de:", datetime.date.today())
     start = d_ref - timedelta(days=d_ref.weekday())
+    semana = planificar([start + timedelta(days=i) for i in range(7)])
     
     tabs = st.tabs(["L", "M", "X", "J", "V", "S", "D"])
-    for i, tab in enumerate(tabs):
+    for plan, tab in zip(semana, tabs):
         with tab:
-            dia = start + timedelta(days=i)
-            st.subheader(dia.strftime("%A %d/%m"))
-            renderizar_dia_completo(dia)
+            st.subheader(plan.fecha.strftime("%A %d/%m"))
+            renderizar_dia_completo(plan, version_catalogo)
 
 elif menu_navegacion == "🔍 Buscador AI":
     st.title("🔍 Buscador & Generador AI")
-    if not HAS_GEMINI: st.error("Falta API Key"); st.stop()
     
     if 'ai_results' not in st.session_state: st.session_state.ai_results = []
     
     q = st.text_input("Describe dolencia:")
+    preguntar_ia = False
     if st.button("Buscar") and q:
-        with st.spinner("Generando opciones visuales..."):
-            res = consultar_ia(q)
-            if res: st.session_state.ai_results = res
+        # Primero el catálogo (en memoria, sin red); la IA solo si nada encaja
+        inicio = time.perf_counter()
+        encontrados = buscador_catalogo(clave_usuario).buscar(q, lista_tratamientos)
+        st.session_state.busqueda_local = (q, [t.id for t, _ in encontrados], time.perf_counter() - inicio)
+        st.session_state.ai_results = []
+        preguntar_ia = not encontrados
+
+    consulta, ids_locales, segundos = st.session_state.get("busqueda_local", (q, [], 0))
+    if ids_locales:
+        st.write(f"En tu catálogo ({segundos * 1000:.0f} ms):")
+        hoy = datetime.date.today().isoformat()
+        for t in filter(None, map(lista_tratamientos.get, ids_locales)):
+            with st.container(border=True):
+                st.markdown(f"**{t.nombre}** · {t.zona}")
+                if t.sintomas: st.caption(f"🩺 {t.sintomas}")
+                c1, c2 = st.columns(2)
+                ver = c1.toggle("Ver ficha", key=f"ficha_loc_{t.id}")
+                if c2.button("📅 Planificar Hoy", key=f"plan_loc_{t.id}"):
+                    mutar(op_fijar([clave_usuario, "planificados_adhoc", hoy, t.id], "FLEX")); st.success("Añadido a hoy!")
+                if ver: mostrar_ficha_tecnica(t, lista_tratamientos)
+        preguntar_ia = st.button("✨ Preguntar también a la IA") or preguntar_ia
+
+    if preguntar_ia:
+        if not HAS_GEMINI: st.error("Falta API Key")
+        # En segundo plano: el resto de la app sigue respondiendo mientras Gemini contesta
+        else: lanzar_trabajo("ia", "Generando opciones visuales", ia.consultar, cliente_ia(), consulta, cache_ia())
+    trabajo = recoger_trabajo("ia", espera=0.2 if preguntar_ia else 0)  # un acierto de caché llega sin esperar al sondeo
+    if trabajo is not None and not trabajo.terminado: vigilar_trabajo("ia")
+    elif trabajo is not None:
+        try:
+            res, desde_cache = trabajo.resultado()
+            if res: st.session_state.ai_results, st.session_state.ai_origen = res, (desde_cache, trabajo.segundos)
+            else: st.error("Falta API Key")
+        except ia.ErrorIA as e: st.error(f"Ningún modelo dio una respuesta válida: {e}")
+        except CancelledError: pass
     
     if st.session_state.ai_results:
         st.write(f"He encontrado {len(st.session_state.ai_results)} opciones:")
+        desde_cache, segundos = st.session_state.get("ai_origen", (False, 0))
+        st.caption(f"{'⚡ Desde la caché' if desde_cache else '✨ Generado por Gemini'} en {segundos * 1000:.0f} ms")
         for i, r in enumerate(st.session_state.ai_results):
             with st.container(border=True):
                 st.subheader(r['nombre'])
@@ -927,39 +505,43 @@ elif menu_navegacion == "🔍 Buscador AI":
                 c1, c2, c3 = st.columns(3)
                 if c1.button(f"💾 Guardar Disponibles", key=f"s_{i}"):
                     id_new = str(uuid.uuid4())[:8]; r['id'] = id_new
-                    db_usuario["tratamientos_custom"].append(r)
-                    guardar_datos_completos(st.session_state.db_global)
+                    mutar(op_anadir([clave_usuario, "tratamientos_custom"], r))
                     st.success("Guardado!"); st.rerun()
                 
                 if c2.button(f"📅 Planificar Hoy", key=f"p_{i}"):
                     id_new = str(uuid.uuid4())[:8]; r['id'] = id_new; r['tipo'] = 'PUNTUAL'
-                    db_usuario["tratamientos_custom"].append(r)
                     hoy = datetime.date.today().isoformat()
-                    if "planificados_adhoc" not in db_usuario: db_usuario["planificados_adhoc"] = {}
-                    if hoy not in db_usuario["planificados_adhoc"]: db_usuario["planificados_adhoc"][hoy] = {}
-                    db_usuario["planificados_adhoc"][hoy][id_new] = "FLEX"
-                    guardar_datos_completos(st.session_state.db_global)
+                    mutar(op_anadir([clave_usuario, "tratamientos_custom"], r),
+                          op_fijar([clave_usuario, "planificados_adhoc", hoy, id_new], "FLEX"))
                     st.success("Añadido a hoy!"); st.rerun()
                 
                 if c3.button(f"🚑 Empezar Clínica", key=f"c_{i}"):
                     id_new = str(uuid.uuid4())[:8]; r['id'] = id_new; r['tipo'] = 'LESION'
                     r['fases'] = [{"nombre": "Estándar", "dias_fin": 30}]
-                    db_usuario["tratamientos_custom"].append(r)
-                    if "ciclos_activos" not in db_usuario: db_usuario["ciclos_activos"] = {}
-                    db_usuario["ciclos_activos"][id_new] = {"fecha_inicio": datetime.date.today().isoformat(), "activo": True, "modo": "fases", "estado": "activo", "dias_saltados": []}
-                    guardar_datos_completos(st.session_state.db_global)
+                    ciclo_new = {"fecha_inicio": datetime.date.today().isoformat(), "activo": True, "modo": "fases", "estado": "activo", "dias_saltados": []}
+                    mutar(op_anadir([clave_usuario, "tratamientos_custom"], r),
+                          op_fijar([clave_usuario, "ciclos_activos", id_new], ciclo_new))
                     st.success("Clínica iniciada!"); st.rerun()
         
+    if st.session_state.ai_results or ids_locales:
         if st.button("Limpiar Búsqueda"):
-            st.session_state.ai_results = []
+            st.session_state.ai_results = []; st.session_state.busqueda_local = (q, [], 0)
             st.rerun()
 
+    with st.expander("📈 Caché de respuestas"):
+        est = cache_ia().estadisticas()
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Aciertos", "—" if est["tasa_aciertos"] is None else f"{est['tasa_aciertos']:.0%}", help=f"{est['aciertos']} de {est['consultas']} búsquedas en este proceso")
+        c2.metric("Guardadas", est["entradas"])
+        c3.metric("Caducadas / desalojadas", f"{est['caducadas']} / {est['desalojadas']}")
+        if st.button("Vaciar caché", key="vaciar_cache_ia"): cache_ia().vaciar(); st.rerun()
+
 elif menu_navegacion == "🗂️ Gestionar Tratamientos":
     st.title("🗂️ Gestionar Tratamientos")
     nombres = [t.nombre for t in lista_tratamientos]
     sel = st.selectbox("Editar:", ["--"] + nombres)
     if sel != "--":
-        t = next(x for x in lista_tratamientos if x.nombre == sel)
+        t = lista_tratamientos.por_nombre[sel]
         
         # STATUS CLINICO
         ciclo = db_usuario.get("ciclos_activos", {}).get(t.id)
@@ -971,13 +553,10 @@ elif menu_navegacion == "🗂️ Gestionar Tratamientos":
             c1.write(f"Estado actual: **{'ACTIVO' if is_active else 'INACTIVO'}**")
             if is_active:
                 if c2.button("Detener Clínica"):
-                    db_usuario["ciclos_activos"][t.id]['activo'] = False
-                    guardar_datos_completos(st.session_state.db_global); st.rerun()
+                    mutar(op_fijar([clave_usuario, "ciclos_activos", t.id, "activo"], False)); st.rerun()
             else:
                 if c2.button("Iniciar Clínica"):
-                    if "ciclos_activos" not in db_usuario: db_usuario["ciclos_activos"] = {}
-                    db_usuario["ciclos_activos"][t.id] = {"fecha_inicio": datetime.date.today().isoformat(), "activo": True}
-                    guardar_datos_completos(st.session_state.db_global); st.rerun()
+                    mutar(op_fijar([clave_usuario, "ciclos_activos", t.id], {"fecha_inicio": datetime.date.today().isoformat(), "activo": True})); st.rerun()
 
         st.markdown("#### Editar Parámetros")
         with st.form("edit"):
@@ -986,28 +565,23 @@ elif menu_navegacion == "🗂️ Gestionar Tratamientos":
             ns = st.text_area("Síntomas", t.sintomas)
             np = st.text_area("Posición", t.posicion)
             if st.form_submit_button("Guardar Cambios"):
-                new_data = t.__dict__.copy()
+                new_data = t.a_dict()
                 new_data['nombre'] = nn; new_data['descripcion'] = nd
                 new_data['sintomas'] = ns; new_data['posicion'] = np
                 new_data['id'] = str(uuid.uuid4())[:8] if not t.es_custom else t.id
                 
-                if t.es_custom:
-                    db_usuario["tratamientos_custom"] = [x for x in db_usuario["tratamientos_custom"] if x['id'] != t.id]
-                db_usuario["tratamientos_custom"].append(new_data)
-                guardar_datos_completos(st.session_state.db_global)
+                customs = [x for x in db_usuario["tratamientos_custom"] if not (t.es_custom and x['id'] == t.id)]
+                mutar(op_fijar([clave_usuario, "tratamientos_custom"], customs + [new_data]))
                 st.success("Guardado!"); st.rerun()
         
         st.markdown("#### Acciones Peligrosas")
         if t.es_custom:
             if st.button("🗑️ Borrar Tratamiento Definitivamente"):
-                db_usuario["tratamientos_custom"] = [x for x in db_usuario["tratamientos_custom"] if x['id'] != t.id]
-                guardar_datos_completos(st.session_state.db_global)
+                mutar(op_fijar([clave_usuario, "tratamientos_custom"], [x for x in db_usuario["tratamientos_custom"] if x['id'] != t.id]))
                 st.success("Borrado!"); st.rerun()
         else:
             if st.button("👁️ Ocultar del Catálogo (No borrar)"):
-                if "tratamientos_ocultos" not in db_usuario: db_usuario["tratamientos_ocultos"] = []
-                db_usuario["tratamientos_ocultos"].append(t.id)
-                guardar_datos_completos(st.session_state.db_global)
+                mutar(op_anadir([clave_usuario, "tratamientos_ocultos"], t.id))
                 st.success("Ocultado!"); st.rerun()
 
 elif menu_navegacion == "🚑 Clínica":
@@ -1016,14 +590,135 @@ elif menu_navegacion == "🚑 Clínica":
     with st.expander("🆕 Iniciar Tratamiento Manualmente"):
         renderizar_seccion_anadir_manual(datetime.date.today(), db_usuario, lista_tratamientos, "clinic_start")
 
-    for t in lista_tratamientos:
-        ciclo = db_usuario.get("ciclos_activos", {}).get(t.id)
-        if ciclo and ciclo['activo']:
-            st.info(f"En curso: {t.nombre} (Desde {ciclo['fecha_inicio']})")
-            if st.button(f"Finalizar {t.nombre}", key=f"fin_{t.id}"):
-                ciclo['activo'] = False
-                guardar_datos_completos(st.session_state.db_global); st.rerun()
+    ciclos = db_usuario.get("ciclos_activos", {})
+    en_curso = [t for t in lista_tratamientos if ciclos.get(t.id, {}).get('activo')]
+    for t in paginar(en_curso, "clinica"):
+        ciclo = ciclos[t.id]
+        st.info(f"En curso: {t.nombre} (Desde {ciclo['fecha_inicio']})")
+        if st.button(f"Finalizar {t.nombre}", key=f"fin_{t.id}"):
+            mutar(op_fijar([clave_usuario, "ciclos_activos", t.id, "activo"], False)); st.rerun()
 
 elif menu_navegacion == "📊 Historial":
+    import pandas as pd
     st.title("📊 Historial")
-    st.write(db_usuario.get("historial", {}))
+    with st.expander("⬇️ Exportar (CSV / Excel)"):
+        hoy = datetime.date.today()
+        rango = st.date_input("Fechas:", (hoy - timedelta(days=365), hoy), key="exp_rango")
+        desde, hasta = (rango[0], rango[-1]) if isinstance(rango, (tuple, list)) and rango else (hoy, hoy)
+        elegidos = st.multiselect("Tratamientos (vacío = todos):", [t.nombre for t in lista_tratamientos], key="exp_trat")
+        filtro = {lista_tratamientos.por_nombre[n].id for n in elegidos} or None
+        formato = st.radio("Formato:", list(exportacion.FORMATOS), horizontal=True, key="exp_formato")
+        if formato == "csv": hojas = [st.selectbox("Datos:", list(exportacion.HOJAS), key="exp_hoja")]
+        else: hojas = st.multiselect("Hojas:", list(exportacion.HOJAS), default=list(exportacion.HOJAS), key="exp_hojas")
+        # El archivo se genera en segundo plano; al terminar queda listo para descargar
+        preparar = st.button("Preparar archivo", disabled=not hojas, key="exp_preparar")
+        if preparar:
+            soltar_exportacion()
+            lanzar_trabajo("exportacion", f"Exportando {', '.join(hojas)}", exportacion.exportar, formato, hojas, db_usuario, lista_tratamientos, indices_historial()[clave_usuario], desde, hasta, filtro)
+            st.session_state.exp_destino = (f"mega_panel_{clave_usuario}_{desde}_{hasta}.{formato}", exportacion.FORMATOS[formato])
+        trabajo = recoger_trabajo("exportacion", espera=0.5 if preparar else 0)
+        if trabajo is not None and not trabajo.terminado: vigilar_trabajo("exportacion")
+        elif trabajo is not None and trabajo.estado == "hecho":
+            soltar_exportacion()
+            st.session_state.exp_listo = (trabajo.resultado(), *st.session_state.exp_destino)
+        elif trabajo is not None and trabajo.estado == "error": st.error(f"No se pudo exportar: {trabajo.futuro.exception()}")
+        if st.session_state.get("exp_listo"):
+            archivo, nombre, mime = st.session_state.exp_listo
+            st.download_button(f"Descargar {nombre}", data=functools.partial(exportacion.rebobinar, archivo), file_name=nombre, mime=mime, on_click="ignore")
+    with st.expander("⬆️ Importar (Excel)"):
+        tipo = st.radio("Contenido:", ["Historial de sesiones", "Rutina semanal"], horizontal=True, key="imp_tipo")
+        if tipo == "Historial de sesiones": st.caption("Columnas: Fecha, Tratamiento (ID o nombre) y, opcionales, Hora y Detalle.")
+        else: st.caption("Hoja 'Semana': día y rutinas separadas por comas.")
+        archivo = st.file_uploader("Libro .xlsx", type=["xlsx"], key="imp_archivo")
+        if archivo is not None and st.button("Importar", key="imp_ok"):
+            from nucleo import importacion
+            try:
+                if tipo == "Historial de sesiones":
+                    r = importacion.leer_historial(archivo, lista_tratamientos, db_usuario, clave_usuario)
+                    ops, errores = r.ops, r.errores
+                    resumen = f"{len(ops)} registros nuevos de {r.leidas} filas ({r.duplicadas} ya estaban)."
+                else:
+                    semana, errores = importacion.leer_rutina(archivo, db_global["configuracion_rutina"].get("tags", TAGS_ACTIVIDADES))
+                    ops = importacion.ops_rutina(semana)
+                    resumen = f"{len(ops)} días de la rutina actualizados."
+            except importacion.ErrorImportacion as e: st.error(str(e))
+            else:
+                if ops: mutar(*ops)  # una sola escritura para todo el libro
+                st.success(resumen)
+                if errores:
+                    st.warning(f"{len(errores)} filas con errores (no importadas):")
+                    st.dataframe(pd.DataFrame(errores, columns=["Fila", "Motivo"]), use_container_width=True, hide_index=True)
+    # La primera vez se recorre todo el historial: en segundo plano si tarda
+    nuevo = not resumenes_historial().listo(clave_usuario) and "resumenes" not in st.session_state.get("trabajos", {})
+    if nuevo: lanzar_trabajo("resumenes", "Calculando resúmenes del historial", calcular_resumenes, clave_usuario)
+    trabajo = recoger_trabajo("resumenes", espera=0.5 if nuevo else 0)
+    if trabajo is not None and not trabajo.terminado: vigilar_trabajo("resumenes", cancelable=False); st.stop()
+    # Todo sale de los resúmenes acumulados: el coste depende de la página, no de los años de historial
+    resumenes = resumenes_historial()[clave_usuario]
+    agrupar = {"Día": "dia", "Semana": "semana", "Mes": "mes"}
+    periodo = agrupar[st.radio("Agrupar por:", list(agrupar), index=1, horizontal=True)]
+    claves = resumenes.claves[periodo][::-1]  # más reciente primero
+    if not claves: st.info("Sin registros todavía."); st.stop()
+    pagina = paginar(claves, f"hist_{periodo}", por_pagina=12)
+    ciclos = db_usuario.get("ciclos_activos", {})
+
+    filas, uso = [], Counter()
+    for clave in pagina:
+        r = resumenes.resumen(periodo, clave)
+        agenda, clinica = r.adherencia_agenda, adherencia_clinica(r, *limites_periodo(clave, periodo), ciclos)
+        filas.append({"Periodo": clave, "Sesiones": r.total_sesiones, "Tratamientos": len(r.sesiones),
+                      "Agenda %": None if agenda is None else round(agenda * 100),
+                      "Clínica %": None if clinica is None else round(clinica * 100),
+                      "Descartados": r.descartados})
+        uso.update(r.sesiones)
+    df = pd.DataFrame(filas)
+    df[["Agenda %", "Clínica %"]] = df[["Agenda %", "Clínica %"]].astype(float)
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Sesiones", int(df["Sesiones"].sum()))
+    c2.metric("Agenda", f"{df['Agenda %'].mean():.0f}%" if df["Agenda %"].notna().any() else "—")
+    c3.metric("Clínica", f"{df['Clínica %'].mean():.0f}%" if df["Clínica %"].notna().any() else "—")
+
+    serie = df.set_index("Periodo").iloc[::-1]
+    st.bar_chart(serie[["Sesiones", "Descartados"]])
+    if serie[["Agenda %", "Clínica %"]].notna().any().any(): st.line_chart(serie[["Agenda %", "Clínica %"]])
+    st.dataframe(df, use_container_width=True, hide_index=True)
+
+    if uso:
+        st.markdown("#### Más usados en estas fechas")
+        top = pd.DataFrame([{"Tratamiento": (lista_tratamientos.get(tid).nombre if lista_tratamientos.get(tid) else tid), "Sesiones": n} for tid, n in uso.most_common(10)])
+        st.bar_chart(top.set_index("Tratamiento"), horizontal=True)
+
+    if st.toggle("Ver registros de estas fechas", key=f"raw_{periodo}"):
+        desde, hasta = limites_periodo(pagina[-1], periodo)[0], limites_periodo(pagina[0], periodo)[1]
+        registros = []
+        for f in indices_historial()[clave_usuario].rango(desde, hasta):
+            for tid, entradas in db_usuario["historial"].get(f, {}).items():
+                t = lista_tratamientos.get(tid)
+                for e in entradas: registros.append({"Fecha": f, "Tratamiento": t.nombre if t else tid, "Hora": e.get("hora"), "Detalle": e.get("detalle")})
+        if registros: st.dataframe(pd.DataFrame(registros), use_container_width=True, hide_index=True)
+        else: st.info("Sin registros en este periodo.")
+
+    if st.toggle("📈 Análisis de todo el historial", key="analisis"):
+        motor, hoy = analitica(), datetime.date.today()
+        nombre = lambda tid: lista_tratamientos.get(tid).nombre if lista_tratamientos.get(tid) else tid
+        r = motor.rachas(hoy)
+        r = r[r["usuario"] == clave_usuario].sort_values(["actual", "mejor"], ascending=False).head(10)
+        if len(r):
+            st.markdown("#### Rachas")
+            st.dataframe(pd.DataFrame({"Tratamiento": r["tratamiento"].astype(str).map(nombre), "Actual": r["actual"], "Mejor": r["mejor"], "Última": r["ultima"].dt.date}), use_container_width=True, hide_index=True)
+        topes = motor.topes()
+        topes = topes[(topes["usuario"] == clave_usuario) & (topes["semana"] == pd.Period(hoy, freq="W"))]
+        if len(topes):
+            st.markdown("#### Topes semanales (esta semana)")
+            st.dataframe(pd.DataFrame({"Tratamiento": topes["tratamiento"].astype(str).map(nombre), "Días": topes["dias"], "Máx.": topes["max_semanal"], "Uso %": (topes["uso"] * 100).round()}), use_container_width=True, hide_index=True)
+        zonas = motor.zonas()
+        zonas = zonas[zonas["usuario"] == clave_usuario]
+        if len(zonas):
+            st.markdown("#### Minutos por zona")
+            st.bar_chart(zonas.set_index(zonas["zona"].astype(str))["minutos"])
+        matriz = motor.adherencia(clave_usuario, periodo).tail(12)
+        if len(matriz):
+            st.markdown("#### Adherencia a la agenda por tratamiento (%)")
+            matriz = (matriz * 100).round().rename(columns=lambda tid: nombre(str(tid)))
+            st.dataframe(matriz.set_axis(matriz.index.astype(str)), use_container_width=True)
@@ -0,0 +1,54 @@
+# Analítica sobre un historial sintético de varios usuarios y años: tiempo de
+# aplanar el árbol a tablas y de cada cálculo vectorizado, y de aplanar el mismo
+# árbol leído de un almacén real (mapas por segmentos), como en la app.
+#   python benchmarks/analitica_historial.py [años] [tratamientos] [json|sqlite]
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from nucleo import almacen, analitica, persistencia
+from nucleo.catalogo import catalogo_usuario
+from sintetico import generar_datos
+
+def cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    valor = funcion(*args)
+    return valor, round((time.perf_counter() - inicio) * 1000, 1)
+
+if __name__ == "__main__":
+    anios = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    tratamientos = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    backend = sys.argv[3] if len(sys.argv) > 3 else "json"
+    hoy = datetime.date.today()
+    ids_base = [t.id for t in catalogo_usuario({})]
+    # Primera pasada sobre datos mínimos: en la app pandas ya está caliente cuando se recalcula tras un mutar()
+    pequeno, _ = generar_datos(ids_base, tratamientos, dias_historial=14, hoy=hoy, usuarios=persistencia.USUARIOS, agenda_historica=True)
+    t = analitica.aplanar(pequeno); c = analitica.tabla_catalogo(pequeno, t)
+    analitica.matriz_adherencia(t, "usuario_rutina"); analitica.rachas(t, hoy); analitica.uso_topes_semanales(t, c); analitica.totales_por_zona(t, c)
+
+    datos, _ = generar_datos(ids_base, tratamientos, dias_historial=365 * anios, hoy=hoy,
+                             usuarios=persistencia.USUARIOS, agenda_historica=True)
+    tablas, ms_aplanar = cronometrar(analitica.aplanar, datos)
+    catalogo, ms_catalogo = cronometrar(analitica.tabla_catalogo, datos, tablas)
+    ms = {"aplanar": ms_aplanar, "catalogo": ms_catalogo}
+    _, ms["adherencia_semanal"] = cronometrar(analitica.matriz_adherencia, tablas, "usuario_rutina", "semana")
+    _, ms["rachas"] = cronometrar(analitica.rachas, tablas, hoy)
+    _, ms["topes_semanales"] = cronometrar(analitica.uso_topes_semanales, tablas, catalogo)
+    _, ms["totales_por_zona"] = cronometrar(analitica.totales_por_zona, tablas, catalogo)
+    ms["total"] = round(sum(ms.values()), 1)
+    filas = {nombre: len(getattr(tablas, nombre)) for nombre in ("sesiones", "planificados", "descartados", "cardio")}
+
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directorio:
+        ruta = os.path.join(directorio, "historial_mega_panel_pro." + ("sqlite" if backend == "sqlite" else "json"))
+        abrir = lambda: almacen.AlmacenSQLite(ruta) if backend == "sqlite" else almacen.AlmacenJSON(ruta)
+        abrir().guardar(datos)
+        # Almacén recién abierto: ningún segmento en memoria, como tras una recarga
+        desde_almacen, ms_almacen = cronometrar(analitica.aplanar, persistencia.cargar(abrir()))
+        assert len(desde_almacen.sesiones) == filas["sesiones"]
+    print(json.dumps({"anios": anios, "usuarios": len(persistencia.USUARIOS), "filas": filas, "ms": ms,
+                      "aplanar_desde_almacen": {"backend": backend, "ms": ms_almacen}}, indent=2))
@@ -0,0 +1,80 @@
+# Arranque en frío: cada repetición es un intérprete nuevo que mide
+#   - importar streamlit,
+#   - las importaciones de primer nivel de app.py (leídas de su AST, así una
+#     importación pesada nueva en cabecera aparece aquí),
+#   - la primera ejecución completa del Panel Diario en modo bare (AppTest),
+# y qué módulos pesados quedaron cargados tras esa primera ejecución. Los datos son
+# sintéticos, en un directorio temporal.
+#   python benchmarks/arranque.py [repeticiones] [tratamientos]
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+APP = os.path.join(RAIZ, "app.py")
+PESADOS = ("pandas", "numpy", "openpyxl", "google.generativeai")
+
+def sentencias_importacion():
+    # Las importaciones de primer nivel de app.py salvo streamlit, tal como están escritas
+    arbol = ast.parse(open(APP, encoding="utf-8").read())
+    return [n for n in arbol.body if isinstance(n, (ast.Import, ast.ImportFrom))
+            and not any(a.name == "streamlit" for a in n.names) and getattr(n, "module", None) != "streamlit"]
+
+def importaciones_app():
+    return [ast.unparse(n) for n in sentencias_importacion()]
+
+def hijo(directorio):
+    # Una medición en este intérprete recién arrancado; imprime JSON
+    sys.path.insert(0, RAIZ)
+    os.chdir(directorio)
+    inicio = time.perf_counter()
+    import streamlit  # noqa: F401
+    t_streamlit = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    # Se ejecutan tal cual: "from nucleo import ia" carga el submódulo, cosa que no haría import_module("nucleo")
+    exec(compile(ast.Module(sentencias_importacion(), type_ignores=[]), APP, "exec"), {})
+    t_app = time.perf_counter() - inicio
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.session_state["logged_in"] = True
+    at.session_state["current_user_name"] = "Bench"
+    at.session_state["current_user_role"] = "usuario_rutina"
+    inicio = time.perf_counter()
+    at.run()
+    t_render = time.perf_counter() - inicio
+    if at.exception: raise SystemExit(f"La app falló: {at.exception[0].value}")
+    print(json.dumps({"import_streamlit_s": t_streamlit, "import_app_s": t_app, "primer_render_s": t_render,
+                      "pesados_cargados": [m for m in PESADOS if m in sys.modules]}))
+
+def preparar(directorio, tratamientos):
+    sys.path.insert(0, RAIZ); sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from nucleo import almacen
+    from nucleo.catalogo import catalogo_usuario
+    from sintetico import generar_datos
+    datos, _ = generar_datos([t.id for t in catalogo_usuario({})], tratamientos)
+    cola = almacen.abrir_almacen("json", os.path.join(directorio, "historial_mega_panel_pro.json"))
+    cola.guardar(datos)
+    cola.vaciar()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--hijo":
+        hijo(sys.argv[2]); sys.exit()
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    tratamientos = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directorio:
+        preparar(directorio, tratamientos)
+        medidas = []
+        for _ in range(repeticiones):
+            salida = subprocess.run([sys.executable, os.path.abspath(__file__), "--hijo", directorio], capture_output=True, text=True, check=True).stdout
+            medidas.append(json.loads(salida.strip().splitlines()[-1]))
+    resultado = {"repeticiones": repeticiones, "tratamientos": tratamientos, "importaciones_app": importaciones_app(),
+                 "pesados_cargados": medidas[-1]["pesados_cargados"]}
+    for clave in ("import_streamlit_s", "import_app_s", "primer_render_s"):
+        valores = [m[clave] for m in medidas]
+        resultado[clave] = {"mediana": round(statistics.median(valores), 3), "max": round(max(valores), 3)}
+    print(json.dumps(resultado, indent=2))
@@ -0,0 +1,54 @@
+# Latencia de una búsqueda IA con el recorrido secuencial de modelos (como antes)
+# frente a la carrera concurrente de ia.carrera, con un cliente local sin red que
+# simula latencias y fallos. Escenarios: el primer modelo responde bien, el primero
+# falla tras un rato y el primero se cuelga (solo el plazo lo corta).
+#   python benchmarks/carrera_ia.py [escala]   (escala multiplica las latencias)
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from nucleo import ia
+
+VALIDA = '[{"nombre": "Sintético", "zona": "Rodilla"}]'
+
+class ClienteSimulado:
+    def __init__(self, guion):
+        self.guion = guion  # modelo -> (segundos, texto o excepción)
+
+    def generar(self, modelo, prompt, plazo):
+        espera, salida = self.guion[modelo]
+        time.sleep(min(espera, plazo))
+        if isinstance(salida, Exception): raise salida
+        if espera > plazo: raise TimeoutError(f"{plazo:g} s")
+        return salida
+
+def escenarios(escala):
+    m1, m2, m3 = ia.MODELOS_IA
+    return {
+        "primero_bien": {m1: (1.0 * escala, VALIDA), m2: (0.8 * escala, VALIDA), m3: (0.6 * escala, VALIDA)},
+        "primero_falla": {m1: (1.5 * escala, RuntimeError("503")), m2: (0.8 * escala, VALIDA), m3: (0.6 * escala, VALIDA)},
+        "primero_colgado": {m1: (60.0, VALIDA), m2: (0.8 * escala, "no es json"), m3: (0.6 * escala, VALIDA)},
+    }
+
+def secuencial(cliente, prompt, plazo):
+    # El bucle original: un modelo tras otro hasta el primero que parsea
+    for m in ia.MODELOS_IA:
+        try: return m, ia.parsear_opciones(cliente.generar(m, prompt, plazo))
+        except Exception: continue
+    return None, None
+
+def medir(fn, cliente, plazo):
+    inicio = time.perf_counter()
+    modelo, _ = fn(cliente, "dolor de rodilla", plazo=plazo)
+    return {"s": round(time.perf_counter() - inicio, 3), "modelo": modelo}
+
+if __name__ == "__main__":
+    escala = float(sys.argv[1]) if len(sys.argv) > 1 else 0.1
+    plazo = 5.0 * escala * 10
+    resultado = {"escala": escala, "plazo_s": plazo}
+    for nombre, guion in escenarios(escala).items():
+        cliente = ClienteSimulado(guion)
+        resultado[nombre] = {"secuencial": medir(secuencial, cliente, plazo), "carrera": medir(ia.carrera, cliente, plazo)}
+    print(json.dumps(resultado, indent=2))
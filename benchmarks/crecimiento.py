@@ -0,0 +1,151 @@
+# Cómo escala la app con el tamaño de los datos: genera un conjunto sintético de
+# varios usuarios y años (historial, descartes, agenda, cardio, ciclos de clínica y
+# cientos de tratamientos personalizados), lo escribe con el backend elegido en un
+# directorio temporal con los nombres de archivo de la app y mide
+#   - cargar_datos_completos con un almacén recién abierto, y el recorrido de todo el
+#     historial (las secciones por fecha se cargan por segmentos al primer acceso),
+#   - guardar_datos_completos (reescritura completa, sin la cola de escritura),
+#   - obtener_catalogo (construcción) frente a catalogo_usuario (caché por firma),
+#   - los bloqueos de todas las tarjetas de la semana: analizar_bloqueos por
+#     tarjeta/día/momento frente a evaluar_bloqueos, y planificar_semana entero,
+#   - la primera ejecución del script en el proceso y el pintado completo del Panel
+#     Diario y del Panel Semanal en una sesión nueva (AppTest, modo bare).
+# Imprime JSON para comparar entre versiones.
+#   python benchmarks/crecimiento.py [años] [personalizados] [repeticiones] [json|sqlite]
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from nucleo import almacen, persistencia
+from nucleo.catalogo import catalogo_usuario, obtener_catalogo
+from nucleo.planificacion import planificar_semana
+from nucleo.reglas import MOMENTOS, analizar_bloqueos, evaluar_bloqueos
+from sintetico import generar_datos
+
+USUARIO = "usuario_rutina"
+ARCHIVOS = {"json": "historial_mega_panel_pro.json", "sqlite": "historial_mega_panel_pro.sqlite"}  # los de app.py
+PAGINAS = ("📅 Panel Diario", "🗓️ Panel Semanal")
+
+def cronometrar(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        valor = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return valor, {"mediana": round(statistics.median(tiempos), 4), "max": round(max(tiempos), 4)}
+
+def almacen_nuevo(backend, ruta):
+    # Sin la caché de abrir_almacen: cada repetición empieza sin segmentos residentes
+    return almacen.AlmacenSQLite(ruta) if backend == "sqlite" else almacen.AlmacenJSON(ruta)
+
+def recorrer(datos):
+    # Toca cada día de cada sección por fecha, como un informe sobre todo el historial
+    return sum(len(v) for u in persistencia.USUARIOS for s in ("historial", "descartados", "planificados_adhoc") for v in datos[u][s].values())
+
+def tamano(directorio):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, archivos in os.walk(directorio) for f in archivos)
+
+def describir(datos):
+    resumen = {}
+    for u in persistencia.USUARIOS:
+        db_u = datos[u]
+        resumen[u] = {"dias": len(db_u["historial"]), "sesiones": sum(len(v) for v in db_u["historial"].values()),
+                      "descartes": sum(len(v) for v in db_u["descartados"].values()),
+                      "planificados": sum(len(v) for v in db_u["planificados_adhoc"].values()),
+                      "personalizados": len(db_u["tratamientos_custom"]),
+                      "ciclos": len(db_u["ciclos_activos"]), "ciclos_activos": sum(1 for c in db_u["ciclos_activos"].values() if c["activo"])}
+    return resumen
+
+def bloqueos_por_tarjeta(planes, historial):
+    # El recorrido de antes de evaluar_bloqueos: una llamada por tarjeta, día y momento
+    resultado = {}
+    for plan in planes:
+        for t, _ in plan.to_show:
+            for m in MOMENTOS:
+                resultado[(t.id, plan.fecha_str, m)] = analizar_bloqueos(t, m, historial, plan.registros, plan.fecha_str, plan.tags, USUARIO)
+    return resultado
+
+def medir_nucleo(backend, ruta, datos, fechas, repeticiones):
+    r = {}
+    _, r["cargar_datos_completos_s"] = cronometrar(lambda: persistencia.cargar(almacen_nuevo(backend, ruta)), repeticiones)
+    _, r["cargar_y_recorrer_s"] = cronometrar(lambda: recorrer(persistencia.cargar(almacen_nuevo(backend, ruta))), repeticiones)
+    _, r["guardar_datos_completos_s"] = cronometrar(lambda: almacen_nuevo(backend, ruta).guardar(datos), repeticiones)
+
+    cola = almacen.abrir_almacen(backend, ruta)
+    compartidos = almacen.DatosCompartidos(cola, lambda: persistencia.cargar(cola))
+    cargados = compartidos.obtener()
+    db_u = cargados[USUARIO]
+    _, r["obtener_catalogo_s"] = cronometrar(lambda: obtener_catalogo(db_u["tratamientos_custom"], db_u), repeticiones)
+    catalogo_usuario(db_u)
+    catalogo, r["catalogo_usuario_s"] = cronometrar(lambda: catalogo_usuario(db_u), repeticiones)
+
+    planificar = lambda: planificar_semana(fechas, cargados, db_u, catalogo, db_u["historial"], USUARIO, {}, compartidos.version)
+    planes, r["planificar_semana_s"] = cronometrar(planificar, repeticiones)
+    visibles = list({t.id: t for p in planes for t, _ in p.to_show}.values())
+    por_tarjeta, r["analizar_bloqueos_semana_s"] = cronometrar(lambda: bloqueos_por_tarjeta(planes, db_u["historial"]), repeticiones)
+    de_una_vez, r["evaluar_bloqueos_semana_s"] = cronometrar(
+        lambda: evaluar_bloqueos(visibles, fechas, db_u["historial"], {p.fecha_str: p.tags for p in planes}, USUARIO), repeticiones)
+    r["tarjetas_semana"] = sum(len(p.to_show) for p in planes)
+    r["bloqueos_coinciden"] = por_tarjeta == de_una_vez
+    return r
+
+def medir_pintado(repeticiones):
+    from streamlit.testing.v1 import AppTest
+
+    def pintar(pagina):
+        # Sesión nueva; solo cuenta la ejecución que pinta la página pedida
+        at = AppTest.from_file(os.path.join(RAIZ, "app.py"), default_timeout=600)
+        at.session_state["logged_in"] = True
+        at.session_state["current_user_name"] = "Bench"
+        at.session_state["current_user_role"] = USUARIO
+        if pagina != PAGINAS[0]:
+            at.run()
+            at.sidebar.radio[0].set_value(pagina)
+        inicio = time.perf_counter()
+        at.run()
+        segundos = time.perf_counter() - inicio
+        if at.exception: raise SystemExit(f"La app falló en {pagina}: {at.exception[0].value}")
+        return segundos
+
+    # La primera incluye las factorías de st.cache_resource (carga, índices, resúmenes)
+    r = {"primera_ejecucion_s": round(pintar(PAGINAS[0]), 4)}
+    for pagina in PAGINAS:
+        tiempos = [pintar(pagina) for _ in range(repeticiones)]
+        r[pagina] = {"mediana": round(statistics.median(tiempos), 4), "max": round(max(tiempos), 4)}
+    return r
+
+if __name__ == "__main__":
+    anios = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    personalizados = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    repeticiones = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    backend = sys.argv[4] if len(sys.argv) > 4 else "json"
+    hoy = datetime.date.today()
+    lunes = hoy - datetime.timedelta(days=hoy.weekday())
+    fechas = [lunes + datetime.timedelta(days=i) for i in range(7)]
+    ids_base = [t.id for t in catalogo_usuario({})]
+
+    inicio = time.perf_counter()
+    datos, _ = generar_datos(ids_base, len(ids_base) + personalizados, dias_historial=365 * anios, hoy=hoy,
+                             usuarios=persistencia.USUARIOS, agenda_historica=True, ciclos=personalizados // 10)
+    datos = persistencia.completar(datos)
+    resultado = {"anios": anios, "personalizados": personalizados, "repeticiones": repeticiones, "backend": backend,
+                 "generar_s": round(time.perf_counter() - inicio, 3), "datos": describir(datos)}
+
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directorio:
+        os.chdir(directorio)
+        os.environ["MEGA_PANEL_BACKEND"] = backend
+        ruta = os.path.join(directorio, ARCHIVOS[backend])
+        almacen_nuevo(backend, ruta).guardar(datos)
+        resultado["bytes_en_disco"] = tamano(directorio)
+        resultado["nucleo"] = medir_nucleo(backend, ruta, datos, fechas, repeticiones)
+        resultado["pintado"] = medir_pintado(repeticiones)
+        almacen.abrir_almacen(backend, ruta).vaciar()
+        os.chdir(RAIZ)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
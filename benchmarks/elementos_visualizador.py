@@ -0,0 +1,76 @@
+# Elementos que emite el Panel Semanal con todas las tarjetas de la semana abiertas
+# (ficha técnica incluida), con el visualizador de ondas actual (un bloque HTML en
+# caché) y con el anterior (caption + st.columns + un markdown por onda). Se ejecuta
+# la app de verdad (AppTest, modo bare) sobre un almacén JSON sintético; la versión
+# "anterior" es app.py con solo mostrar_visualizador_mega sustituida.
+#   python benchmarks/elementos_visualizador.py [tratamientos]
+import ast
+import datetime
+import json
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from streamlit.testing.v1 import AppTest
+from nucleo import almacen, catalogo, persistencia
+from sintetico import generar_datos
+
+USUARIO = "usuario_rutina"
+PAGINA = "🗓️ Panel Semanal"
+
+VISUALIZADOR_ANTERIOR = '''
+def mostrar_visualizador_mega(t):
+    if not t.frecuencias: return
+    st.caption("Configuración Panel:")
+    cols = st.columns(len(t.frecuencias))
+    for idx, (nm, pct) in enumerate(t.frecuencias):
+        bg = "#ffebee" if pct >= 80 else "#f5f5f5"
+        border = "#ef5350" if pct >= 80 else "#bdbdbd"
+        txt = "#b71c1c" if pct >= 80 else "#616161"
+        cols[idx].markdown(f"""<div style="background-color:{bg};border:1px solid {border};border-radius:5px;padding:5px;text-align:center;font-size:12px;color:{txt};font-weight:bold;">{nm}nm<br>{pct}%</div>""", unsafe_allow_html=True)
+'''
+
+def app_anterior(directorio):
+    fuente = open(os.path.join(RAIZ, "app.py"), encoding="utf-8").read()
+    lineas = fuente.splitlines(keepends=True)
+    nodo = next(n for n in ast.parse(fuente).body if isinstance(n, ast.FunctionDef) and n.name == "mostrar_visualizador_mega")
+    ruta = os.path.join(directorio, "app_anterior.py")
+    with open(ruta, "w", encoding="utf-8") as f: f.write("".join(lineas[:nodo.lineno - 1]) + VISUALIZADOR_ANTERIOR.lstrip() + "".join(lineas[nodo.end_lineno:]))
+    return ruta
+
+def contar(nodo):
+    # Cada bloque (columnas, columna, expander...) y cada elemento del árbol cuenta uno
+    hijos = getattr(nodo, "children", None) or {}
+    return 1 + sum(contar(h) for h in hijos.values())
+
+def elementos(script, abiertas):
+    at = AppTest.from_file(script, default_timeout=600)
+    at.session_state["logged_in"] = True
+    at.session_state["current_user_name"] = "Bench"
+    at.session_state["current_user_role"] = USUARIO
+    for clave in abiertas: at.session_state[clave] = True
+    at.run()
+    at.sidebar.radio[0].set_value(PAGINA)
+    at.run()
+    if at.exception: raise SystemExit(f"La app falló: {at.exception[0].value}")
+    return contar(at.main)
+
+if __name__ == "__main__":
+    tratamientos = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    hoy = datetime.date.today()
+    lunes = hoy - datetime.timedelta(days=hoy.weekday())
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directorio:
+        os.chdir(directorio)
+        os.environ["MEGA_PANEL_BACKEND"] = "json"
+        datos, activos = generar_datos([t.id for t in catalogo.catalogo_usuario({})], tratamientos, hoy=hoy)
+        almacen.AlmacenJSON(os.path.join(directorio, "historial_mega_panel_pro.json")).guardar(persistencia.completar(datos))
+        abiertas = [f"open_{tid}_{(lunes + datetime.timedelta(days=i)).isoformat()}" for tid in activos for i in range(7)]
+        resultado = {"tratamientos_activos": tratamientos}
+        for nombre, script in (("anterior", app_anterior(directorio)), ("actual", os.path.join(RAIZ, "app.py"))):
+            resultado[nombre] = {"cerradas": elementos(script, []), "abiertas": elementos(script, abiertas)}
+        almacen.abrir_almacen("json", os.path.join(directorio, "historial_mega_panel_pro.json")).vaciar()
+        os.chdir(RAIZ)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
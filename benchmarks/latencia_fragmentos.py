@@ -0,0 +1,120 @@
+# Latencia de las acciones del Panel Semanal ejecutando la app de verdad (AppTest,
+# modo bare) sobre un almacén JSON con muchos tratamientos activos. Cada acción se
+# mide como la envía el navegador: un widget dentro de un fragmento reejecuta solo
+# ese fragmento (y lo que él mismo pida después, p. ej. un rerun completo cuando la
+# tarjeta cambia de grupo); "completo" es la misma acción como rerun de toda la app,
+# lo que ocurría antes de los fragmentos. Por acción se cuentan las tarjetas que se
+# vuelven a pintar y las firmas de catálogo calculadas.
+#   python benchmarks/latencia_fragmentos.py [tratamientos] [repeticiones]
+# AppTest no expone cómo enviar un rerun de fragmento: se pasa el id en RerunData
+# (como hace la sesión real) y el id de cada fragmento se saca de sus argumentos.
+import datetime
+import functools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import streamlit
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import local_script_runner
+from nucleo import almacen, catalogo, persistencia
+from sintetico import generar_datos
+
+USUARIO = "usuario_rutina"
+PAGINA = "🗓️ Panel Semanal"
+
+class Contador:
+    # Tarjetas pintadas (su toggle de cabecera) y firmas de catálogo en cada ejecución
+    def __init__(self):
+        self.tarjetas = self.firmas = 0
+        toggle, firma = streamlit.toggle, catalogo.firma_catalogo
+        def contar_toggle(etiqueta, *args, key=None, **kwargs):
+            if str(key).startswith("open_"): self.tarjetas += 1
+            return toggle(etiqueta, *args, key=key, **kwargs)
+        def contar_firma(*args):
+            self.firmas += 1
+            return firma(*args)
+        streamlit.toggle, catalogo.firma_catalogo = contar_toggle, contar_firma
+
+    def reiniciar(self): self.tarjetas = self.firmas = 0
+
+def fragmentos(at):
+    # id de fragmento -> ("dia", fecha) o ("tarjeta", id, fecha), a partir de los argumentos con que se declaró
+    ids = {}
+    for id_f, f in at._fragment_storage._fragments.items():
+        celdas = dict(zip(f.__code__.co_freevars, (c.cell_contents for c in f.__closure__ or ())))
+        funcion, args = celdas.get("non_optional_func"), celdas.get("args")
+        if funcion is None or not args: continue
+        if funcion.__name__ == "renderizar_dia_completo": ids[("dia", args[0].fecha_str)] = id_f
+        elif funcion.__name__ == "render_card": ids[("tarjeta", args[1].id, args[0].fecha_str)] = id_f
+    return ids
+
+def ejecutar(at, id_fragmento=None):
+    original = local_script_runner.RerunData
+    if id_fragmento: local_script_runner.RerunData = functools.partial(original, fragment_id_queue=[id_fragmento])
+    try:
+        inicio = time.perf_counter()
+        at.run()
+        segundos = time.perf_counter() - inicio
+    finally: local_script_runner.RerunData = original
+    if at.exception: raise SystemExit(f"La app falló: {at.exception[0].value}")
+    return segundos
+
+def preparar(directorio, tratamientos):
+    hoy = datetime.date.today()
+    datos, activos = generar_datos([t.id for t in catalogo.catalogo_usuario({})], tratamientos, hoy=hoy)
+    almacen.AlmacenJSON(os.path.join(directorio, "historial_mega_panel_pro.json")).guardar(persistencia.completar(datos))
+    at = AppTest.from_file(os.path.join(RAIZ, "app.py"), default_timeout=600)
+    at.session_state["logged_in"] = True
+    at.session_state["current_user_name"] = "Bench"
+    at.session_state["current_user_role"] = USUARIO
+    at.run()
+    at.sidebar.radio[0].set_value(PAGINA)
+    ejecutar(at)
+    return at, hoy - datetime.timedelta(days=hoy.weekday())
+
+def medir(at, contador, acciones, repeticiones, alcance):
+    # acciones: [(clave del widget, clave del fragmento)] que se alternan para no acumular estado
+    tiempos, tarjetas, firmas = [], [], []
+    for i in range(repeticiones):
+        widget, fragmento = acciones[i % len(acciones)]
+        at.button(key=widget).click()
+        id_f = fragmentos(at)[fragmento] if alcance == "fragmento" else None
+        contador.reiniciar()
+        tiempos.append(ejecutar(at, id_f))
+        tarjetas.append(contador.tarjetas); firmas.append(contador.firmas)
+    return {"ms_mediana": round(statistics.median(tiempos) * 1000, 1), "ms_max": round(max(tiempos) * 1000, 1),
+            "tarjetas_repintadas": round(statistics.median(tarjetas)), "firmas_catalogo": round(statistics.median(firmas))}
+
+if __name__ == "__main__":
+    tratamientos = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directorio:
+        os.chdir(directorio)
+        os.environ["MEGA_PANEL_BACKEND"] = "json"
+        at, lunes = preparar(directorio, tratamientos)
+        contador = Contador()
+        fecha = lunes.isoformat()
+        tid = next(k[1] for k in fragmentos(at) if k[0] == "tarjeta" and k[2] == fecha)
+        resultado = {"tratamientos_activos": tratamientos, "tarjetas_semana": len([k for k in fragmentos(at) if k[0] == "tarjeta"])}
+
+        # Abrir la ficha: solo la tarjeta, sin tocar los datos
+        at.toggle(key=f"open_{tid}_{fecha}").set_value(True)
+        contador.reiniciar()
+        resultado["abrir_tarjeta"] = {"ms": round(ejecutar(at, fragmentos(at)[("tarjeta", tid, fecha)]) * 1000, 1), "tarjetas_repintadas": contador.tarjetas}
+
+        # Registrar / Deshacer en la tarjeta: cambia de grupo, así que la tarjeta pide un rerun completo
+        tarjeta = [(f"go_{tid}_{fecha}", ("tarjeta", tid, fecha)), (f"undo_{tid}_{fecha}", ("tarjeta", tid, fecha))]
+        # Editar / Confirmar la rutina del día: solo el fragmento del día
+        dia = [(f"ed_{fecha}", ("dia", fecha)), (f"bc_{fecha}", ("dia", fecha))]
+        for nombre, acciones in (("registrar_tarjeta", tarjeta), ("rutina_dia", dia)):
+            resultado[nombre] = {alcance: medir(at, contador, acciones, repeticiones, alcance) for alcance in ("fragmento", "completo")}
+        almacen.abrir_almacen("json", os.path.join(directorio, "historial_mega_panel_pro.json")).vaciar()
+        os.chdir(RAIZ)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
@@ -0,0 +1,61 @@
+# Memoria por entrada del catálogo: Tratamiento actual (slots, inmutable, valores
+# compartidos) frente a la clase anterior con __dict__ por instancia.
+#   python benchmarks/memoria_catalogo.py [repeticiones]
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from nucleo import catalogo
+
+class TratamientoAnterior:
+    def __init__(self, id_t, nombre, zona, ondas_txt, config_energia, herzios, distancia, duracion, max_diario, max_semanal, tipo, tags_entreno, default_visual_group, momento_ideal_txt, momentos_prohibidos, tips_antes, tips_despues, incompatible_with=None, fases_config=None, es_custom=False, patologia="", lado_txt="", frecuencias=None, descripcion="", sintomas="", posicion=""):
+        self.id = id_t
+        self.nombre = nombre
+        self.zona = zona
+        self.ondas_txt = ondas_txt
+        self.config_energia = config_energia
+        self.herzios = herzios
+        self.distancia = distancia
+        self.duracion = duracion
+        self.max_diario = max_diario
+        self.max_semanal = max_semanal
+        self.tipo = tipo
+        self.tags_entreno = tags_entreno
+        self.default_visual_group = default_visual_group
+        self.momento_ideal_txt = momento_ideal_txt
+        self.momentos_prohibidos = momentos_prohibidos
+        self.tips_antes = tips_antes
+        self.tips_despues = tips_despues
+        self.incompatible_with = incompatible_with if incompatible_with else []
+        self.fases_config = fases_config if fases_config else []
+        self.es_custom = es_custom
+        self.patologia = patologia
+        self.lado_txt = lado_txt
+        self.frecuencias = frecuencias if frecuencias else []
+        self.descripcion = descripcion
+        self.sintomas = sintomas
+        self.posicion = posicion
+
+def medir(clase, repeticiones):
+    actual = catalogo.Tratamiento
+    catalogo.Tratamiento = clase
+    try:
+        catalogo.obtener_catalogo()  # calienta cachés de cadenas/tuplas compartidas
+        tracemalloc.start()
+        antes = tracemalloc.take_snapshot()
+        vivos = [catalogo.obtener_catalogo() for _ in range(repeticiones)]
+        despues = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    finally:
+        catalogo.Tratamiento = actual
+    entradas = sum(len(c) for c in vivos)
+    total = sum(d.size_diff for d in despues.compare_to(antes, "filename"))
+    return {"entradas": entradas, "bytes_por_entrada": round(total / entradas, 1)}
+
+if __name__ == "__main__":
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    resultado = {"anterior": medir(TratamientoAnterior, repeticiones), "actual": medir(catalogo.Tratamiento, repeticiones)}
+    resultado["reduccion"] = round(1 - resultado["actual"]["bytes_por_entrada"] / resultado["anterior"]["bytes_por_entrada"], 3)
+    print(json.dumps(resultado, indent=2))
@@ -0,0 +1,63 @@
+# Datos sintéticos con el esquema de la app para los benchmarks: tratamientos
+# personalizados además del catálogo base, todos planificados cada día de la semana,
+# historial de los días anteriores (años si hace falta) y, opcionalmente, ciclos de
+# clínica sobre los personalizados.
+import datetime
+import random
+
+CAMPOS_USUARIO = ("historial", "meta_diaria", "meta_cardio", "ciclos_activos", "descartados", "planificados_adhoc", "tratamientos_custom", "confirmaciones_diarias", "tratamientos_ocultos")
+MOMENTOS_ADHOC = ("PRE", "POST", "FLEX", "NIGHT")
+DETALLES = ("🏋️ Entrenamiento (Pre)", "🚿 Post-Entreno / Mañana", "⛅ Tarde", "🌙 Noche", "Batch")
+CARDIO = (("Caminar (Cinta)", {"tiempo": 30, "velocidad": 6.5, "inclinacion": 8.0}), ("Bici Estática", {"tiempo": 20}), ("Descanso Cardio", {}))
+
+def usuario_vacio():
+    return {k: ([] if k in ("tratamientos_custom", "tratamientos_ocultos") else {}) for k in CAMPOS_USUARIO}
+
+def tratamiento_custom(i):
+    return {"id": f"sint_{i:04d}", "nombre": f"Sintético {i}", "zona": f"Zona {i % 12}", "ondas": "660+850",
+            "energia": "660nm: 50% | 850nm: 100%", "hz": "10Hz", "dist": "15cm", "dur": 10, "tipo": "LESION",
+            "tips_ant": ["Piel limpia"], "tips_des": ["Hidratar"], "fases": [], "frecuencias": [[660, 50], [850, 100]],
+            "descripcion": "", "sintomas": "", "posicion": ""}
+
+def ciclo_clinico(inicio, activo):
+    # Mismo esquema que "🚑 Empezar Clínica"; los terminados quedan con activo=False
+    return {"fecha_inicio": inicio.isoformat(), "activo": activo, "modo": "fases", "estado": "activo" if activo else "finalizado", "dias_saltados": []}
+
+def generar_usuario(catalogo_base, tratamientos, dias_historial, hoy, azar, agenda_historica=False, ciclos=0):
+    lunes = hoy - datetime.timedelta(days=hoy.weekday())
+    usuario = usuario_vacio()
+    extra = max(0, tratamientos - len(catalogo_base))
+    usuario["tratamientos_custom"] = [tratamiento_custom(i) for i in range(extra)]
+    activos = (list(catalogo_base) + [c["id"] for c in usuario["tratamientos_custom"]])[:tratamientos]
+    for i in range(7):
+        fecha = (lunes + datetime.timedelta(days=i)).isoformat()
+        usuario["planificados_adhoc"][fecha] = {tid: azar.choice(MOMENTOS_ADHOC) for tid in activos}
+        usuario["confirmaciones_diarias"][fecha] = True
+    for i in range(1, dias_historial + 1):
+        fecha = (lunes - datetime.timedelta(days=i)).isoformat()
+        if not agenda_historica:
+            usuario["historial"][fecha] = {tid: [{"hora": "10:00", "detalle": "Sintético"}] for tid in azar.sample(activos, len(activos) // 4)}
+            continue
+        # Agenda del día, lo que se hizo (casi todo lo planificado y algo más), descartes y cardio
+        planificados = azar.sample(activos, len(activos) // 3)
+        usuario["planificados_adhoc"][fecha] = {tid: azar.choice(MOMENTOS_ADHOC) for tid in planificados}
+        hechos = [tid for tid in planificados if azar.random() < 0.8] + azar.sample(activos, 3)
+        usuario["historial"][fecha] = {tid: [{"hora": "10:00", "detalle": azar.choice(DETALLES)}] for tid in hechos}
+        usuario["descartados"][fecha] = [tid for tid in planificados if tid not in usuario["historial"][fecha]][:2]
+        actividad, params = azar.choice(CARDIO)
+        usuario["meta_cardio"][fecha] = dict(params, actividad=actividad)
+    # Ciclos de clínica repartidos por el historial; siguen activos los de los últimos 60 días
+    for custom in azar.sample(usuario["tratamientos_custom"], min(ciclos, len(usuario["tratamientos_custom"]))):
+        custom["fases"] = [{"nombre": "Estándar", "dias_fin": 30}]
+        inicio = lunes - datetime.timedelta(days=azar.randint(0, max(dias_historial, 1)))
+        usuario["ciclos_activos"][custom["id"]] = ciclo_clinico(inicio, (lunes - inicio).days <= 60)
+    return usuario, activos
+
+def generar_datos(catalogo_base, tratamientos=60, dias_historial=120, hoy=None, semilla=0, usuarios=("usuario_rutina",), agenda_historica=False, ciclos=0):
+    # catalogo_base: ids del catálogo sin personalizar; se completan hasta `tratamientos` activos
+    azar = random.Random(semilla)
+    hoy = hoy or datetime.date.today()
+    datos = {"usuario_rutina": usuario_vacio(), "usuario_libre": usuario_vacio()}
+    for nombre in usuarios:
+        datos[nombre], activos = generar_usuario(catalogo_base, tratamientos, dias_historial, hoy, azar, agenda_historica, ciclos)
+    return datos, activos
@@ -0,0 +1,9 @@
+# ==============================================================================
+# NÚCLEO SIN STREAMLIT
+# ==============================================================================
+# Catálogo, reglas, planificación, persistencia, índices, resúmenes, analítica,
+# importación/exportación, búsqueda, IA y trabajos en segundo plano. Nada aquí
+# importa streamlit: se puede usar desde scripts, trabajos por lotes y benchmarks,
+# y app.py es solo la interfaz. Los módulos con dependencias pesadas (analitica e
+# importacion con pandas, exportacion con openpyxl al escribir) se importan
+# explícitamente donde se usan; este paquete no los carga.
@@ -0,0 +1,1016 @@
+import atexit
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+# ==============================================================================
+# PERSISTENCIA: ALMACENES INTERCAMBIABLES (JSON + DIARIO / SQLITE)
+# ==============================================================================
+# Cada cambio se expresa como una operación pequeña sobre una ruta del árbol de
+# datos. Los almacenes persisten esas operaciones y reconstruyen el árbol al
+# cargar; la interfaz común es cargar / registrar / compactar / guardar.
+#
+# - AlmacenJSON: un directorio por usuario (perfil + un segmento por mes y sección
+#   por fecha + diario append-only compactado en segundo plano) y un archivo
+#   compartido para configuracion_rutina.
+# - AlmacenSQLite: tablas indexadas por (usuario, fecha, tratamiento_id).
+#
+# Ambos llevan una versión por usuario y escriben con compare-and-swap: los cambios
+# de otra sesión que no chocan con los nuestros se fusionan por día; si chocan, gana
+# el que ya estaba en disco y el nuestro queda en conflictos.
+#
+# En ambos las secciones por fecha (historial, descartados...) son mapas
+# perezosos: se cargan por segmentos al primer acceso y se mantiene un LRU, así
+# que la memoria depende de las fechas consultadas y no de los años de historial.
+# - ColaEscritura: delante de cualquiera de los dos; agrupa los cambios en un
+#   hilo escritor para sacar el disco del camino de la interacción.
+
+UMBRAL_COMPACTACION = 200
+MESES_RESIDENTES = 24     # segmentos mensuales en memoria por sección (JSON)
+DIAS_RESIDENTES = 400     # días en memoria por sección (SQLite)
+VENTANA_ESCRITURA = 0.25  # segundos sin cambios antes de escribir el lote
+ESPERA_MAXIMA = 2.0       # ningún cambio espera en cola más que esto
+CAMBIOS_RETENIDOS = 1000  # historial de versiones por usuario para detectar conflictos (SQLite)
+
+log = logging.getLogger(__name__)
+
+class ErrorAlmacen(Exception):
+    pass
+SECCIONES_FECHA = ("historial", "descartados", "planificados_adhoc", "meta_diaria", "meta_cardio", "confirmaciones_diarias")
+CONMUTATIVAS = ("append", "remove")
+
+# --- OPERACIONES ---
+def op_fijar(ruta, valor): return {"op": "set", "ruta": list(ruta), "valor": valor}
+def op_borrar(ruta): return {"op": "del", "ruta": list(ruta)}
+def op_anadir(ruta, valor): return {"op": "append", "ruta": list(ruta), "valor": valor}
+def op_quitar(ruta, valor): return {"op": "remove", "ruta": list(ruta), "valor": valor}
+
+def aplicar_op(datos, op):
+    tipo = op["op"]
+    *padres, ultima = op["ruta"]
+    nodo = datos
+    for k in padres:
+        if k not in nodo:
+            if tipo in ("del", "remove"): return
+            nodo[k] = {}
+        nodo = nodo[k]
+    if tipo == "set": nodo[ultima] = op["valor"]
+    elif tipo == "del":
+        if ultima in nodo: del nodo[ultima]
+    elif tipo == "append":
+        if ultima not in nodo: nodo[ultima] = []
+        nodo[ultima].append(op["valor"])
+    elif tipo == "remove":
+        lista = nodo.get(ultima)
+        if lista and op["valor"] in lista: lista.remove(op["valor"])
+    else: raise ValueError(f"Operación desconocida: {tipo}")
+
+def _copiar(nodo): return list(nodo) if isinstance(nodo, list) else dict(nodo)
+
+def aplicar_op_copiando(datos, op):
+    # Como aplicar_op, pero sin tocar ningún contenedor que otro hilo pueda estar
+    # recorriendo: se copian los de la ruta y la copia se engancha con una sola
+    # asignación en la raíz o en el mapa por segmentos más profundo (que se recorre
+    # sobre copias de sus claves). El resto del árbol se comparte.
+    tipo = op["op"]
+    *padres, ultima = op["ruta"]
+    cadena = [datos]
+    for k in padres:
+        if k not in cadena[-1]:
+            if tipo in ("del", "remove"): return
+            cadena.append({})
+        else: cadena.append(cadena[-1][k])
+    ancla = max(i for i, nodo in enumerate(cadena) if i == 0 or isinstance(nodo, MapaSegmentado))
+    copias = [_copiar(nodo) for nodo in cadena[ancla + 1:]]
+    for i in range(1, len(copias)): copias[i - 1][padres[ancla + i]] = copias[i]
+    hoja = copias[-1] if copias else cadena[ancla]
+    if tipo in ("append", "remove") and ultima in hoja: hoja[ultima] = list(hoja[ultima])
+    aplicar_op(hoja, dict(op, ruta=[ultima]))
+    if copias: cadena[ancla][padres[ancla]] = copias[0]
+
+# --- ARCHIVOS JSON ATÓMICOS ---
+def _leer_json(ruta):
+    # Si el archivo está dañado se aparta (.corrupto) y se usa la copia anterior (.bak)
+    respaldo = ruta + ".bak"
+    for r in (ruta, respaldo):
+        if not os.path.exists(r): continue
+        try:
+            with open(r, 'r') as f: datos = json.load(f)
+        except ValueError as e:
+            shutil.copy2(r, r + ".corrupto")
+            log.error("JSON ilegible %s: %s", r, e)
+            continue
+        if r == respaldo: log.warning("Usando copia de seguridad %s", respaldo)
+        return datos
+    if os.path.exists(ruta) or os.path.exists(respaldo):
+        raise ErrorAlmacen(f"{ruta} está dañado y no hay copia válida (se guardó como .corrupto)")
+    return None
+
+def _escribir_json(ruta, datos, indent=None):
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    tmp = ruta + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(datos, f, indent=indent, ensure_ascii=False)
+        f.flush(); os.fsync(f.fileno())
+    # La copia anterior se hace antes y el cambio es un único rename: `ruta` nunca falta
+    if os.path.exists(ruta):
+        try:
+            if os.path.exists(tmp + ".bak"): os.remove(tmp + ".bak")
+            os.link(ruta, tmp + ".bak")  # mismo contenido sin copiarlo
+            os.replace(tmp + ".bak", ruta + ".bak")
+        except OSError: shutil.copy2(ruta, ruta + ".bak")  # sin enlaces duros
+    os.replace(tmp, ruta)
+
+def _leer_diario(ruta):
+    ops = []
+    if not os.path.exists(ruta): return ops
+    with open(ruta, 'r') as f:
+        for linea in f:
+            try: ops.append(json.loads(linea))
+            except ValueError: log.warning("Línea ilegible en %s (escritura cortada): se ignora", ruta)
+    return ops
+
+def mes_de(fecha): return fecha[:7]
+
+def _es_de_fecha(op):
+    return len(op["ruta"]) >= 3 and op["ruta"][1] in SECCIONES_FECHA
+
+def _validar(op):
+    # Las secciones por fecha viven repartidas en segmentos: se modifican día a día
+    ruta = op["ruta"]
+    if ruta[0] != "configuracion_rutina" and (len(ruta) == 1 or (len(ruta) == 2 and ruta[1] in SECCIONES_FECHA)):
+        raise ValueError(f"Operación demasiado amplia para el diario: {ruta} (usa guardar())")
+
+# --- MAPA PEREZOSO POR SEGMENTOS ---
+class MapaSegmentado(MutableMapping):
+    # fecha -> valor. Carga cada segmento (un mes, o un día en SQLite) al primer
+    # acceso y mantiene solo los más recientes en memoria (LRU).
+    def __init__(self, cargar_segmento, listar_segmentos, segmento=mes_de, capacidad=24, lock=None):
+        self._cargar_segmento = cargar_segmento
+        self._listar_segmentos = listar_segmentos
+        self._segmento = segmento
+        self.capacidad = capacidad
+        self._residentes = OrderedDict()
+        self._lock = lock or threading.RLock()  # el del almacén: cargar/desalojar no se cruza con una mutación
+
+    def _seg(self, clave):
+        with self._lock:
+            if clave in self._residentes:
+                self._residentes.move_to_end(clave)
+                return self._residentes[clave]
+            datos = self._cargar_segmento(clave)
+            self._residentes[clave] = datos
+            while len(self._residentes) > self.capacidad: self._residentes.popitem(last=False)
+            return datos
+
+    def __getitem__(self, fecha): return self._seg(self._segmento(fecha))[fecha]
+    def __setitem__(self, fecha, valor): self._seg(self._segmento(fecha))[fecha] = valor
+    def __delitem__(self, fecha): del self._seg(self._segmento(fecha))[fecha]
+    def __contains__(self, fecha): return isinstance(fecha, str) and fecha in self._seg(self._segmento(fecha))
+
+    def __iter__(self):
+        with self._lock: claves = set(self._listar_segmentos()) | set(self._residentes)
+        for clave in sorted(claves): yield from sorted(self._seg(clave))
+
+    def __len__(self): return sum(1 for _ in self)
+
+    def entre(self, desde, hasta):
+        # Fechas de [desde, hasta] en orden; solo carga los segmentos que caen dentro
+        inicio, fin = self._segmento(desde), self._segmento(hasta)
+        with self._lock: claves = {c for c in set(self._listar_segmentos()) | set(self._residentes) if inicio <= c <= fin}
+        for clave in sorted(claves): yield from sorted(f for f in self._seg(clave) if desde <= f <= hasta)
+
+    def residentes(self):
+        with self._lock: return list(self._residentes)
+
+# --- BLOQUEO ENTRE PROCESOS Y FUSIÓN DE CAMBIOS CONCURRENTES ---
+@contextmanager
+def _bloqueo(ruta):
+    # flock es por descriptor: no anidar dos bloqueos del mismo archivo en un proceso
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta, 'a') as f:
+        if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+        try: yield
+        finally:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+
+def _reparar_cola(f):
+    # Una escritura cortada deja la última línea sin "\n"; lo que se anexara detrás
+    # quedaría pegado a ella e ilegible. Si la línea está completa se cierra, si no se recorta.
+    f.seek(0, os.SEEK_END); fin = f.tell()
+    if not fin: return
+    f.seek(fin - 1)
+    if f.read(1) == b"\n": return
+    inicio = fin
+    while inicio > 0:
+        paso = min(65536, inicio); inicio -= paso
+        f.seek(inicio)
+        i = f.read(paso).rfind(b"\n")
+        if i >= 0: inicio += i + 1; break
+    f.seek(inicio)
+    try: json.loads(f.read()); f.write(b"\n")
+    except ValueError:
+        log.warning("Diario %s cortado a mitad de línea: se recortan %d bytes", f.name, fin - inicio)
+        f.truncate(inicio)
+
+def _anexar_diario(ruta, ops):
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with open(ruta, 'a+b') as f: _reparar_cola(f)
+    with open(ruta, 'a') as f:
+        f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops))
+        f.flush(); os.fsync(f.fileno())
+
+def _reescribir_diario(ruta, ops):
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    tmp = ruta + ".tmp"
+    with open(tmp, 'w') as f:
+        f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops))
+        f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, ruta)
+
+def _ultima_seq(ruta):
+    # Solo se lee la cola del diario
+    try: f = open(ruta, 'rb')
+    except FileNotFoundError: return 0
+    with f:
+        f.seek(0, os.SEEK_END); fin = f.tell()
+        f.seek(max(0, fin - 65536))
+        lineas = f.read().splitlines()
+    for linea in reversed(lineas):
+        try: return json.loads(linea)["seq"]
+        except ValueError: continue
+    ops = _leer_diario(ruta) if fin > 65536 else []  # una sola línea enorme
+    return ops[-1]["seq"] if ops else 0
+
+def _firma_de(*rutas):
+    firma = []
+    for ruta in rutas:
+        try: st = os.stat(ruta); firma.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError: firma.append(None)
+    return tuple(firma)
+
+def en_conflicto(op, remotas):
+    # Dos cambios chocan si uno toca la ruta del otro o una que la contiene, salvo que
+    # ambos añadan/quiten en una lista: esos se aplican los dos. Devuelve el remoto.
+    for r in remotas:
+        n = min(len(op["ruta"]), len(r["ruta"]))
+        if op["ruta"][:n] == r["ruta"][:n] and not (op["op"] in CONMUTATIVAS and r["op"] in CONMUTATIVAS):
+            return r
+    return None
+
+def _tomar_conflictos(conflictos, usuario):
+    propios = [c for c in conflictos if c["usuario"] == usuario]
+    conflictos[:] = [c for c in conflictos if c["usuario"] != usuario]
+    return propios
+
+# --- ALMACÉN JSON (UN DIRECTORIO Y UN DIARIO POR USUARIO) ---
+# historial_mega_panel_pro/
+#   configuracion_rutina.json           compartida; "_version" se incrementa en cada escritura
+#   <usuario>/perfil.json               datos no fechados del usuario
+#   <usuario>/<seccion>/<AAAA-MM>.json  un archivo por mes y sección por fecha
+#   <usuario>/diario.jsonl              operaciones aún no volcadas a perfil/segmentos
+# historial_mega_panel_pro.lock         bloqueo de la configuración y de las migraciones
+# Cada usuario numera sus operaciones (su versión) y cada archivo guarda "_seq", la
+# última que ya contiene. Escribir es compare-and-swap bajo flock: si la versión en
+# disco no es la que conocíamos, otro proceso ha escrito; sus cambios se conservan y
+# los nuestros que choquen con ellos se descartan y se notifican.
+class CuentaJSON:
+    def __init__(self, almacen, usuario):
+        self.almacen = almacen
+        self.usuario = usuario
+        self.directorio = os.path.join(almacen.directorio, usuario)
+        self.ruta_perfil = os.path.join(self.directorio, "perfil.json")
+        self.ruta_diario = os.path.join(self.directorio, "diario.jsonl")
+        self.ruta_bloqueo = os.path.join(self.directorio, ".lock")
+        self.version = 0          # última versión en disco conocida (propia o ajena)
+        self.seq_compactado = 0   # "_seq" del perfil
+        self.remotas = []         # cambios de otros procesos que la memoria aún no tiene
+        self.recargar = False
+        self._pendientes = {}     # (seccion, mes) -> ops aún no volcadas a segmentos
+        self._lock_archivos = threading.Lock()
+        self._compactando = None
+        self._firma_conocida = (None, None)  # aún sin archivos: cambia solo si otro proceso los crea
+
+    def _firma(self): return _firma_de(self.ruta_perfil, self.ruta_diario)
+
+    def cambios_externos(self):
+        if self._lock_archivos.locked(): return False
+        return self.recargar or self._firma() != self._firma_conocida
+
+    def _ruta_segmento(self, seccion, mes):
+        return os.path.join(self.directorio, seccion, mes + ".json")
+
+    def _version_disco(self):
+        seq = _ultima_seq(self.ruta_diario)
+        if seq: return seq
+        perfil = _leer_json(self.ruta_perfil) or {}
+        return perfil.get("_seq", 0)
+
+    def _indexar(self, op):
+        _, seccion, fecha = op["ruta"][:3]
+        self._pendientes.setdefault((seccion, mes_de(fecha)), []).append(op)
+
+    def _cargar_segmento(self, seccion, mes):
+        with self.almacen.lock:
+            datos = _leer_json(self._ruta_segmento(seccion, mes)) or {}
+            seq_seg = datos.pop("_seq", 0)
+            for op in self._pendientes.get((seccion, mes), []):
+                if op.get("descartada"): continue
+                if op.get("seq") is None or op["seq"] > seq_seg: aplicar_op(datos, dict(op, ruta=op["ruta"][2:]))
+            return datos
+
+    def _listar_segmentos(self, seccion):
+        carpeta = os.path.join(self.directorio, seccion)
+        meses = set()
+        if os.path.isdir(carpeta):
+            meses.update(n[:-5] for n in os.listdir(carpeta) if n.endswith(".json"))
+        with self.almacen.lock:
+            meses.update(m for (s, m) in self._pendientes if s == seccion)
+        return sorted(meses)
+
+    def _volcar(self, datos_u, seq):
+        # Perfil + segmentos completos con _seq = seq (los meses que ya no existen quedan vacíos)
+        perfil, segmentos = {}, {}
+        for seccion, contenido in datos_u.items():
+            if seccion not in SECCIONES_FECHA: perfil[seccion] = contenido; continue
+            for fecha, v in contenido.items(): segmentos.setdefault((seccion, mes_de(fecha)), {})[fecha] = v
+        for seccion in SECCIONES_FECHA:
+            carpeta = os.path.join(self.directorio, seccion)
+            if os.path.isdir(carpeta):
+                for n in os.listdir(carpeta):
+                    if n.endswith(".json"): segmentos.setdefault((seccion, n[:-5]), {})
+        for (seccion, mes), contenido in segmentos.items():
+            _escribir_json(self._ruta_segmento(seccion, mes), dict(contenido, _seq=seq))
+        _escribir_json(self.ruta_perfil, dict(perfil, _seq=seq), indent=4)
+
+    def cargar(self):
+        # Llamar con el lock del almacén tomado
+        perfil = _leer_json(self.ruta_perfil) or {}
+        self.seq_compactado = perfil.pop("_seq", 0)
+        ops = _leer_diario(self.ruta_diario)
+        self._pendientes = {}
+        for op in ops:
+            if _es_de_fecha(op): self._indexar(op)
+            elif op["seq"] > self.seq_compactado: aplicar_op({self.usuario: perfil}, op)
+        self.version = max([self.seq_compactado] + [op["seq"] for op in ops])
+        self.remotas, self.recargar = [], False
+        self._firma_conocida = self._firma()
+        for seccion in SECCIONES_FECHA:
+            perfil[seccion] = MapaSegmentado(lambda mes, s=seccion: self._cargar_segmento(s, mes), lambda s=seccion: self._listar_segmentos(s),
+                                             capacidad=self.almacen.meses_residentes, lock=self.almacen.lock)
+        return perfil
+
+    def escribir(self, ops):
+        with self._lock_archivos, _bloqueo(self.ruta_bloqueo):
+            version = self._version_disco()
+            if version > self.version:
+                # Si otra compactación ya recortó parte del diario no se ven todos, pero se recarga igual
+                nuevas = [op for op in _leer_diario(self.ruta_diario) if op["seq"] > self.version]
+                with self.almacen.lock: self.remotas.extend(nuevas); self.recargar = True
+            numeradas = []
+            with self.almacen.lock:
+                for op in ops:
+                    if op.get("descartada") or op.get("seq") is not None: continue  # descartada o ya escrita en un intento anterior
+                    remota = self.remotas and en_conflicto(op, self.remotas)
+                    if remota:
+                        op["descartada"] = True
+                        self.almacen.conflictos.append({"usuario": self.usuario, "ruta": op["ruta"], "op": op["op"], "remota": remota["op"]})
+                        log.warning("Conflicto en %s: se conserva el cambio de otra sesión", op["ruta"])
+                        continue
+                    version += 1
+                    numeradas.append((op, version))
+            if numeradas: _anexar_diario(self.ruta_diario, [dict(op, seq=v) for op, v in numeradas])
+            with self.almacen.lock:
+                for op, v in numeradas: op["seq"] = v
+                self.version = version
+                self._firma_conocida = self._firma()
+        if self.version - self.seq_compactado >= self.almacen.umbral_compactacion and not self._compactando:
+            self._compactando = threading.Thread(target=self.compactar, daemon=True)
+            self._compactando.start()
+
+    def compactar(self):
+        # Vuelca el diario en disco sobre el perfil y solo los segmentos que ha tocado
+        try:
+            with self._lock_archivos, _bloqueo(self.ruta_bloqueo):
+                perfil = _leer_json(self.ruta_perfil) or {}
+                anterior = perfil.pop("_seq", 0)
+                ops = [op for op in _leer_diario(self.ruta_diario) if op["seq"] > anterior]
+                if not ops: return
+                corte = ops[-1]["seq"]
+                por_segmento = {}
+                for op in ops:
+                    if _es_de_fecha(op): por_segmento.setdefault((op["ruta"][1], mes_de(op["ruta"][2])), []).append(op)
+                    else: aplicar_op({self.usuario: perfil}, op)
+                for (seccion, mes), lista in por_segmento.items():
+                    ruta = self._ruta_segmento(seccion, mes)
+                    seg = _leer_json(ruta) or {}
+                    seq_seg = seg.pop("_seq", 0)
+                    for op in lista:
+                        if op["seq"] > seq_seg: aplicar_op(seg, dict(op, ruta=op["ruta"][2:]))
+                    _escribir_json(ruta, dict(seg, _seq=corte))
+                _escribir_json(self.ruta_perfil, dict(perfil, _seq=corte), indent=4)
+                # Se conserva desde la compactación anterior para que los .bak + diario
+                # sigan siendo un estado completo si algo se daña
+                _reescribir_diario(self.ruta_diario, ops)
+                with self.almacen.lock:
+                    for clave in list(self._pendientes):
+                        self._pendientes[clave] = [op for op in self._pendientes[clave]
+                                                   if not op.get("descartada") and (op.get("seq") is None or op["seq"] > corte)]
+                        if not self._pendientes[clave]: del self._pendientes[clave]
+                    self.seq_compactado = corte
+                    if corte > self.version: self.recargar = True  # incluía cambios ajenos sin leer
+                    self._firma_conocida = self._firma()
+        finally:
+            self._compactando = None
+
+    def guardar(self, datos_u):
+        # Reescritura completa desde memoria: perfil y segmentos pasan a ser la verdad
+        with self._lock_archivos, _bloqueo(self.ruta_bloqueo):
+            version = max(self._version_disco(), self.version)
+            self._volcar(datos_u, version)
+            _reescribir_diario(self.ruta_diario, [])
+            with self.almacen.lock:
+                self._pendientes = {}
+                self.version = self.seq_compactado = version
+                self._firma_conocida = self._firma()
+
+class AlmacenJSON:
+    def __init__(self, ruta_datos, umbral_compactacion=UMBRAL_COMPACTACION, meses_residentes=MESES_RESIDENTES):
+        self.ruta_legado = ruta_datos
+        self.directorio = os.path.splitext(ruta_datos)[0]
+        self.ruta_config = os.path.join(self.directorio, "configuracion_rutina.json")
+        self.ruta_bloqueo = self.directorio + ".lock"
+        self.umbral_compactacion = umbral_compactacion
+        self.meses_residentes = meses_residentes
+        self.lock = threading.RLock()
+        self.cuentas = {}
+        self.conflictos = []      # cambios propios descartados por chocar con los de otra sesión
+        self.version_config = 0
+        self.recargar_config = False
+        self._firma_config = (None,)
+
+    def cuenta(self, usuario):
+        with self.lock:
+            if usuario not in self.cuentas: self.cuentas[usuario] = CuentaJSON(self, usuario)
+            return self.cuentas[usuario]
+
+    def _usuarios_en_disco(self):
+        if not os.path.isdir(self.directorio): return set()
+        return {u for u in os.listdir(self.directorio) if not u.startswith(".") and os.path.isdir(os.path.join(self.directorio, u))}
+
+    def cambios_externos(self):
+        # ¿Otro proceso ha tocado los archivos desde nuestra última lectura/escritura?
+        with self.lock:
+            if self.recargar_config or _firma_de(self.ruta_config) != self._firma_config: return True
+            if not self._usuarios_en_disco() <= set(self.cuentas): return True
+            return any(c.cambios_externos() for c in self.cuentas.values())
+
+    def tomar_conflictos(self, usuario):
+        with self.lock: return _tomar_conflictos(self.conflictos, usuario)
+
+    def _escribir_config(self, valor, version):
+        if valor is None:
+            if os.path.exists(self.ruta_config): os.remove(self.ruta_config)
+        else: _escribir_json(self.ruta_config, dict(valor, _version=version), indent=4)
+        self.version_config = version
+        self._firma_config = _firma_de(self.ruta_config)
+
+    def _migrar_legado(self):
+        # Formato original: un único historial_mega_panel_pro.json (+ su diario)
+        datos = _leer_json(self.ruta_legado) or {}
+        seq = datos.pop("_seq", 0)
+        for op in _leer_diario(os.path.splitext(self.ruta_legado)[0] + ".diario.jsonl"):
+            if op["seq"] > seq: aplicar_op(datos, op); seq = op["seq"]
+        self._escribir_config(datos.pop("configuracion_rutina", None), 0)
+        for u, datos_u in datos.items(): self.cuenta(u)._volcar(datos_u, 0)
+        log.info("Migrado %s a archivos por usuario en %s", self.ruta_legado, self.directorio)
+
+    def _migrar_base_comun(self, ruta_base):
+        # Formato intermedio: base.json + diario.jsonl comunes a todos los usuarios. Los
+        # segmentos ya están en su sitio; sus _seq siguen valiendo como versión de cada usuario.
+        ruta_diario = os.path.join(self.directorio, "diario.jsonl")
+        base = _leer_json(ruta_base) or {}
+        seq = base.pop("_seq", 0)
+        config = {"configuracion_rutina": base.pop("configuracion_rutina")} if "configuracion_rutina" in base else {}
+        por_usuario = {u: [] for u in base}
+        for op in _leer_diario(ruta_diario):
+            if op["seq"] <= seq and not _es_de_fecha(op): continue
+            if op["ruta"][0] == "configuracion_rutina": aplicar_op(config, op)
+            else: por_usuario.setdefault(op["ruta"][0], []).append(op)
+        self._escribir_config(config.get("configuracion_rutina"), 0)
+        for u, ops in por_usuario.items():
+            c, perfil = self.cuenta(u), base.get(u, {})
+            for op in ops:
+                if not _es_de_fecha(op): aplicar_op({u: perfil}, op)
+            _reescribir_diario(c.ruta_diario, [op for op in ops if _es_de_fecha(op) and op["seq"] > seq])
+            _escribir_json(c.ruta_perfil, dict(perfil, _seq=seq), indent=4)
+        for ruta in (ruta_base, ruta_diario):
+            if os.path.exists(ruta): os.replace(ruta, ruta + ".migrado")
+        log.info("Migrado %s a archivos por usuario", ruta_base)
+
+    def cargar(self):
+        # Devuelve None si no hay nada persistido todavía
+        with _bloqueo(self.ruta_bloqueo), self.lock:
+            ruta_base = os.path.join(self.directorio, "base.json")
+            if os.path.exists(ruta_base): self._migrar_base_comun(ruta_base)
+            elif not os.path.isdir(self.directorio) and os.path.exists(self.ruta_legado): self._migrar_legado()
+            if not os.path.isdir(self.directorio): return None
+            datos = {}
+            config = _leer_json(self.ruta_config)
+            self.version_config = config.pop("_version", 0) if config else 0
+            if config is not None: datos["configuracion_rutina"] = config
+            self.recargar_config = False
+            self._firma_config = _firma_de(self.ruta_config)
+            for u in sorted(self._usuarios_en_disco()): datos[u] = self.cuenta(u).cargar()
+            return datos
+
+    def anotar(self, ops):
+        # Deja las operaciones visibles para los segmentos aún no cargados; el número
+        # de versión se les asigna al escribirlas
+        with self.lock:
+            for op in ops:
+                _validar(op)
+                if _es_de_fecha(op): self.cuenta(op["ruta"][0])._indexar(op)
+            return list(ops)
+
+    def escribir(self, ops):
+        por_clave = {}
+        for op in ops: por_clave.setdefault(op["ruta"][0], []).append(op)
+        for clave, lote in por_clave.items():
+            if clave == "configuracion_rutina": self._escribir_cambios_config(lote)
+            else: self.cuenta(clave).escribir(lote)
+
+    def _escribir_cambios_config(self, ops):
+        # La configuración es pequeña: leer-aplicar-escribir bajo flock, sin diario
+        with _bloqueo(self.ruta_bloqueo):
+            actual = _leer_json(self.ruta_config)
+            version = actual.pop("_version", 0) if actual else 0
+            if version != self.version_config: self.recargar_config = True
+            datos = {"configuracion_rutina": actual} if actual is not None else {}
+            nuevas = [op for op in ops if op.get("seq") is None]
+            for op in nuevas: aplicar_op(datos, op)
+            with self.lock:
+                self._escribir_config(datos.get("configuracion_rutina"), version + 1)
+                for op in nuevas: op["seq"] = version + 1
+
+    def registrar(self, ops):
+        self.escribir(self.anotar(ops))
+
+    def compactar(self):
+        for c in list(self.cuentas.values()): c.compactar()
+
+    def guardar(self, datos):
+        with _bloqueo(self.ruta_bloqueo):
+            actual = _leer_json(self.ruta_config)
+            version = actual.get("_version", 0) if actual else 0
+            with self.lock: self._escribir_config(datos.get("configuracion_rutina"), version + 1)
+        for clave, valor in datos.items():
+            if clave != "configuracion_rutina": self.cuenta(clave).guardar(valor)
+
+def hay_datos_json(ruta_datos):
+    return os.path.exists(ruta_datos) or os.path.isdir(os.path.splitext(ruta_datos)[0])
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS historial (usuario TEXT, fecha TEXT, tratamiento_id TEXT, orden INTEGER, hora TEXT, detalle TEXT);
+CREATE INDEX IF NOT EXISTS ix_historial ON historial (usuario, fecha, tratamiento_id);
+CREATE INDEX IF NOT EXISTS ix_historial_trat ON historial (usuario, tratamiento_id, fecha);
+CREATE TABLE IF NOT EXISTS descartados (usuario TEXT, fecha TEXT, tratamiento_id TEXT, orden INTEGER);
+CREATE INDEX IF NOT EXISTS ix_descartados ON descartados (usuario, fecha, tratamiento_id);
+CREATE TABLE IF NOT EXISTS planificados_adhoc (usuario TEXT, fecha TEXT, tratamiento_id TEXT, momento TEXT);
+CREATE INDEX IF NOT EXISTS ix_planificados ON planificados_adhoc (usuario, fecha, tratamiento_id);
+CREATE TABLE IF NOT EXISTS meta_diaria (usuario TEXT, fecha TEXT, rutinas TEXT, PRIMARY KEY (usuario, fecha));
+CREATE TABLE IF NOT EXISTS meta_cardio (usuario TEXT, fecha TEXT, params TEXT, PRIMARY KEY (usuario, fecha));
+CREATE TABLE IF NOT EXISTS confirmaciones_diarias (usuario TEXT, fecha TEXT, confirmado INTEGER, PRIMARY KEY (usuario, fecha));
+CREATE TABLE IF NOT EXISTS ciclos_activos (usuario TEXT, tratamiento_id TEXT, datos TEXT, PRIMARY KEY (usuario, tratamiento_id));
+CREATE TABLE IF NOT EXISTS tratamientos_custom (usuario TEXT, id TEXT, orden INTEGER, datos TEXT);
+CREATE INDEX IF NOT EXISTS ix_custom ON tratamientos_custom (usuario, id);
+CREATE TABLE IF NOT EXISTS ajustes (clave TEXT PRIMARY KEY, valor TEXT);
+CREATE TABLE IF NOT EXISTS versiones (usuario TEXT PRIMARY KEY, version INTEGER);
+CREATE TABLE IF NOT EXISTS cambios (usuario TEXT, version INTEGER, op TEXT, ruta TEXT, PRIMARY KEY (usuario, version));
+"""
+
+class AlmacenSQLite:
+    def __init__(self, ruta_db):
+        self.ruta_db = ruta_db
+        self.lock = threading.RLock()
+        self._pendientes = {}  # (usuario, seccion, fecha) -> ops anotadas aún sin confirmar en la BD
+        self._conn = sqlite3.connect(ruta_db, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(ESQUEMA_SQLITE)
+        self._version_vista = None
+        self._versiones = {}   # usuario -> última versión conocida
+        self.remotas = {}      # usuario -> cambios de otras conexiones que la memoria aún no tiene
+        self.recargar = False
+        self.conflictos = []
+
+    def _data_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def cambios_externos(self):
+        # data_version solo cambia cuando confirma otra conexión
+        with self.lock: return self.recargar or self._data_version() != self._version_vista
+
+    def tomar_conflictos(self, usuario):
+        with self.lock: return _tomar_conflictos(self.conflictos, usuario)
+
+    # --- Lectura por unidad (un día de una sección, un ciclo, una lista) ---
+    def _leer_fecha(self, usuario, seccion, fecha):
+        q = lambda sql: self._conn.execute(sql, (usuario, fecha)).fetchall()
+        with self.lock:
+            if seccion == "historial":
+                dia = {}
+                for tid, hora, detalle in q("SELECT tratamiento_id, hora, detalle FROM historial WHERE usuario=? AND fecha=? ORDER BY rowid"):
+                    # Como en JSON: los campos que no se guardaron no aparecen (NULL no es None)
+                    dia.setdefault(tid, []).append({k: v for k, v in (("hora", hora), ("detalle", detalle)) if v is not None})
+                return dia or None
+            if seccion == "descartados":
+                return [r[0] for r in q("SELECT tratamiento_id FROM descartados WHERE usuario=? AND fecha=? ORDER BY rowid")] or None
+            if seccion == "planificados_adhoc":
+                return dict(q("SELECT tratamiento_id, momento FROM planificados_adhoc WHERE usuario=? AND fecha=? ORDER BY rowid")) or None
+            if seccion == "confirmaciones_diarias":
+                filas = q("SELECT confirmado FROM confirmaciones_diarias WHERE usuario=? AND fecha=?")
+                return bool(filas[0][0]) if filas else None
+            columna = "rutinas" if seccion == "meta_diaria" else "params"
+            filas = q(f"SELECT {columna} FROM {seccion} WHERE usuario=? AND fecha=?")
+            return json.loads(filas[0][0]) if filas else None
+
+    def _escribir_fecha(self, usuario, seccion, fecha, valor):
+        ex = self._conn.execute
+        ex(f"DELETE FROM {seccion} WHERE usuario=? AND fecha=?", (usuario, fecha))
+        if valor is None: return
+        if seccion == "historial":
+            self._conn.executemany("INSERT INTO historial VALUES (?,?,?,?,?,?)",
+                [(usuario, fecha, tid, i, e.get("hora"), e.get("detalle")) for tid, entradas in valor.items() for i, e in enumerate(entradas)])
+        elif seccion == "descartados":
+            self._conn.executemany("INSERT INTO descartados VALUES (?,?,?,?)", [(usuario, fecha, tid, i) for i, tid in enumerate(valor)])
+        elif seccion == "planificados_adhoc":
+            self._conn.executemany("INSERT INTO planificados_adhoc VALUES (?,?,?,?)", [(usuario, fecha, tid, m) for tid, m in valor.items()])
+        elif seccion == "confirmaciones_diarias":
+            ex("INSERT INTO confirmaciones_diarias VALUES (?,?,?)", (usuario, fecha, int(bool(valor))))
+        else:
+            ex(f"INSERT INTO {seccion} VALUES (?,?,?)", (usuario, fecha, json.dumps(valor, ensure_ascii=False)))
+
+    def _listar_fechas(self, usuario, seccion):
+        with self.lock:
+            fechas = {r[0] for r in self._conn.execute(f"SELECT DISTINCT fecha FROM {seccion} WHERE usuario=?", (usuario,))}
+            fechas.update(f for (u, s, f) in self._pendientes if u == usuario and s == seccion)
+            return sorted(fechas)
+
+    def _cargar_segmento(self, usuario, seccion, fecha):
+        # Un día: filas de la BD + operaciones encoladas que aún no se han confirmado
+        with self.lock:
+            unidad = {}
+            valor = self._leer_fecha(usuario, seccion, fecha)
+            if valor is not None: unidad[fecha] = valor
+            for op in self._pendientes.get((usuario, seccion, fecha), []):
+                if not op.get("descartada"): aplicar_op(unidad, dict(op, ruta=op["ruta"][2:]))
+            return unidad
+
+    def _leer_ciclo(self, usuario, tid):
+        filas = self._conn.execute("SELECT datos FROM ciclos_activos WHERE usuario=? AND tratamiento_id=?", (usuario, tid)).fetchall()
+        return json.loads(filas[0][0]) if filas else None
+
+    def _escribir_ciclo(self, usuario, tid, valor):
+        self._conn.execute("DELETE FROM ciclos_activos WHERE usuario=? AND tratamiento_id=?", (usuario, tid))
+        if valor is not None:
+            self._conn.execute("INSERT INTO ciclos_activos VALUES (?,?,?)", (usuario, tid, json.dumps(valor, ensure_ascii=False)))
+
+    def _leer_custom(self, usuario):
+        return [json.loads(r[0]) for r in self._conn.execute("SELECT datos FROM tratamientos_custom WHERE usuario=? ORDER BY orden", (usuario,))]
+
+    def _escribir_custom(self, usuario, lista):
+        self._conn.execute("DELETE FROM tratamientos_custom WHERE usuario=?", (usuario,))
+        self._conn.executemany("INSERT INTO tratamientos_custom VALUES (?,?,?,?)",
+            [(usuario, c.get("id"), i, json.dumps(c, ensure_ascii=False)) for i, c in enumerate(lista or [])])
+
+    def _leer_ajuste(self, clave):
+        filas = self._conn.execute("SELECT valor FROM ajustes WHERE clave=?", (clave,)).fetchall()
+        return json.loads(filas[0][0]) if filas else None
+
+    def _escribir_ajuste(self, clave, valor):
+        self._conn.execute("DELETE FROM ajustes WHERE clave=?", (clave,))
+        if valor is not None:
+            self._conn.execute("INSERT INTO ajustes VALUES (?,?)", (clave, json.dumps(valor, ensure_ascii=False)))
+
+    def _usuarios(self):
+        usuarios = set()
+        for tabla in SECCIONES_FECHA + ("ciclos_activos", "tratamientos_custom"):
+            usuarios.update(r[0] for r in self._conn.execute(f"SELECT DISTINCT usuario FROM {tabla}"))
+        for (clave,) in self._conn.execute("SELECT clave FROM ajustes"):
+            ruta = json.loads(clave)
+            if len(ruta) > 1: usuarios.add(ruta[0])
+        return usuarios
+
+    # --- Interfaz común ---
+    def cargar(self):
+        with self.lock:
+            self._version_vista = self._data_version()
+            self._versiones = dict(self._conn.execute("SELECT usuario, version FROM versiones"))
+            self.remotas, self.recargar = {}, False
+            usuarios = self._usuarios()
+            config = self._leer_ajuste(json.dumps(["configuracion_rutina"]))
+            if not usuarios and config is None: return None
+            datos = {}
+            if config is not None: datos["configuracion_rutina"] = config
+            for u in usuarios:
+                db_u = {}
+                for seccion in SECCIONES_FECHA:
+                    db_u[seccion] = MapaSegmentado(lambda f, u=u, s=seccion: self._cargar_segmento(u, s, f), lambda u=u, s=seccion: self._listar_fechas(u, s),
+                                                   segmento=lambda fecha: fecha, capacidad=DIAS_RESIDENTES, lock=self.lock)
+                db_u["ciclos_activos"] = {tid: json.loads(v) for tid, v in self._conn.execute("SELECT tratamiento_id, datos FROM ciclos_activos WHERE usuario=?", (u,))}
+                db_u["tratamientos_custom"] = self._leer_custom(u)
+                for (clave,) in self._conn.execute("SELECT clave FROM ajustes").fetchall():
+                    ruta = json.loads(clave)
+                    if len(ruta) == 2 and ruta[0] == u: db_u[ruta[1]] = self._leer_ajuste(clave)
+                datos[u] = db_u
+            return datos
+
+    def _persistir(self, op):
+        # Lee la unidad afectada, le aplica la operación y la reescribe entera
+        ruta = op["ruta"]
+        if len(ruta) >= 3 and ruta[1] in SECCIONES_FECHA:
+            u, seccion, fecha = ruta[:3]
+            unidad = {}
+            actual = self._leer_fecha(u, seccion, fecha)
+            if actual is not None: unidad[fecha] = actual
+            aplicar_op(unidad, dict(op, ruta=ruta[2:]))
+            self._escribir_fecha(u, seccion, fecha, unidad.get(fecha))
+        elif len(ruta) >= 3 and ruta[1] == "ciclos_activos":
+            u, _, tid = ruta[:3]
+            unidad = {}
+            actual = self._leer_ciclo(u, tid)
+            if actual is not None: unidad[tid] = actual
+            aplicar_op(unidad, dict(op, ruta=ruta[2:]))
+            self._escribir_ciclo(u, tid, unidad.get(tid))
+        elif len(ruta) >= 2 and ruta[1] == "tratamientos_custom":
+            unidad = {"lista": self._leer_custom(ruta[0])}
+            aplicar_op(unidad, dict(op, ruta=["lista"] + ruta[2:]))
+            self._escribir_custom(ruta[0], unidad.get("lista"))
+        elif len(ruta) >= 2 and ruta[1] in SECCIONES_FECHA:
+            # Sección completa reemplazada (p.ej. al migrar)
+            u, seccion = ruta[:2]
+            unidad = {}
+            aplicar_op(unidad, dict(op, ruta=["s"] + ruta[2:]))
+            self._conn.execute(f"DELETE FROM {seccion} WHERE usuario=?", (u,))
+            for fecha, valor in (unidad.get("s") or {}).items(): self._escribir_fecha(u, seccion, fecha, valor)
+        elif len(ruta) >= 2 and ruta[1] == "ciclos_activos":
+            unidad = {}
+            aplicar_op(unidad, dict(op, ruta=["s"] + ruta[2:]))
+            self._conn.execute("DELETE FROM ciclos_activos WHERE usuario=?", (ruta[0],))
+            for tid, valor in (unidad.get("s") or {}).items(): self._escribir_ciclo(ruta[0], tid, valor)
+        else:
+            # Resto (configuración, ocultos...): valor JSON bajo la ruta de primer/segundo nivel
+            raiz = ruta[:1] if ruta[0] == "configuracion_rutina" else ruta[:2]
+            clave = json.dumps(raiz, ensure_ascii=False)
+            unidad = {}
+            actual = self._leer_ajuste(clave)
+            if actual is not None: unidad["v"] = actual
+            aplicar_op(unidad, dict(op, ruta=["v"] + ruta[len(raiz):]))
+            self._escribir_ajuste(clave, unidad.get("v"))
+
+    def anotar(self, ops):
+        with self.lock:
+            for op in ops:
+                if _es_de_fecha(op): self._pendientes.setdefault(tuple(op["ruta"][:3]), []).append(op)
+            return list(ops)
+
+    def _comprobar_version(self, usuario):
+        # Dentro de la transacción: si otra conexión avanzó la versión, se recogen sus cambios
+        fila = self._conn.execute("SELECT version FROM versiones WHERE usuario=?", (usuario,)).fetchone()
+        version = fila[0] if fila else 0
+        if version > self._versiones.get(usuario, 0):
+            filas = self._conn.execute("SELECT op, ruta FROM cambios WHERE usuario=? AND version>? ORDER BY version", (usuario, self._versiones.get(usuario, 0)))
+            self.remotas.setdefault(usuario, []).extend({"op": op, "ruta": json.loads(ruta)} for op, ruta in filas)
+            self.recargar = True
+            self._versiones[usuario] = version
+        return version
+
+    def escribir(self, ops):
+        with self.lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                versiones, cambios = {}, []
+                for op in ops:
+                    if op.get("descartada"): continue
+                    u = op["ruta"][0]
+                    if u not in versiones: versiones[u] = self._comprobar_version(u)
+                    remota = en_conflicto(op, self.remotas.get(u, []))
+                    if remota:
+                        op["descartada"] = True
+                        self.conflictos.append({"usuario": u, "ruta": op["ruta"], "op": op["op"], "remota": remota["op"]})
+                        log.warning("Conflicto en %s: se conserva el cambio de otra sesión", op["ruta"])
+                        continue
+                    self._persistir(op)
+                    versiones[u] += 1
+                    cambios.append((u, versiones[u], op["op"], json.dumps(op["ruta"], ensure_ascii=False)))
+                self._conn.executemany("INSERT INTO cambios VALUES (?,?,?,?)", cambios)
+                for u, v in versiones.items():
+                    self._conn.execute("INSERT OR REPLACE INTO versiones VALUES (?,?)", (u, v))
+                    self._conn.execute("DELETE FROM cambios WHERE usuario=? AND version<=?", (u, v - CAMBIOS_RETENIDOS))
+                self._conn.execute("COMMIT")
+            except:
+                self._conn.execute("ROLLBACK"); raise
+            self._versiones.update(versiones)
+            # Lo anterior a la última op confirmada de cada día ya está en la BD (o se fusionó en la cola)
+            ultimas = {}
+            for op in ops:
+                if _es_de_fecha(op) and not op.get("descartada"): ultimas[tuple(op["ruta"][:3])] = op
+            for clave, op in ultimas.items():
+                lista = self._pendientes.get(clave, [])
+                corte = next((i for i, x in enumerate(lista) if x is op), None)
+                if corte is not None: del lista[:corte + 1]
+            for op in ops:
+                clave = tuple(op["ruta"][:3])
+                if _es_de_fecha(op) and clave in self._pendientes:
+                    self._pendientes[clave] = [x for x in self._pendientes[clave] if not x.get("descartada")]
+                    if not self._pendientes[clave]: del self._pendientes[clave]
+
+    def registrar(self, ops):
+        self.escribir(self.anotar(ops))
+
+    def compactar(self):
+        with self.lock: self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def guardar(self, datos):
+        # Reescritura completa (usada por el migrador)
+        ops = []
+        for clave, valor in datos.items():
+            if clave == "configuracion_rutina": ops.append(op_fijar([clave], valor)); continue
+            for seccion, contenido in valor.items():
+                ops.append(op_fijar([clave, seccion], dict(contenido) if isinstance(contenido, MutableMapping) else contenido))
+        with self.lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for tabla in SECCIONES_FECHA + ("ciclos_activos", "tratamientos_custom", "ajustes"):
+                    self._conn.execute(f"DELETE FROM {tabla}")
+                for op in ops: self._persistir(op)
+                self._conn.execute("COMMIT")
+            except:
+                self._conn.execute("ROLLBACK"); raise
+
+# --- COLA DE ESCRITURA (WRITE-BEHIND) ---
+def _encolar(pendientes, op):
+    # Ráfagas sobre la misma ruta (p.ej. number_input del cardio) se quedan en la última
+    if pendientes and op["op"] in ("set", "del"):
+        previa = pendientes[-1]
+        if previa["op"] in ("set", "del") and previa["ruta"] == op["ruta"]:
+            previa["descartada"] = True  # los almacenes la ignoran al reconstruir segmentos
+            pendientes[-1] = op; return
+    pendientes.append(op)
+
+class ColaEscritura:
+    def __init__(self, destino, ventana=VENTANA_ESCRITURA, espera_maxima=ESPERA_MAXIMA):
+        self.destino = destino
+        self.ventana = ventana
+        self.espera_maxima = espera_maxima
+        self.ultimo_error = None
+        self._pendientes = []
+        self._escribiendo = False
+        self._forzar = False
+        self._primero = self._ultimo = 0.0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._bucle, daemon=True, name="mega-panel-escritor").start()
+        atexit.register(self.vaciar)
+
+    def registrar(self, ops):
+        congeladas = json.loads(json.dumps(list(ops)))  # la memoria puede seguir mutando
+        with self.destino.lock, self._cond:
+            anotadas = self.destino.anotar(congeladas)
+            ahora = time.monotonic()
+            if not self._pendientes: self._primero = ahora
+            self._ultimo = ahora
+            for op in anotadas: _encolar(self._pendientes, op)
+            self._cond.notify_all()
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while not self._pendientes: self._cond.wait()
+                while not self._forzar:
+                    restante = min(self._ultimo + self.ventana, self._primero + self.espera_maxima) - time.monotonic()
+                    if restante <= 0: break
+                    self._cond.wait(restante)
+                lote, self._pendientes = self._pendientes, []
+                self._escribiendo = True
+            error = reintentar = None
+            try: self.destino.escribir(lote)
+            except (OSError, sqlite3.OperationalError) as e:
+                error = reintentar = e; log.exception("Fallo al persistir %d cambios; se reintentará", len(lote))
+            except Exception as e:
+                # Un lote que nunca podrá escribirse no debe bloquear los siguientes
+                error = e; log.exception("Descartados %d cambios que no se pueden persistir", len(lote))
+                for op in lote:
+                    if op.get("seq") is None: op["descartada"] = True
+            with self._cond:
+                self._escribiendo = False
+                self.ultimo_error = error
+                if reintentar:
+                    self._pendientes[:0] = lote
+                    self._primero = self._ultimo = time.monotonic()
+                self._cond.notify_all()
+            if reintentar: time.sleep(self.ventana)
+
+    def vaciar(self, timeout=10):
+        # Bloquea hasta que todo lo encolado esté en disco; False si no se consiguió
+        with self._cond:
+            self._forzar = True
+            self._cond.notify_all()
+            ok = self._cond.wait_for(lambda: not self._pendientes and not self._escribiendo, timeout)
+            self._forzar = False
+        return ok
+
+    def cargar(self):
+        self.vaciar()
+        return self.destino.cargar()
+
+    def compactar(self):
+        if not self.vaciar(): raise ErrorAlmacen(f"No se pudieron guardar los cambios pendientes: {self.ultimo_error}")
+        self.destino.compactar()
+
+    def guardar(self, datos):
+        self.vaciar()
+        self.destino.guardar(datos)
+
+    def __getattr__(self, nombre):
+        return getattr(self.destino, nombre)
+
+# --- DATOS COMPARTIDOS POR PROCESO ---
+class DatosCompartidos:
+    # Un único árbol de datos por proceso para todas las sesiones. Las sesiones lo
+    # leen directamente y mutan solo con aplicar(), así que cada una ve al instante
+    # lo que hacen las demás. aplicar() copia en escritura: los contenedores que
+    # cambian se sustituyen por copias, de modo que quien está recorriendo uno (otra
+    # sesión, un trabajo en segundo plano) sigue viendo su versión sin bloquear.
+    # Si otro proceso toca el almacén (mtime del JSON o data_version de SQLite) se
+    # recarga en la siguiente lectura.
+    def __init__(self, almacen, cargar):
+        self.almacen = almacen
+        self._cargar = cargar
+        self._lock_recarga = threading.Lock()
+        self.version = 0
+        self.datos = None
+        self._observadores = []
+
+    def observar(self, funcion):
+        # funcion(datos, ops) tras cada mutación; ops es None cuando se recarga todo.
+        # Se llama fuera del lock del almacén: debe releer el estado, no reaplicar ops.
+        self._observadores.append(funcion)
+
+    def _avisar(self, datos, ops):
+        for funcion in self._observadores: funcion(datos, ops)
+
+    def obtener(self):
+        if self.datos is None or self.almacen.cambios_externos():
+            recargado = None
+            with self._lock_recarga:
+                if self.datos is None or self.almacen.cambios_externos():
+                    self.datos = recargado = self._cargar()
+                    self.version += 1
+            if recargado is not None: self._avisar(recargado, None)
+        return self.datos
+
+    def aplicar(self, ops):
+        # Memoria + anotación bajo el lock del almacén: ningún segmento se recarga entre medias
+        datos = self.obtener()
+        with self.almacen.lock:
+            for op in ops: aplicar_op_copiando(datos, op)
+            self.almacen.registrar(ops)
+            self.version += 1
+        self._avisar(datos, ops)
+
+# --- FACTORÍA Y MIGRACIÓN ---
+_almacenes = {}
+_almacenes_lock = threading.Lock()
+
+def abrir_almacen(tipo, ruta):
+    # Un único almacén por archivo y proceso: el módulo sobrevive a los reruns de Streamlit
+    clave = (tipo, os.path.abspath(ruta))
+    with _almacenes_lock:
+        if clave not in _almacenes:
+            _almacenes[clave] = ColaEscritura(AlmacenSQLite(ruta) if tipo == "sqlite" else AlmacenJSON(ruta))
+        return _almacenes[clave]
+
+def migrar_json_a_sqlite(ruta_json, ruta_sqlite):
+    datos = AlmacenJSON(ruta_json).cargar()
+    if datos is None: return False
+    AlmacenSQLite(ruta_sqlite).guardar(datos)
+    return True
+
+if __name__ == "__main__":
+    # python -m nucleo.almacen historial_mega_panel_pro.json historial_mega_panel_pro.sqlite
+    if len(sys.argv) != 3: sys.exit("Uso: python -m nucleo.almacen <origen.json> <destino.sqlite>")
+    print("Migrado." if migrar_json_a_sqlite(sys.argv[1], sys.argv[2]) else "Nada que migrar.")
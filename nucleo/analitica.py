@@ -0,0 +1,198 @@
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from .catalogo import catalogo_usuario
+from .persistencia import USUARIOS
+from .planificacion import MOMENTOS
+
+# ==============================================================================
+# ANALÍTICA DEL HISTORIAL
+# ==============================================================================
+# Aplana historial, descartados, planificados_adhoc y meta_cardio de todos los
+# usuarios en tablas columnares (ids categóricos, fechas datetime64, códigos de
+# momento) y calcula sobre ellas con groupby vectorizados. El único bucle en
+# Python es el recorrido del árbol al aplanar. Analitica guarda tablas y
+# resultados hasta la siguiente mutación de DatosCompartidos.
+
+MOMENTOS_CODIGO = pd.CategoricalDtype(["PRE", "POST", "FLEX", "NIGHT"])
+FRECUENCIAS = {"dia": "D", "semana": "W", "mes": "M"}
+
+@dataclass
+class Tablas:
+    sesiones: pd.DataFrame      # usuario, fecha, tratamiento, hora, momento (NaN si no vino del selector)
+    planificados: pd.DataFrame  # usuario, fecha, tratamiento, momento
+    descartados: pd.DataFrame   # usuario, fecha, tratamiento
+    cardio: pd.DataFrame        # usuario, fecha, actividad, tiempo, velocidad, inclinacion
+    tratamientos: pd.CategoricalDtype  # categorías comunes: los merge entre tablas no recodifican
+
+def _fechas(claves, filas_por_clave):
+    # Cada fecha ISO se convierte una sola vez y se repite por sus filas
+    fechas = pd.to_datetime(pd.Index(list(claves), dtype=object), format="%Y-%m-%d", errors="coerce")
+    return np.repeat(fechas.values, filas_por_clave)
+
+def _categorica(valores, dtype):
+    # Códigos calculados aquí: pd.Categorical(lista) pasa antes por un array de cadenas y es varias veces más lento
+    codigo = {v: i for i, v in enumerate(dtype.categories)}
+    return pd.Categorical.from_codes(np.fromiter((codigo.get(v, -1) for v in valores), dtype=np.int32, count=len(valores)), dtype=dtype)
+
+def _tabla(columnas):
+    df = pd.DataFrame(columnas)
+    return df[df["fecha"].notna()].reset_index(drop=True) if df["fecha"].isna().any() else df  # claves que no son fechas
+
+def _en_memoria(db, seccion):
+    # fecha -> valor en memoria. Un mapa por segmentos se recorre una sola vez, en orden (cada
+    # mes se lee una vez); luego las listas por columna pueden volver a iterarlo sin coste
+    valor = db.get(seccion)
+    if valor is None: return {}
+    return valor if isinstance(valor, dict) else dict(valor.items())
+
+def aplanar(db_global, usuarios=USUARIOS):
+    s = {"usuario": [], "fecha": [], "tratamiento": [], "hora": [], "detalle": []}
+    p = {"usuario": [], "fecha": [], "tratamiento": [], "momento": []}
+    d = {"usuario": [], "fecha": [], "tratamiento": []}
+    c = {"usuario": [], "fecha": [], "actividad": [], "tiempo": [], "velocidad": [], "inclinacion": []}
+    for u in usuarios:
+        db = db_global.get(u) or {}
+        historial = _en_memoria(db, "historial")
+        entradas = [e for dia in historial.values() for lista in dia.values() for e in lista]
+        s["usuario"] += [u] * len(entradas)
+        s["fecha"].append(_fechas(historial, [sum(map(len, dia.values())) for dia in historial.values()]))
+        s["tratamiento"] += [tid for dia in historial.values() for tid, lista in dia.items() for _ in lista]
+        s["hora"] += [e.get("hora") for e in entradas]
+        s["detalle"] += [e.get("detalle") for e in entradas]
+
+        adhoc = _en_memoria(db, "planificados_adhoc")
+        p["usuario"] += [u] * sum(map(len, adhoc.values()))
+        p["fecha"].append(_fechas(adhoc, [len(dia) for dia in adhoc.values()]))
+        p["tratamiento"] += [tid for dia in adhoc.values() for tid in dia]
+        p["momento"] += [m for dia in adhoc.values() for m in dia.values()]
+
+        descartados = _en_memoria(db, "descartados")
+        d["usuario"] += [u] * sum(map(len, descartados.values()))
+        d["fecha"].append(_fechas(descartados, [len(ids) for ids in descartados.values()]))
+        d["tratamiento"] += [tid for ids in descartados.values() for tid in ids]
+
+        cardio = _en_memoria(db, "meta_cardio")
+        c["usuario"] += [u] * len(cardio)
+        c["fecha"].append(_fechas(cardio, 1))
+        c["actividad"] += [params.get("actividad") for params in cardio.values()]
+        for k in ("tiempo", "velocidad", "inclinacion"): c[k] += [params.get(k) for params in cardio.values()]
+
+    usuario = pd.CategoricalDtype(list(usuarios))
+    tratamientos = pd.CategoricalDtype(sorted(set(s["tratamiento"]) | set(p["tratamiento"]) | set(d["tratamiento"])))
+    for cols in (s, p, d, c):
+        cols["usuario"] = _categorica(cols["usuario"], usuario)
+        cols["fecha"] = np.concatenate(cols["fecha"]) if cols["fecha"] else np.array([], dtype="datetime64[ns]")
+        if "tratamiento" in cols: cols["tratamiento"] = _categorica(cols["tratamiento"], tratamientos)
+    s["hora"] = _categorica(s["hora"], pd.CategoricalDtype(sorted({h for h in s["hora"] if h is not None})))
+    s["momento"] = _categorica([MOMENTOS.get(x) for x in s.pop("detalle")], MOMENTOS_CODIGO)
+    p["momento"] = _categorica(p["momento"], MOMENTOS_CODIGO)
+    c["actividad"] = _categorica(c["actividad"], pd.CategoricalDtype(sorted({a for a in c["actividad"] if a is not None})))
+    for k in ("tiempo", "velocidad", "inclinacion"): c[k] = np.array(c[k], dtype="float64")  # None -> NaN
+    return Tablas(sesiones=_tabla(s), planificados=_tabla(p), descartados=_tabla(d), cardio=_tabla(c), tratamientos=tratamientos)
+
+def tabla_catalogo(db_global, tablas, usuarios=USUARIOS):
+    # zona, duración y tope semanal de cada tratamiento según el catálogo de cada usuario
+    filas = [(u, t.id, t.zona, t.duracion, t.max_semanal) for u in usuarios for t in catalogo_usuario(db_global.get(u) or {})]
+    df = pd.DataFrame(filas, columns=["usuario", "tratamiento", "zona", "duracion", "max_semanal"])
+    return df.astype({"usuario": tablas.sesiones["usuario"].dtype, "tratamiento": tablas.tratamientos, "zona": "category"}).dropna(subset=["tratamiento"])
+
+# --- Claves enteras ---
+# (usuario, tratamiento) -> grupo = código usuario * nº tratamientos + código tratamiento, y
+# cada fecha -> días desde 1970 (negativos antes). Deduplicar, cruzar y agrupar van sobre
+# esas dos columnas enteras en lugar de sobre categorías y fechas.
+def _grupos(tablas, df):
+    n = np.int64(len(tablas.tratamientos.categories))
+    return df["usuario"].cat.codes.to_numpy(np.int64) * n + df["tratamiento"].cat.codes.to_numpy(np.int64)
+
+def _dias(df):
+    return df["fecha"].to_numpy("datetime64[D]").astype(np.int64)
+
+def _columnas_grupo(tablas, grupos):
+    usuario, tratamiento = np.divmod(grupos, len(tablas.tratamientos.categories))
+    return {"usuario": pd.Categorical.from_codes(usuario, dtype=tablas.sesiones["usuario"].dtype),
+            "tratamiento": pd.Categorical.from_codes(tratamiento, dtype=tablas.tratamientos)}
+
+def _por_grupo(tablas, catalogo, columna):
+    # Valor del catálogo para cada grupo posible (NaN si el tratamiento no está en el catálogo de ese usuario)
+    valores = np.full(len(tablas.sesiones["usuario"].cat.categories) * len(tablas.tratamientos.categories), np.nan)
+    valores[_grupos(tablas, catalogo)] = catalogo[columna].to_numpy(np.float64)
+    return valores
+
+def dias_con_sesion(tablas):
+    # (grupo, dia) únicos de los días con al menos un registro, ordenados
+    dias = pd.DataFrame({"grupo": _grupos(tablas, tablas.sesiones), "dia": _dias(tablas.sesiones)})
+    return dias.drop_duplicates().sort_values(["grupo", "dia"], ignore_index=True)
+
+def matriz_adherencia(tablas, usuario, periodo="semana"):
+    # Fracción de lo planificado en la agenda que se registró el mismo día: periodo x tratamiento
+    plan = tablas.planificados.loc[tablas.planificados["usuario"] == usuario, ["fecha", "tratamiento", "usuario"]]
+    hechos = pd.MultiIndex.from_frame(dias_con_sesion(tablas))
+    hecho = pd.MultiIndex.from_arrays([_grupos(tablas, plan), _dias(plan)]).isin(hechos)
+    periodo = plan["fecha"].dt.to_period(FRECUENCIAS[periodo]).rename("periodo")
+    return pd.Series(hecho, index=plan.index).groupby([periodo, plan["tratamiento"]], observed=True).mean().unstack("tratamiento")
+
+def rachas(tablas, hoy):
+    # Días seguidos con sesión por usuario y tratamiento: la mejor y la actual (viva si llega a hoy o ayer)
+    dias = dias_con_sesion(tablas)
+    grupo, dia = dias["grupo"].to_numpy(), dias["dia"].to_numpy()
+    if not len(grupo): return pd.DataFrame(columns=["usuario", "tratamiento", "mejor", "ultima", "actual"])
+    arranques = np.flatnonzero(np.r_[True, (grupo[1:] != grupo[:-1]) | (dia[1:] - dia[:-1] != 1)])
+    largos = np.diff(np.r_[arranques, len(dia)])
+    grupo_tramo, fin_tramo = grupo[arranques], dia[arranques + largos - 1]
+    primeros = np.flatnonzero(np.r_[True, grupo_tramo[1:] != grupo_tramo[:-1]])
+    ultimos = np.r_[primeros[1:], len(grupo_tramo)] - 1
+    hoy = np.datetime64(hoy, "D").astype(np.int64)
+    return pd.DataFrame(dict(_columnas_grupo(tablas, grupo_tramo[primeros]),
+                             mejor=np.maximum.reduceat(largos, primeros),
+                             ultima=fin_tramo[ultimos].astype("datetime64[D]").astype("datetime64[ns]"),
+                             actual=np.where(fin_tramo[ultimos] >= hoy - 1, largos[ultimos], 0)))
+
+def uso_topes_semanales(tablas, catalogo):
+    # Días con sesión por semana ISO (de lunes a domingo) frente a max_semanal (1.0 = tope alcanzado)
+    dias = dias_con_sesion(tablas)
+    por_semana = dias.assign(semana=(dias["dia"] + 3) // 7).groupby(["grupo", "semana"]).size()  # el 1970-01-01 fue jueves
+    grupo, semana = (por_semana.index.get_level_values(n).to_numpy() for n in ("grupo", "semana"))
+    dias = por_semana.to_numpy()
+    tope = _por_grupo(tablas, catalogo, "max_semanal")[grupo]
+    en_catalogo = ~np.isnan(tope)
+    grupo, semana, dias, tope = grupo[en_catalogo], semana[en_catalogo], dias[en_catalogo], tope[en_catalogo]
+    lunes = (semana * 7 - 3).astype("datetime64[D]")
+    return pd.DataFrame(dict(_columnas_grupo(tablas, grupo), semana=pd.PeriodIndex(lunes, freq="W"),
+                             dias=dias, max_semanal=tope.astype(np.int64), uso=dias / tope))
+
+def totales_por_zona(tablas, catalogo):
+    # Sesiones y minutos (duración del catálogo x sesiones) por usuario y zona
+    sesiones = np.bincount(_grupos(tablas, tablas.sesiones), minlength=len(tablas.sesiones["usuario"].cat.categories) * len(tablas.tratamientos.categories))
+    por_grupo = catalogo.assign(sesiones=sesiones[_grupos(tablas, catalogo)])
+    por_grupo["minutos"] = por_grupo["sesiones"] * por_grupo["duracion"]
+    return por_grupo[por_grupo["sesiones"] > 0].groupby(["usuario", "zona"], observed=True)[["sesiones", "minutos"]].sum().reset_index()
+
+class Analitica:
+    # Resultados de la última versión de los datos; cualquier mutar() los invalida
+    def __init__(self, compartidos):
+        self.compartidos = compartidos
+        self._lock = threading.Lock()
+        self._version = None
+        self._cache = {}
+
+    def _memo(self, clave, calcular):
+        datos = self.compartidos.obtener()
+        version = self.compartidos.version
+        with self._lock:
+            if version != self._version: self._version, self._cache = version, {}
+            if clave in self._cache: return self._cache[clave]
+        valor = calcular(datos)
+        with self._lock:
+            if version == self._version: self._cache[clave] = valor
+        return valor
+
+    def tablas(self): return self._memo(("tablas",), aplanar)
+    def catalogo(self): return self._memo(("catalogo",), lambda datos: tabla_catalogo(datos, self.tablas()))
+    def adherencia(self, usuario, periodo="semana"): return self._memo(("adherencia", usuario, periodo), lambda datos: matriz_adherencia(self.tablas(), usuario, periodo))
+    def rachas(self, hoy): return self._memo(("rachas", hoy), lambda datos: rachas(self.tablas(), hoy))
+    def topes(self): return self._memo(("topes",), lambda datos: uso_topes_semanales(self.tablas(), self.catalogo()))
+    def zonas(self): return self._memo(("zonas",), lambda datos: totales_por_zona(self.tablas(), self.catalogo()))
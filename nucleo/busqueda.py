@@ -0,0 +1,116 @@
+import math
+import threading
+from collections import Counter
+
+from .texto import terminos
+
+# ==============================================================================
+# BÚSQUEDA LOCAL POR SÍNTOMAS (BM25)
+# ==============================================================================
+# Índice invertido en memoria sobre el catálogo del usuario: nombre, patología,
+# zona, síntomas, descripción y posición, sin tildes ni mayúsculas. Cada palabra
+# se indexa entera y en trigramas de letras, así "rodillas", "lumbalgia" o una
+# errata siguen encontrando "rodilla" y "lumbar". La puntuación es BM25 con un
+# peso por campo; los trigramas cuentan menos que las palabras enteras.
+#
+# sincronizar(catalogo) compara por id con lo ya indexado y solo reindexa los
+# tratamientos nuevos, cambiados u ocultados: crear un tratamiento personalizado
+# toca un documento, no el catálogo entero.
+
+PESOS_CAMPO = {"nombre": 3.0, "patologia": 3.0, "zona": 2.0, "sintomas": 2.0, "descripcion": 1.0, "posicion": 0.5}
+PESO_TRIGRAMAS = 0.3
+K1, B = 1.2, 0.75
+# Si nada alcanza el umbral, la consulta no la responde el catálogo y se pregunta a la IA.
+# Sobre el catálogo base, nombrar la zona o la patología ("codo de tenista", "lumbalgia",
+# "dolor de rodilla") puntúa 12-20; lo que no tiene tratamiento ("fiebre y tos",
+# "ansiedad") se queda en 1-3 con coincidencias de trigramas y palabras comunes como
+# "dolor". 8.0 deja margen a ambos lados; una sola palabra emparentada ("rodillas")
+# ronda 6 y pasa a la IA, que la resuelve mejor que una coincidencia débil.
+UMBRAL_BUSQUEDA = 8.0
+FRACCION_DEL_MEJOR = 0.5  # se descartan los resultados con menos de esta fracción de la mejor puntuación
+MAX_RESULTADOS = 5
+
+def trigramas(palabra):
+    marcada = f"#{palabra}#"
+    return [marcada[i:i + 3] for i in range(len(marcada) - 2)]
+
+def _tokens(texto):
+    # Palabras enteras y, con prefijo "~", sus trigramas
+    palabras = terminos(texto)
+    return palabras + ["~" + g for p in palabras for g in trigramas(p)]
+
+def _texto_campos(t):
+    return tuple(getattr(t, campo) or "" for campo in PESOS_CAMPO)
+
+class IndiceBM25:
+    def __init__(self):
+        self.postings = {}  # término -> {id: frecuencia ponderada}
+        self.longitud = {}  # id -> longitud ponderada del documento
+        self.terminos = {}  # id -> términos del documento (para quitarlo)
+        self.total = 0.0
+
+    def __len__(self): return len(self.longitud)
+
+    def anadir(self, id_doc, campos):
+        frecuencias = Counter()
+        for peso, texto in zip(PESOS_CAMPO.values(), campos):
+            for token in _tokens(texto): frecuencias[token] += peso
+        for token, f in frecuencias.items(): self.postings.setdefault(token, {})[id_doc] = f
+        self.terminos[id_doc] = tuple(frecuencias)
+        self.longitud[id_doc] = sum(frecuencias.values())
+        self.total += self.longitud[id_doc]
+
+    def quitar(self, id_doc):
+        for token in self.terminos.pop(id_doc, ()):
+            docs = self.postings[token]
+            del docs[id_doc]
+            if not docs: del self.postings[token]
+        self.total -= self.longitud.pop(id_doc, 0.0)
+
+    def puntuar(self, consulta):
+        # -> Counter id -> puntuación BM25
+        n = len(self.longitud)
+        if not n: return Counter()
+        media = self.total / n
+        puntos = Counter()
+        for token in set(_tokens(consulta)):
+            docs = self.postings.get(token)
+            if not docs: continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            if token.startswith("~"): idf *= PESO_TRIGRAMAS
+            for id_doc, f in docs.items():
+                puntos[id_doc] += idf * f * (K1 + 1) / (f + K1 * (1 - B + B * self.longitud[id_doc] / media))
+        return puntos
+
+class BuscadorCatalogo:
+    def __init__(self):
+        self.indice = IndiceBM25()
+        self._lock = threading.Lock()
+        self._catalogo = None
+        self._indexados = {}  # id -> (tratamiento, campos) tal como se indexaron
+
+    def sincronizar(self, catalogo):
+        with self._lock:
+            if catalogo is self._catalogo: return
+            vivos = set()
+            for t in catalogo:
+                vivos.add(t.id)
+                campos = _texto_campos(t)
+                anterior = self._indexados.get(t.id)
+                if anterior is not None and anterior[1] == campos:
+                    self._indexados[t.id] = (t, campos); continue
+                if anterior is not None: self.indice.quitar(t.id)
+                self.indice.anadir(t.id, campos)
+                self._indexados[t.id] = (t, campos)
+            for id_t in [i for i in self._indexados if i not in vivos]:
+                self.indice.quitar(id_t); del self._indexados[id_t]
+            self._catalogo = catalogo
+
+    def buscar(self, consulta, catalogo=None, umbral=UMBRAL_BUSQUEDA, limite=MAX_RESULTADOS):
+        # -> [(tratamiento, puntuación)] de mayor a menor; vacío si el mejor no llega al umbral
+        if catalogo is not None: self.sincronizar(catalogo)
+        with self._lock:
+            mejores = self.indice.puntuar(consulta).most_common(limite)
+            if not mejores or mejores[0][1] < umbral: return []
+            corte = mejores[0][1] * FRACCION_DEL_MEJOR
+            return [(self._indexados[i][0], p) for i, p in mejores if p >= corte]
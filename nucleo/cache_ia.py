@@ -0,0 +1,83 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from .texto import terminos
+
+# ==============================================================================
+# CACHÉ EN DISCO DE LAS RESPUESTAS DE LA IA
+# ==============================================================================
+# SQLite compartido por todos los procesos. La clave es la versión del prompt más
+# la consulta normalizada (sin tildes, mayúsculas, puntuación ni palabras vacías),
+# así "Dolor de rodilla." y "dolor rodilla" comparten respuesta y cambiar el
+# prompt invalida todo lo anterior. Cada entrada caduca a los TTL_CACHE_IA
+# segundos y, por encima de MAX_ENTRADAS_IA, se desalojan las menos usadas
+# recientemente. Los contadores son del proceso.
+
+TTL_CACHE_IA = 30 * 24 * 3600
+MAX_ENTRADAS_IA = 500
+
+ESQUEMA_CACHE = """
+CREATE TABLE IF NOT EXISTS respuestas (
+    clave TEXT PRIMARY KEY, consulta TEXT NOT NULL, respuesta TEXT NOT NULL,
+    creada REAL NOT NULL, usada REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS respuestas_usada ON respuestas (usada);
+"""
+
+def consulta_normalizada(consulta):
+    return " ".join(terminos(consulta))
+
+class CacheIA:
+    def __init__(self, ruta_db, ttl=TTL_CACHE_IA, max_entradas=MAX_ENTRADAS_IA, reloj=time.time):
+        self.ttl, self.max_entradas, self.reloj = ttl, max_entradas, reloj
+        self.lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta_db, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(ESQUEMA_CACHE)
+        self.aciertos = self.fallos = self.caducadas = self.desalojadas = 0
+
+    def clave(self, consulta, version):
+        return hashlib.sha256(f"{version}\n{consulta_normalizada(consulta)}".encode()).hexdigest()
+
+    def obtener(self, consulta, version):
+        clave, ahora = self.clave(consulta, version), self.reloj()
+        with self.lock:
+            fila = self._conn.execute("SELECT respuesta, creada FROM respuestas WHERE clave=?", (clave,)).fetchone()
+            if fila is not None and ahora - fila[1] > self.ttl:
+                self._conn.execute("DELETE FROM respuestas WHERE clave=?", (clave,))
+                self.caducadas += 1; fila = None
+            if fila is None:
+                self.fallos += 1
+                return None
+            self._conn.execute("UPDATE respuestas SET usada=? WHERE clave=?", (ahora, clave))
+            self.aciertos += 1
+            return json.loads(fila[0])
+
+    def guardar(self, consulta, version, respuesta):
+        ahora = self.reloj()
+        with self.lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("INSERT OR REPLACE INTO respuestas VALUES (?,?,?,?,?)",
+                                   (self.clave(consulta, version), consulta_normalizada(consulta), json.dumps(respuesta, ensure_ascii=False), ahora, ahora))
+                caducadas = self._conn.execute("DELETE FROM respuestas WHERE creada < ?", (ahora - self.ttl,)).rowcount
+                # LRU: fuera todo lo que pase de max_entradas por uso más reciente
+                desalojadas = self._conn.execute("DELETE FROM respuestas WHERE clave IN (SELECT clave FROM respuestas ORDER BY usada DESC LIMIT -1 OFFSET ?)",
+                                                 (self.max_entradas,)).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK"); raise
+            self.caducadas += caducadas; self.desalojadas += desalojadas
+
+    def vaciar(self):
+        with self.lock: self._conn.execute("DELETE FROM respuestas")
+
+    def estadisticas(self):
+        with self.lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+            consultas = self.aciertos + self.fallos
+            return {"consultas": consultas, "aciertos": self.aciertos, "fallos": self.fallos,
+                    "tasa_aciertos": self.aciertos / consultas if consultas else None,
+                    "entradas": entradas, "caducadas": self.caducadas, "desalojadas": self.desalojadas}
@@ -0,0 +1,521 @@
+import functools
+import hashlib
+import json
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+
+# ==============================================================================
+# CATÁLOGO DE TRATAMIENTOS
+# ==============================================================================
+# Definición base, modelo Tratamiento y generación del catálogo de cada usuario.
+# El catálogo solo depende de tratamientos_custom y tratamientos_ocultos, así que
+# se construye una vez por combinación y se reutiliza entre reruns y sesiones.
+
+CATALOGOS_EN_CACHE = 8
+TUPLAS_COMPARTIDAS = 4096  # de sobra para el catálogo base; los personalizados desalojan solo lo suyo
+
+# Zonas que generan variantes Derecha/Izquierda automáticamente
+ZONAS_SIMETRICAS = ["Codo", "Antebrazo", "Muñeca", "Pierna", "Pie", "Hombro", "Rodilla", "Tobillo", "Brazo", "Mano", "Cadera"]
+
+# ==============================================================================
+# 1. DEFINICIÓN MAESTRA BASE (CATÁLOGO COMPLETO)
+# ==============================================================================
+DB_TRATAMIENTOS_BASE = {
+    "Codo": {
+        "Epicondilitis (Tenista)": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz (Dolor)", "dist": "Contacto", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Reduce inflamación en tendón extensor y alivia dolor agudo.",
+            "sintomas": "Dolor en la cara externa del codo al agarrar o girar.",
+            "posicion": "Sentado, brazo en mesa. Panel lateral tocando zona externa.",
+            "tips_ant": ["Piel limpia"], "tips_des": ["No pinza con dedos", "Hielo si dolor"]
+        },
+        "Epitrocleitis (Golfista)": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz (Dolor)", "dist": "Contacto", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Regeneración para la cara interna del codo.",
+            "sintomas": "Dolor interno al flexionar muñeca.",
+            "posicion": "Brazo en mesa, palma arriba. Panel en cara interna.",
+            "tips_ant": ["Piel limpia"], "tips_des": ["Estirar flexores"]
+        },
+        "Calcificación": {
+            "ondas": "850nm", "energia": "660nm: 0% | 850nm: 100%", 
+            "hz": "50Hz (Analgesia)", "dist": "Contacto", "dur": 12,
+            "frecuencias": [(660, 0), (850, 100)],
+            "descripcion": "Infrarrojo profundo para estimular reabsorción de calcio.",
+            "sintomas": "Dolor punzante y limitación de movimiento.",
+            "posicion": "Panel en contacto directo con la zona calcificada.",
+            "tips_ant": ["Calor previo"], "tips_des": ["Movilidad suave"]
+        },
+        "Bursitis (Apoyo)": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "10Hz (Anti-inflamatorio)", "dist": "5cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Baja la inflamación de la bursa sin contacto directo.",
+            "sintomas": "Hinchazón (bulto) en la punta del codo.",
+            "posicion": "Panel a 5cm del bulto. NO TOCAR.",
+            "tips_ant": ["Zona limpia"], "tips_des": ["No apoyar codo"]
+        }
+    },
+    "Espalda": {
+        "Cervicalgia (Cuello)": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz (Dolor)", "dist": "10cm", "dur": 15,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Relaja tensión cervical y mejora riego sanguíneo.",
+            "sintomas": "Rigidez de cuello y trapecios.",
+            "posicion": "Sentado, panel detrás del cuello.",
+            "tips_ant": ["Sin collar"], "tips_des": ["Movilidad suave"]
+        },
+        "Dorsalgia (Alta)": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz", "dist": "15cm", "dur": 15,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Para zona media-alta de la espalda y postura.",
+            "sintomas": "Dolor entre omóplatos.",
+            "posicion": "Sentado al revés en silla o tumbado.",
+            "tips_ant": ["Postura recta"], "tips_des": ["Estirar pecho"]
+        },
+        "Lumbalgia (Baja)": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz (Dolor)", "dist": "10cm", "dur": 20,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Penetración profunda lumbar para desinflamar discos.",
+            "sintomas": "Dolor en zona baja, dificultad al enderezarse.",
+            "posicion": "Tumbado boca abajo o sentado en taburete.",
+            "tips_ant": ["Calor previo"], "tips_des": ["No cargar peso"]
+        }
+    },
+    "Antebrazo": {
+        "Sobrecarga": {
+            "ondas": "660+850", "energia": "660nm: 80% | 850nm: 80%", 
+            "hz": "10Hz (Relajación)", "dist": "15cm", "dur": 12,
+            "frecuencias": [(660, 80), (850, 80)],
+            "descripcion": "Relajación muscular general del antebrazo.",
+            "sintomas": "Sensación de fatiga, antebrazos duros.",
+            "posicion": "Antebrazo apoyado en mesa. Panel desde arriba.",
+            "tips_ant": ["Quitar sudor"], "tips_des": ["Estirar", "Calor"]
+        },
+        "Tendinitis": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz (Dolor)", "dist": "10cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Tratamiento anti-inflamatorio localizado.",
+            "sintomas": "Dolor puntual en trayecto del tendón.",
+            "posicion": "Panel apuntando directamente al punto de dolor.",
+            "tips_ant": ["Quitar reloj"], "tips_des": ["Reposo"]
+        }
+    },
+    "Muñeca": {
+        "Túnel Carpiano": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "10Hz (Nervio)", "dist": "5cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Enfocado en regeneración nerviosa y desinflamación.",
+            "sintomas": "Hormigueo en dedos, dolor nocturno.",
+            "posicion": "Palma arriba. Panel en base de muñeca.",
+            "tips_ant": ["Palma abierta"], "tips_des": ["Movilidad"]
+        },
+        "Articular": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz", "dist": "5cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Para dolor articular general y rigidez.",
+            "sintomas": "Dolor difuso al mover la muñeca.",
+            "posicion": "Rotar muñeca frente al panel.",
+            "tips_ant": ["Sin muñequera"], "tips_des": ["Hielo"]
+        }
+    },
+    "Pierna": {
+        "Cintilla Iliotibial": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz (Dolor)", "dist": "Contacto", "dur": 12,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Reduce fricción e inflamación en fascia lata.",
+            "sintomas": "Dolor lateral externo rodilla/muslo.",
+            "posicion": "Tumbado de lado, panel en cara externa muslo.",
+            "tips_ant": ["Piel limpia"], "tips_des": ["Estirar TFL"]
+        },
+        "Sobrecarga Femoral": {
+            "ondas": "660+850", "energia": "660nm: 80% | 850nm: 100%", 
+            "hz": "10Hz (Recuperación)", "dist": "10cm", "dur": 15,
+            "frecuencias": [(660, 80), (850, 100)],
+            "descripcion": "Acelera barrido de lactato y recuperación.",
+            "sintomas": "Fatiga, pesadez muscular.",
+            "posicion": "Panel cubriendo el grupo muscular afectado.",
+            "tips_ant": ["Quitar sudor"], "tips_des": ["Estirar"]
+        }
+    },
+    "Pie": {
+        "Fascitis Plantar": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "50Hz", "dist": "5cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Desinflamación del arco plantar.",
+            "sintomas": "Dolor agudo en talón al pisar.",
+            "posicion": "Sentado, panel apuntando a planta del pie.",
+            "tips_ant": ["Sin calcetín"], "tips_des": ["Rodar pelota"]
+        },
+        "Dorsal (Esguince)": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "10Hz (Regeneración)", "dist": "10cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Regeneración de ligamentos.",
+            "sintomas": "Dolor e hinchazón tobillo/empeine.",
+            "posicion": "Panel enfocado a zona hinchada.",
+            "tips_ant": ["Piel limpia"], "tips_des": ["Movilidad"]
+        },
+        "Lateral (Metatarso)": {
+            "ondas": "Todas (Mega)", "energia": "TODO 100%", 
+            "hz": "50Hz (Analgesia)", "dist": "10cm", "dur": 12,
+            "frecuencias": [(660, 100), (850, 100), (810, 100), (830, 100), (630, 100)],
+            "descripcion": "Alivio dolor agudo en 5º metatarsiano.",
+            "sintomas": "Dolor borde exterior del pie bajo dedo pequeño.",
+            "posicion": "Panel de lado en suelo apuntando al lateral del pie.",
+            "tips_ant": ["Pie limpio"], "tips_des": ["Movilidad dedos"]
+        }
+    },
+    "Hombro": {
+        "Tendinitis": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "10-40Hz", "dist": "15cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Para manguito rotador inflamado.",
+            "sintomas": "Dolor al levantar brazo lateralmente.",
+            "posicion": "Sentado, panel lateral apuntando al deltoides.",
+            "tips_ant": ["Sin ropa"], "tips_des": ["Péndulos"]
+        }
+    },
+    "Rodilla": {
+        "Dolor General": {
+            "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%", 
+            "hz": "10Hz", "dist": "15cm", "dur": 10,
+            "frecuencias": [(660, 50), (850, 100)],
+            "descripcion": "Mantenimiento articular y meniscos.",
+            "sintomas": "Molestia profunda o chasquidos.",
+            "posicion": "Pierna estirada, panel frontal o lateral.",
+            "tips_ant": ["No hielo antes"], "tips_des": ["Movilidad"]
+        }
+    },
+    "Piel": {
+        "Cicatrices": {
+            "ondas": "630+660", "energia": "660nm: 100% | 850nm: 20%", 
+            "hz": "CW", "dist": "10cm", "dur": 10,
+            "frecuencias": [(660, 100), (850, 20)],
+            "descripcion": "Mejora textura y color de cicatrices.",
+            "sintomas": "Tejido cicatricial reciente o antiguo.",
+            "posicion": "Panel directo a la cicatriz.",
+            "tips_ant": ["Limpio"], "tips_des": ["Rosa Mosqueta"]
+        },
+        "Acné": {
+            "ondas": "630+660", "energia": "660nm: 80% | 850nm: 0%", 
+            "hz": "CW", "dist": "15cm", "dur": 8,
+            "frecuencias": [(660, 80), (850, 0)],
+            "descripcion": "Reduce inflamación bacteriana y rojez.",
+            "sintomas": "Brotes activos, rojez facial.",
+            "posicion": "Frente al rostro (gafas puestas).",
+            "tips_ant": ["Limpio"], "tips_des": ["Hidratar"]
+        },
+        "Quemaduras": {
+            "ondas": "630+660", "energia": "660nm: 50% | 850nm: 0%", 
+            "hz": "CW", "dist": "20cm", "dur": 5,
+            "frecuencias": [(660, 50), (850, 0)],
+            "descripcion": "Regeneración epidérmica sin calor.",
+            "sintomas": "Piel roja o dañada por sol/calor.",
+            "posicion": "Mayor distancia (20-30cm).",
+            "tips_ant": ["Sin cremas"], "tips_des": ["Aloe Vera"]
+        }
+    },
+    "Sistémico": {
+        "Circulación": {
+            "ondas": "660+850", "energia": "100% | 100%", 
+            "hz": "CW", "dist": "30cm", "dur": 20,
+            "frecuencias": [(660, 100), (850, 100)],
+            "descripcion": "Vasodilatación general.",
+            "sintomas": "Piernas cansadas, frío en extremidades.",
+            "posicion": "Panel cubriendo grandes grupos musculares.",
+            "tips_ant": ["Beber agua"], "tips_des": ["Caminar"]
+        },
+        "Energía": {
+            "ondas": "660+850", "energia": "100% | 100%", 
+            "hz": "CW", "dist": "20cm", "dur": 10,
+            "frecuencias": [(660, 100), (850, 100)],
+            "descripcion": "Estimulación mitocondrial.",
+            "sintomas": "Fatiga general, falta de energía.",
+            "posicion": "Panel frente al torso/pecho.",
+            "tips_ant": ["Mañana"], "tips_des": ["Actividad"]
+        }
+    },
+    "Cabeza": {
+        "Migraña": {
+            "ondas": "850nm", "energia": "660nm: 0% | 850nm: 50%", 
+            "hz": "10Hz (Alfa)", "dist": "Contacto Nuca", "dur": 10,
+            "frecuencias": [(660, 0), (850, 50)],
+            "descripcion": "Relajación occipital para tensión vascular.",
+            "sintomas": "Dolor pulsátil, tensión en nuca.",
+            "posicion": "Panel en la nuca (NO ojos).",
+            "tips_ant": ["Oscuridad"], "tips_des": ["Reposo"]
+        },
+        "Salud Cerebral": {
+            "ondas": "810nm", "energia": "0% | 100%", 
+            "hz": "40Hz (Gamma)", "dist": "30cm", "dur": 10,
+            "frecuencias": [(810, 100)],
+            "descripcion": "Neuroprotección y cognitiva.",
+            "sintomas": "Niebla mental, prevención.",
+            "posicion": "Panel a la frente/cabeza. GAFAS OBLIGATORIAS.",
+            "tips_ant": ["Gafas"], "tips_des": ["Tarea cognitiva"]
+        }
+    },
+    "Grasa/Estética": {
+        "Grasa Localizada": {
+            "ondas": "Todas (Mega)", "energia": "TODO AL 100%", 
+            "hz": "CW (Continuo)", "dist": "20-30cm", "dur": 15,
+            "frecuencias": [(660, 100), (850, 100), (810, 100), (830, 100), (630, 100)],
+            "descripcion": "Lipólisis térmica máxima.",
+            "sintomas": "Grasa resistente.",
+            "posicion": "Directo a piel desnuda. EJERCICIO INMEDIATO.",
+            "tips_ant": ["Beber agua"], "tips_des": ["Cardio 30min"],
+            "visual_group": "PRE", "req_tags": ["Active"]
+        },
+        "Facial": {
+            "ondas": "630nm", "energia": "100% | 0%", 
+            "hz": "CW", "dist": "30cm", "dur": 10,
+            "frecuencias": [(630, 100), (660, 50)],
+            "descripcion": "Colágeno superficial.",
+            "sintomas": "Arrugas finas, piel apagada.",
+            "posicion": "Frente al rostro 30cm. GAFAS PUESTAS.",
+            "tips_ant": ["Gafas"], "tips_des": ["Serum"],
+            "visual_group": "FLEX", "momento_txt": "Cualquier hora"
+        }
+    },
+    "Permanente": {
+        "Testosterona": {
+            "ondas": "660+850", "energia": "100% | 100%", 
+            "hz": "CW", "dist": "15cm", "dur": 5,
+            "frecuencias": [(660, 100), (850, 100)],
+            "descripcion": "Estimulación mitocondrial hormonal.",
+            "sintomas": "Optimización hormonal.",
+            "posicion": "Directo a zona testicular.",
+            "tips_ant": ["Limpio"], "tips_des": ["Ducha fría"],
+            "visual_group": "MORNING"
+        },
+        "Sueño": {
+            "ondas": "Solo ROJO", "energia": "Rojo: 30% | NIR: 0%", 
+            "hz": "CW (Continuo)", "dist": ">1 Metro", "dur": 20,
+            "frecuencias": [(630, 30), (660, 30), (810, 0), (830, 0), (850, 0)],
+            "descripcion": "Luz ambiente tenue para melatonina.",
+            "sintomas": "Insomnio, dificultad para desconectar.",
+            "posicion": "Panel lejos, luz indirecta contra pared.",
+            "tips_ant": ["Oscuridad"], "tips_des": ["Dormir"],
+            "visual_group": "NIGHT"
+        }
+    }
+}
+
+# ==============================================================================
+# 2. CLASES Y MODELO DE DATOS
+# ==============================================================================
+FASES_LESION = ({"nombre": "🔥 Fase 1: Inflamatoria", "dias_fin": 7}, {"nombre": "🛠️ Fase 2: Proliferación", "dias_fin": 21}, {"nombre": "🧱 Fase 3: Remodelación", "dias_fin": 60})
+
+@functools.lru_cache(maxsize=TUPLAS_COMPARTIDAS)
+def _tupla_unica(t): return t
+
+def _compartir(valor):
+    # Cadenas internadas y listas como tuplas únicas por contenido: las variantes
+    # Derecho/Izquierdo y los valores por defecto repetidos apuntan al mismo objeto.
+    # La tabla de tuplas es un LRU acotado: lo que añaden los personalizados no se
+    # acumula durante toda la vida del proceso.
+    if isinstance(valor, str): return sys.intern(valor)
+    if isinstance(valor, (list, tuple)):
+        t = tuple(_compartir(v) for v in valor)
+        try: return _tupla_unica(t)
+        except TypeError: return valor if isinstance(valor, tuple) else t  # contiene dicts (fases)
+    return valor
+
+SECUENCIAS = ("tags_entreno", "momentos_prohibidos", "tips_antes", "tips_despues", "incompatible_with", "fases_config", "frecuencias")
+
+@dataclass(frozen=True, slots=True, eq=False)
+class Tratamiento:
+    id: str
+    nombre: str
+    zona: str
+    ondas_txt: str
+    config_energia: str
+    herzios: str
+    distancia: str
+    duracion: int
+    max_diario: int
+    max_semanal: int
+    tipo: str
+    tags_entreno: tuple
+    default_visual_group: str
+    momento_ideal_txt: str
+    momentos_prohibidos: tuple
+    tips_antes: tuple
+    tips_despues: tuple
+    incompatible_with: tuple = ()
+    fases_config: tuple = ()
+    es_custom: bool = False
+    patologia: str = ""
+    lado_txt: str = ""
+    frecuencias: tuple = ()
+    descripcion: str = ""
+    sintomas: str = ""
+    posicion: str = ""
+
+    def __post_init__(self):
+        for campo in fields(self):
+            valor = getattr(self, campo.name)
+            if valor is None and campo.name in SECUENCIAS: valor = ()
+            object.__setattr__(self, campo.name, _compartir(valor))
+
+    def a_dict(self):
+        # Formato de tratamientos_custom, el que lee obtener_catalogo
+        return {
+            "id": self.id, "nombre": self.nombre, "zona": self.zona, "ondas": self.ondas_txt, "energia": self.config_energia,
+            "hz": self.herzios, "dist": self.distancia, "dur": self.duracion, "tipo": self.tipo,
+            "tips_ant": list(self.tips_antes), "tips_des": list(self.tips_despues), "fases": [dict(f) for f in self.fases_config],
+            "frecuencias": [list(f) for f in self.frecuencias], "descripcion": self.descripcion, "sintomas": self.sintomas, "posicion": self.posicion
+        }
+
+# --- GENERADOR DE CATÁLOGO ---
+def obtener_catalogo(tratamientos_custom=[], db_usuario=None):
+    catalogo = []
+    ids_procesados = set()
+    ocultos = set()
+    if db_usuario:
+        ocultos = set(db_usuario.get("tratamientos_ocultos", []))
+
+    # 1. Custom
+    for c in tratamientos_custom:
+        if c['id'] in ocultos: continue
+        catalogo.append(Tratamiento(
+            c['id'], c['nombre'], c['zona'], c['ondas'], c['energia'], c['hz'], c['dist'], c['dur'], 
+            1, 7, c['tipo'], ['All'], "FLEX", "Personalizado", [], c['tips_ant'], c['tips_des'], 
+            fases_config=c.get('fases', []), es_custom=True,
+            patologia=c['nombre'], lado_txt="Custom", frecuencias=c.get('frecuencias', []), 
+            descripcion=c.get('descripcion', ''), sintomas=c.get('sintomas', ''), posicion=c.get('posicion', '')
+        ))
+        ids_procesados.add(c['id'])
+
+    # 2. Base
+    for zona, patologias in DB_TRATAMIENTOS_BASE.items():
+        for patologia, specs in patologias.items():
+            freqs = specs.get("frecuencias", [(660, 50), (850, 100)])
+            desc = specs.get("descripcion", "")
+            sint = specs.get("sintomas", "")
+            pos = specs.get("posicion", "")
+            v_group = specs.get("visual_group", "FLEX")
+            req_tags = specs.get("req_tags", ['All'])
+            momento_txt = specs.get("momento_txt", "Flexible")
+            
+            lados_a_generar = [("g", "General")] 
+            if zona in ZONAS_SIMETRICAS:
+                lados_a_generar = [("d", "Derecho"), ("i", "Izquierdo")]
+            elif zona == "Abdomen": 
+                if "Frontal" in patologia: lados_a_generar = [("f", "Frontal")]
+            
+            if zona == "Grasa/Estética" and "Grasa Localizada" in patologia:
+                pass 
+            else:
+                for codigo, nombre_lado in lados_a_generar:
+                    base_id = f"{zona[:3]}_{patologia[:4]}_{codigo}".lower().replace(" ", "")
+                    id_t = "".join(ch for ch in base_id if ch.isalnum() or ch=="_")
+                    
+                    if id_t in ocultos: continue
+
+                    nombre_final = f"{zona} {nombre_lado} ({patologia})" if nombre_lado != "General" else f"{zona} ({patologia})"
+                    if id_t not in ids_procesados:
+                        catalogo.append(Tratamiento(
+                            id_t, nombre_final, zona, specs["ondas"], specs["energia"], specs["hz"], specs["dist"], specs["dur"], 
+                            1, 7, "LESION", req_tags, v_group, momento_txt, [], specs.get("tips_ant", []), specs.get("tips_des", []), fases_config=FASES_LESION,
+                            patologia=patologia, lado_txt=nombre_lado, frecuencias=freqs, descripcion=desc, sintomas=sint, posicion=pos
+                        ))
+
+    # 3. Inyectar estáticos históricos de Grasa
+    s = DB_TRATAMIENTOS_BASE["Grasa/Estética"]["Grasa Localizada"]
+    for sufijo, nombre, lado in [("front", "Frontal", "Frontal"), ("d", "Flanco D", "Flanco Dcho"), ("i", "Flanco I", "Flanco Izq"), ("glutes", "Glúteos", "General")]:
+        id_t = f"fat_{sufijo}"
+        if id_t in ocultos: continue
+        if id_t not in ids_procesados:
+            catalogo.append(Tratamiento(id_t, f"Grasa {nombre}", "Abdomen", s["ondas"], s["energia"], s["hz"], s["dist"], s["dur"], 1, 7, "GRASA", ["Active"], "PRE", "Pre-Entreno", ["🌙 Noche"], s["tips_ant"], s["tips_des"], patologia="Grasa Localizada", lado_txt=lado, frecuencias=s.get("frecuencias"), descripcion=s.get("descripcion"), sintomas=s.get("sintomas"), posicion=s.get("posicion")))
+
+    # 4. Inyectar facial y permanentes
+    f = DB_TRATAMIENTOS_BASE["Grasa/Estética"]["Facial"]
+    if "face" not in ids_procesados and "face" not in ocultos:
+        catalogo.append(Tratamiento("face", "Facial Rejuv", "Cara", f["ondas"], f["energia"], f["hz"], f["dist"], f["dur"], 1, 7, "PERMANENTE", ['All'], f["visual_group"], f.get("momento_txt", "Cualquier hora"), ["🏋️ Entrenamiento (Pre)"], f["tips_ant"], f["tips_des"], patologia="Facial", lado_txt="General", frecuencias=f.get("frecuencias"), descripcion=f.get("descripcion"), sintomas=f.get("sintomas"), posicion=f.get("posicion")))
+    
+    for k, v in DB_TRATAMIENTOS_BASE["Permanente"].items():
+        id_t = k.lower()
+        if id_t not in ids_procesados and id_t not in ocultos:
+            catalogo.append(Tratamiento(id_t, k, "Cuerpo", v["ondas"], v["energia"], v["hz"], v["dist"], v["dur"], 1, 7, "PERMANENTE", ['All'], v["visual_group"], v.get("momento_txt","FLEX"), [], v["tips_ant"], v["tips_des"], patologia=k, lado_txt="Único", frecuencias=v.get("frecuencias"), descripcion=v.get("descripcion"), sintomas=v.get("sintomas"), posicion=v.get("posicion")))
+
+    return catalogo
+
+# ==============================================================================
+# 3. CATÁLOGO MEMOIZADO CON ÍNDICES
+# ==============================================================================
+class Catalogo:
+    # Se itera como la lista de siempre (mismo orden) y además indexa por id,
+    # por nombre y zona -> patología -> variantes. No se modifica tras construirse.
+    def __init__(self, tratamientos):
+        self.tratamientos = tuple(tratamientos)
+        self.por_id, self.por_nombre, self.posicion, self.arbol = {}, {}, {}, {}
+        for i, t in enumerate(self.tratamientos):
+            self.por_id.setdefault(t.id, t)
+            self.posicion.setdefault(t.id, i)
+            self.por_nombre.setdefault(t.nombre, t)
+            self.arbol.setdefault(t.zona, {}).setdefault(t.patologia, []).append(t)
+        self.zonas = sorted(self.arbol)
+        self.patologias = {z: sorted(pats) for z, pats in self.arbol.items()}
+
+    def __iter__(self): return iter(self.tratamientos)
+    def __len__(self): return len(self.tratamientos)
+    def get(self, id_t, defecto=None): return self.por_id.get(id_t, defecto)
+    def variantes(self, zona, patologia): return self.arbol.get(zona, {}).get(patologia, [])
+
+def firma_catalogo(tratamientos_custom, ocultos):
+    datos = json.dumps([tratamientos_custom, sorted(ocultos)], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+_catalogos = OrderedDict()
+_catalogos_lock = threading.Lock()
+
+def catalogo_usuario(db_usuario):
+    customs = db_usuario.get("tratamientos_custom", [])
+    clave = firma_catalogo(customs, db_usuario.get("tratamientos_ocultos", []))
+    with _catalogos_lock:
+        if clave in _catalogos:
+            _catalogos.move_to_end(clave)
+            return _catalogos[clave]
+    catalogo = Catalogo(obtener_catalogo(customs, db_usuario))
+    with _catalogos_lock:
+        _catalogos[clave] = catalogo
+        while len(_catalogos) > CATALOGOS_EN_CACHE: _catalogos.popitem(last=False)
+    return catalogo
+
+SECCIONES_CATALOGO = ("tratamientos_custom", "tratamientos_ocultos")
+
+class VersionesCatalogo:
+    # usuario -> versión que cambia con cada mutación de sus personalizados u ocultos
+    # (o una recarga completa). Quien guardó la versión junto a un catálogo sabe si
+    # sigue valiendo sin volver a calcular la firma.
+    def __init__(self, compartidos):
+        self._lock = threading.Lock()
+        self._recargas = 0
+        self._versiones = {}
+        compartidos.observar(self._observar)
+
+    def _observar(self, datos, ops):
+        with self._lock:
+            if ops is None: self._recargas += 1; return
+            for op in ops:
+                ruta = op["ruta"]
+                if len(ruta) < 2 or ruta[1] in SECCIONES_CATALOGO: self._versiones[ruta[0]] = self._versiones.get(ruta[0], 0) + 1
+
+    def __getitem__(self, usuario):
+        with self._lock: return self._recargas, self._versiones.get(usuario, 0)
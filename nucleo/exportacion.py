@@ -0,0 +1,93 @@
+import csv
+import io
+import tempfile
+
+from .almacen import MapaSegmentado
+
+# ==============================================================================
+# EXPORTACIÓN (CSV / XLSX)
+# ==============================================================================
+# Cada hoja es un generador de filas que recorre el árbol fecha a fecha. Los
+# escritores consumen fila a fila y escriben en un archivo temporal anónimo
+# (openpyxl en modo write_only vuelca cada hoja a disco según se escribe), así
+# que la memoria no crece con el historial. Puede ejecutarse en otro hilo
+# mientras las sesiones mutan el árbol: cada nivel se copia antes de recorrerlo.
+
+FORMATOS = {"xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "csv": "text/csv"}
+
+def _nombre(catalogo, tid):
+    t = catalogo.get(tid)
+    return t.nombre if t else tid
+
+def _fechas_en_rango(seccion, desde, hasta):
+    d, h = desde.isoformat(), hasta.isoformat()
+    if isinstance(seccion, MapaSegmentado): return list(seccion.entre(d, h))  # sin cargar los segmentos de fuera
+    return sorted(f for f in list(seccion) if d <= f <= h)
+
+def filas_historial(db_usuario, catalogo, indice, desde, hasta, tratamientos=None):
+    historial = db_usuario.get("historial", {})
+    if tratamientos: fechas = sorted({f for tid in tratamientos for f in indice.fechas_de(tid, desde, hasta)})
+    else: fechas = indice.rango(desde, hasta)
+    for fecha in fechas:
+        for tid, entradas in list(historial.get(fecha, {}).items()):
+            if tratamientos and tid not in tratamientos: continue
+            nombre = _nombre(catalogo, tid)
+            for e in list(entradas): yield fecha, tid, nombre, e.get("hora"), e.get("detalle")
+
+def filas_descartados(db_usuario, catalogo, indice, desde, hasta, tratamientos=None):
+    descartados = db_usuario.get("descartados", {})
+    for fecha in _fechas_en_rango(descartados, desde, hasta):
+        for tid in list(descartados.get(fecha, [])):
+            if tratamientos and tid not in tratamientos: continue
+            yield fecha, tid, _nombre(catalogo, tid)
+
+def filas_ciclos(db_usuario, catalogo, indice, desde, hasta, tratamientos=None):
+    # Ciclos de clínica empezados hasta el final del rango (los anteriores pueden seguir en curso)
+    for tid, ciclo in sorted(list(db_usuario.get("ciclos_activos", {}).items())):
+        if not ciclo or (tratamientos and tid not in tratamientos): continue
+        if ciclo.get("fecha_inicio", "") > hasta.isoformat(): continue
+        yield (tid, _nombre(catalogo, tid), ciclo.get("fecha_inicio"), bool(ciclo.get("activo")), ciclo.get("modo"), ciclo.get("estado"),
+               ", ".join(map(str, ciclo.get("dias_saltados", []))))
+
+def filas_cardio(db_usuario, catalogo, indice, desde, hasta, tratamientos=None):
+    cardio = db_usuario.get("meta_cardio", {})
+    for fecha in _fechas_en_rango(cardio, desde, hasta):
+        params = dict(cardio.get(fecha) or {})
+        yield fecha, params.get("actividad"), params.get("tiempo"), params.get("velocidad"), params.get("inclinacion")
+
+HOJAS = {
+    "Historial": (("Fecha", "ID", "Tratamiento", "Hora", "Detalle"), filas_historial),
+    "Descartados": (("Fecha", "ID", "Tratamiento"), filas_descartados),
+    "Clínica": (("ID", "Tratamiento", "Inicio", "Activo", "Modo", "Estado", "Días saltados"), filas_ciclos),
+    "Cardio": (("Fecha", "Actividad", "Minutos", "Km/h", "Inclinación %"), filas_cardio),
+}
+
+def escribir_xlsx(hojas, destino):
+    from openpyxl import Workbook  # solo al exportar a Excel
+    libro = Workbook(write_only=True)
+    for titulo, cabecera, filas in hojas:
+        hoja = libro.create_sheet(titulo)
+        hoja.append(cabecera)
+        for fila in filas: hoja.append(fila)
+    libro.save(destino)
+
+def escribir_csv(cabecera, filas, destino):
+    texto = io.TextIOWrapper(destino, encoding="utf-8-sig", newline="")  # BOM: Excel respeta los acentos
+    escritor = csv.writer(texto)
+    escritor.writerow(cabecera)
+    escritor.writerows(filas)
+    texto.flush(); texto.detach()
+
+def rebobinar(archivo):
+    # Un archivo ya exportado se puede descargar varias veces
+    archivo.seek(0)
+    return archivo
+
+def exportar(formato, nombres_hojas, db_usuario, catalogo, indice, desde, hasta, tratamientos=None):
+    # Archivo temporal anónimo (se borra al cerrarlo) listo para leer desde el principio
+    hojas = [(nombre, HOJAS[nombre][0], HOJAS[nombre][1](db_usuario, catalogo, indice, desde, hasta, tratamientos)) for nombre in nombres_hojas]
+    destino = tempfile.TemporaryFile()
+    if formato == "xlsx": escribir_xlsx(hojas, destino)
+    else: escribir_csv(hojas[0][1], hojas[0][2], destino)  # un CSV lleva una sola hoja
+    destino.seek(0)
+    return destino
@@ -0,0 +1,101 @@
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# ==============================================================================
+# CONSULTAS A LA IA (GEMINI)
+# ==============================================================================
+# Los modelos compiten: se lanzan todos a la vez y gana la primera respuesta que
+# sea un JSON válido; el resto se abandona. Hay un plazo para el conjunto y cada
+# petición lleva ese mismo timeout, así que un modelo lento o caído ya no retrasa
+# a los demás. El cliente es cualquier objeto con generar(modelo, prompt, plazo)
+# -> texto, de modo que puede sustituirse por uno local sin red.
+
+MODELOS_IA = ("gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-flash")
+PLAZO_IA = 20.0  # segundos para toda la carrera
+
+VERSION_PROMPT_IA = 1  # súbela al cambiar PROMPT_IA: las respuestas en caché del prompt anterior dejan de servir
+PROMPT_IA = """
+    Actúa como experto en Fotobiomodulación. Usuario: "{dolencia}".
+    Genera una LISTA de posibles tratamientos en formato JSON Array.
+    Cada objeto debe tener:
+    {{
+        "nombre": "Título",
+        "zona": "Parte cuerpo",
+        "descripcion": "Qué hace biológicamente (max 20 palabras)",
+        "sintomas": "Síntomas que confirma (max 20 palabras)",
+        "posicion": "Cómo poner el panel y el cuerpo (max 20 palabras)",
+        "ondas": "660+850",
+        "energia": "Texto resumen",
+        "frecuencias": [[660, 50], [850, 100]],
+        "hz": "Texto Hz",
+        "dist": "Texto dist",
+        "dur": 10,
+        "tips_ant": ["Tip 1"],
+        "tips_des": ["Tip 1"],
+        "es_lesion": true,
+        "tipo": "LESION"
+    }}
+    Devuelve un JSON Array con 1 a 3 opciones.
+    """
+
+log = logging.getLogger(__name__)
+
+class ErrorIA(Exception):
+    def __init__(self, motivos):
+        self.motivos = motivos  # modelo -> por qué no sirvió
+        super().__init__("; ".join(f"{m}: {motivo}" for m, motivo in motivos.items()))
+
+class ClienteGemini:
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def generar(self, modelo, prompt, plazo):
+        import google.generativeai as genai  # solo al llamar de verdad a la API (un acierto de caché no lo carga)
+        genai.configure(api_key=self.api_key)
+        respuesta = genai.GenerativeModel(modelo).generate_content(prompt, request_options={"timeout": plazo})
+        return respuesta.text
+
+def parsear_opciones(texto):
+    datos = json.loads(texto.replace("```json", "").replace("```", "").strip())
+    if isinstance(datos, dict): datos = [datos]
+    if not isinstance(datos, list) or not datos or not all(isinstance(d, dict) and d.get("nombre") for d in datos):
+        raise ValueError("no es una lista de tratamientos")
+    return datos
+
+def _pedir(cliente, modelo, prompt, plazo):
+    return parsear_opciones(cliente.generar(modelo, prompt, plazo))
+
+def carrera(cliente, prompt, modelos=MODELOS_IA, plazo=PLAZO_IA):
+    # -> (modelo ganador, opciones); ErrorIA con el motivo de cada modelo si ninguno sirve a tiempo
+    limite = time.monotonic() + plazo
+    pool = ThreadPoolExecutor(max_workers=len(modelos), thread_name_prefix="ia")
+    pendientes = {pool.submit(_pedir, cliente, m, prompt, plazo): m for m in modelos}
+    motivos = {}
+    try:
+        while pendientes:
+            hechos, _ = wait(pendientes, timeout=max(0.0, limite - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not hechos: break
+            for futuro in hechos:
+                modelo = pendientes.pop(futuro)
+                try: return modelo, futuro.result()
+                except Exception as e:
+                    motivos[modelo] = f"{type(e).__name__}: {e}"
+                    log.warning("El modelo %s no sirvió: %s", modelo, motivos[modelo])
+        for modelo in pendientes.values(): motivos[modelo] = f"sin respuesta en {plazo:g} s"
+        raise ErrorIA(motivos)
+    finally:
+        # Los perdedores no se esperan: los que no han empezado se cancelan y los que
+        # están en curso terminan solos (como mucho al agotar su timeout)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def consultar(cliente, dolencia, cache=None, modelos=MODELOS_IA, plazo=PLAZO_IA):
+    # -> (opciones, desde_caché); las consultas equivalentes ya respondidas no vuelven a la IA
+    if cache is not None:
+        guardada = cache.obtener(dolencia, VERSION_PROMPT_IA)
+        if guardada is not None: return guardada, True
+    if cliente is None: return None, False
+    _, opciones = carrera(cliente, PROMPT_IA.format(dolencia=dolencia), modelos, plazo)
+    if cache is not None: cache.guardar(dolencia, VERSION_PROMPT_IA, opciones)
+    return opciones, False
@@ -0,0 +1,157 @@
+import datetime
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from .almacen import op_anadir, op_fijar
+from .texto import normalizar
+
+# ==============================================================================
+# IMPORTACIÓN (XLSX)
+# ==============================================================================
+# openpyxl en modo read_only lee las filas del zip según se piden, sin cargar el
+# libro entero. Las columnas se validan de una vez con pandas (fechas, días,
+# tratamientos) y cada fila con problemas se devuelve como (fila, motivo) con el
+# número de fila de Excel. Lo importado sale como una lista de operaciones para
+# aplicarlas con un solo mutar(): una escritura aunque sean miles de registros.
+
+DIAS_SEMANA = {"lunes": "0", "martes": "1", "miercoles": "2", "jueves": "3", "viernes": "4", "sabado": "5", "domingo": "6"}
+DETALLE_IMPORTADO = "Importado"
+FORMATOS_FECHA = ("ISO8601", "%d/%m/%Y", "%d-%m-%Y")
+
+# Cabeceras aceptadas (normalizadas) para cada columna del historial
+COLUMNAS_HISTORIAL = {
+    "fecha": ("fecha", "dia", "date"),
+    "tratamiento": ("tratamiento", "id", "nombre", "treatment"),
+    "hora": ("hora", "time"),
+    "detalle": ("detalle", "momento", "nota", "detail"),
+}
+
+class ErrorImportacion(Exception):
+    pass
+
+class Importacion:
+    def __init__(self, ops, errores, leidas, duplicadas=0):
+        self.ops = ops                # operaciones listas para mutar(*ops)
+        self.errores = errores        # [(fila, motivo)]
+        self.leidas = leidas          # filas de datos leídas (sin cabecera ni vacías)
+        self.duplicadas = duplicadas  # ya estaban en el historial o repetidas en el libro
+
+def _filas(archivo, hoja=None):
+    # (número de fila de Excel, valores) de las filas no vacías, cabecera incluida
+    try: libro = load_workbook(archivo, read_only=True, data_only=True)
+    except Exception as e: raise ErrorImportacion(f"No se pudo abrir el libro: {e}") from e
+    try:
+        if hoja is not None and hoja not in libro.sheetnames: raise ErrorImportacion(f"El libro no tiene la hoja '{hoja}'")
+        hoja = libro[hoja] if hoja else libro.worksheets[0]
+        for n, valores in enumerate(hoja.iter_rows(values_only=True), start=1):
+            if any(v is not None and str(v).strip() for v in valores): yield n, valores
+    finally: libro.close()
+
+def _tabla(filas, indices):
+    # Columnas pedidas (posición en la fila) -> DataFrame de objetos indexado por número de fila
+    numeros, columnas = [], {nombre: [] for nombre in indices}
+    for n, valores in filas:
+        numeros.append(n)
+        for nombre, i in indices.items(): columnas[nombre].append(valores[i] if i is not None and i < len(valores) else None)
+    return pd.DataFrame(columnas, index=pd.Index(numeros, name="fila"), dtype=object)
+
+def _vacias(serie):
+    return serie.isna() | (serie.astype(str).str.strip() == "")
+
+def _por_valor(serie, fn):
+    # Las columnas repiten mucho (fechas, tratamientos): cada valor distinto se convierte una vez
+    valores = serie.unique()
+    return serie.map(dict(zip(valores, map(fn, valores))))
+
+def _errores(mascara, motivo, serie):
+    return [(int(n), f"{motivo}: {'(vacío)' if v is None else v}") for n, v in serie[mascara].items()]
+
+# --- RUTINA SEMANAL (hoja 'Semana': día | rutinas separadas por comas) ---
+def leer_rutina(archivo, rutinas_conocidas=None, hoja="Semana"):
+    filas = _filas(archivo, hoja)
+    next(filas, None)  # cabecera
+    df = _tabla(filas, {"dia": 0, "rutinas": 1})
+    errores = []
+    if df.empty: return {}, errores
+    dia = _por_valor(df["dia"].astype(str), normalizar).map(DIAS_SEMANA)
+    errores += _errores(dia.isna(), "día no válido", df["dia"])
+    sin_rutina = dia.notna() & _vacias(df["rutinas"])
+    errores += _errores(sin_rutina, "sin rutinas para", df["dia"])
+    validas = dia.notna() & ~sin_rutina
+    # Una fila por rutina para comprobarlas todas a la vez contra las etiquetas conocidas
+    rutinas = df.loc[validas, "rutinas"].astype(str).str.split(",").explode().str.strip()
+    rutinas = rutinas[rutinas != ""]
+    if rutinas_conocidas is not None:
+        desconocidas = ~rutinas.isin(list(rutinas_conocidas))
+        errores += _errores(desconocidas, "rutina desconocida", rutinas)
+        rutinas = rutinas[~rutinas.index.isin(rutinas.index[desconocidas])]  # la fila entera se descarta
+    semana = {}
+    for n, lista in rutinas.groupby(level=0, sort=True): semana[dia[n]] = list(lista)  # la última fila de cada día gana
+    return semana, sorted(errores)
+
+def ops_rutina(semana):
+    # Solo los días presentes en el libro; el resto de la semana no cambia
+    return [op_fijar(["configuracion_rutina", "semana", d], rutinas) for d, rutinas in sorted(semana.items())]
+
+# --- HISTORIAL DE SESIONES (Fecha | Tratamiento | Hora | Detalle) ---
+def _indices_cabecera(cabecera):
+    nombres = [normalizar(v) if v is not None else "" for v in cabecera]
+    indices = {}
+    for columna, alias in COLUMNAS_HISTORIAL.items():
+        indices[columna] = next((i for i, n in enumerate(nombres) if n in alias), None)
+    faltan = [c for c in ("fecha", "tratamiento") if indices[c] is None]
+    if faltan: raise ErrorImportacion(f"Faltan columnas: {', '.join(faltan)} (cabecera: {', '.join(map(str, cabecera))})")
+    return indices
+
+def _texto(valor):
+    return "" if valor is None or pd.isna(valor) else str(valor).strip()
+
+def _fechas(serie):
+    # Celdas de fecha de Excel o texto; cada formato se prueba de una vez sobre los valores distintos aún sin fecha
+    valores = pd.Series(serie.unique(), dtype=object)
+    es_fecha = valores.map(lambda v: isinstance(v, datetime.date))
+    fechas = pd.to_datetime(valores.where(es_fecha), errors="coerce")
+    texto = valores.astype(str).str.strip()
+    for formato in FORMATOS_FECHA:
+        pendientes = fechas.isna() & ~es_fecha
+        if pendientes.any(): fechas[pendientes] = pd.to_datetime(texto[pendientes], format=formato, errors="coerce")
+    return serie.map(dict(zip(valores, fechas.dt.strftime("%Y-%m-%d"))))
+
+def _hora(valor):
+    if isinstance(valor, (datetime.time, datetime.datetime)): return valor.strftime("%H:%M")
+    return _texto(valor)
+
+def leer_historial(archivo, catalogo, db_usuario, clave_usuario, hoja=None):
+    filas = _filas(archivo, hoja)
+    cabecera = next(filas, None)
+    if cabecera is None: raise ErrorImportacion("La hoja está vacía")
+    df = _tabla(filas, _indices_cabecera(cabecera[1]))
+    if df.empty: return Importacion([], [], 0)
+
+    fechas = _fechas(df["fecha"])
+    # Tratamientos por id o por nombre (sin distinguir mayúsculas ni tildes)
+    por_nombre = {normalizar(t.nombre): t.id for t in catalogo}
+    texto = df["tratamiento"].astype(str).str.strip()
+    tids = texto.where(texto.isin(list(catalogo.por_id))).fillna(_por_valor(texto, normalizar).map(por_nombre))
+
+    errores = _errores(fechas.isna(), "fecha no válida", df["fecha"]) + _errores(tids.isna() & fechas.notna(), "tratamiento desconocido", df["tratamiento"])
+    validas = fechas.notna() & tids.notna()
+    registros = pd.DataFrame({"fecha": fechas[validas], "tid": tids[validas],
+                              "hora": _por_valor(df.loc[validas, "hora"], _hora),
+                              "detalle": _por_valor(df.loc[validas, "detalle"], _texto).replace("", DETALLE_IMPORTADO)})
+    total = len(registros)
+    registros = registros.drop_duplicates()
+
+    # Fuera lo que ya está en el historial (misma fecha, tratamiento, hora y detalle)
+    historial = db_usuario.get("historial", {})
+    existentes = {(f, tid, e.get("hora", ""), e.get("detalle", "")) for f in registros["fecha"].unique()
+                  for tid, entradas in list((historial.get(f) or {}).items()) for e in list(entradas)}
+    if existentes:
+        claves = pd.Series(list(zip(*(registros[c].tolist() for c in registros.columns))), index=registros.index)
+        registros = registros[~claves.isin(existentes)]
+
+    registros = registros.sort_values(["fecha", "hora"], kind="stable")
+    ops = [op_anadir([clave_usuario, "historial", f, tid], {"hora": h, "detalle": d})
+           for f, tid, h, d in zip(*(registros[c].tolist() for c in registros.columns))]
+    return Importacion(ops, sorted(errores), len(df), total - len(registros))
@@ -0,0 +1,106 @@
+import bisect
+import datetime
+import threading
+from collections.abc import Mapping
+
+# ==============================================================================
+# ÍNDICE DEL HISTORIAL
+# ==============================================================================
+# Por usuario: ordinales ordenados de los días con registros (rangos con bisect)
+# y, por tratamiento, la lista ordenada de días en que aparece. Se mantiene al
+# día observando DatosCompartidos; tras una recarga completa se reconstruye
+# perezosamente en la siguiente consulta.
+#
+# Lo usan las consultas por rango de fechas o por tratamiento sobre todo el
+# historial (exportación y registros en bruto del Historial). Las reglas y la
+# planificación leen el historial perezoso, que para una semana solo carga sus
+# meses; el índice se comporta como un mapa fecha ISO -> ids registrados ese día,
+# así que también lo aceptan si ya está construido.
+
+def _ordinal(fecha):
+    if isinstance(fecha, str): fecha = datetime.date.fromisoformat(fecha)
+    return fecha.toordinal()
+
+def _iso(ordinal): return datetime.date.fromordinal(ordinal).isoformat()
+
+def _insertar(lista, valor):
+    i = bisect.bisect_left(lista, valor)
+    if i == len(lista) or lista[i] != valor: lista.insert(i, valor)
+
+def _retirar(lista, valor):
+    i = bisect.bisect_left(lista, valor)
+    if i < len(lista) and lista[i] == valor: del lista[i]
+
+class IndiceHistorial(Mapping):
+    def __init__(self, historial=None):
+        self.fechas = []           # ordinales ordenados
+        self.dias = {}             # ordinal -> frozenset de ids
+        self.por_tratamiento = {}  # id -> ordinales ordenados
+        if historial is not None:  # sin `or {}`: contar un mapa por segmentos los carga todos
+            for fecha, dia in historial.items(): self.actualizar_dia(fecha, dia)
+
+    def actualizar_dia(self, fecha, dia):
+        # dia: contenido actual de historial[fecha] (None si ya no existe)
+        o = _ordinal(fecha)
+        antes = self.dias.get(o, frozenset())
+        ahora = frozenset(dia) if dia is not None else frozenset()
+        for tid in antes - ahora:
+            _retirar(self.por_tratamiento[tid], o)
+            if not self.por_tratamiento[tid]: del self.por_tratamiento[tid]
+        for tid in ahora - antes: _insertar(self.por_tratamiento.setdefault(tid, []), o)
+        if dia is None:
+            self.dias.pop(o, None); _retirar(self.fechas, o)
+        else:
+            self.dias[o] = ahora; _insertar(self.fechas, o)
+
+    # --- Mapa fecha -> ids ---
+    def __getitem__(self, fecha):
+        try: return self.dias[_ordinal(fecha)]
+        except (ValueError, TypeError): raise KeyError(fecha)
+    def __contains__(self, fecha):
+        try: return _ordinal(fecha) in self.dias
+        except (ValueError, TypeError): return False
+    def __iter__(self): return (_iso(o) for o in self.fechas)
+    def __len__(self): return len(self.fechas)
+
+    # --- Consultas por rango (extremos incluidos; date o ISO) ---
+    def rango(self, desde, hasta):
+        i = bisect.bisect_left(self.fechas, _ordinal(desde))
+        j = bisect.bisect_right(self.fechas, _ordinal(hasta))
+        return [_iso(o) for o in self.fechas[i:j]]
+
+    def fechas_de(self, tid, desde=None, hasta=None):
+        lista = self.por_tratamiento.get(tid, [])
+        i = bisect.bisect_left(lista, _ordinal(desde)) if desde is not None else 0
+        j = bisect.bisect_right(lista, _ordinal(hasta)) if hasta is not None else len(lista)
+        return [_iso(o) for o in lista[i:j]]
+
+class IndicesHistorial:
+    # Un IndiceHistorial por usuario sobre el árbol de un DatosCompartidos
+    def __init__(self, compartidos):
+        self.compartidos = compartidos
+        self._lock = threading.Lock()
+        self._datos = None
+        self._indices = {}
+        compartidos.observar(self.actualizar)
+
+    def actualizar(self, datos, ops):
+        with self._lock:
+            if ops is None or datos is not self._datos:
+                self._datos, self._indices = datos, {}
+                return
+            for op in ops:
+                usuario, ruta = op["ruta"][0], op["ruta"][1:]
+                if usuario not in self._indices or not ruta or ruta[0] != "historial": continue
+                if len(ruta) == 1: del self._indices[usuario]; continue  # historial completo: se reconstruye
+                historial = datos[usuario]["historial"]
+                fecha = ruta[1]
+                self._indices[usuario].actualizar_dia(fecha, historial[fecha] if fecha in historial else None)
+
+    def __getitem__(self, usuario):
+        datos = self.compartidos.obtener()
+        with self._lock:
+            if datos is not self._datos: self._datos, self._indices = datos, {}
+            if usuario not in self._indices:
+                self._indices[usuario] = IndiceHistorial(datos.get(usuario, {}).get("historial"))
+            return self._indices[usuario]
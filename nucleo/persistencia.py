@@ -0,0 +1,42 @@
+import copy
+import os
+
+from . import almacen
+from .planificacion import RUTINA_SEMANAL, TAGS_ACTIVIDADES
+
+USUARIOS = ("usuario_rutina", "usuario_libre")
+
+# ==============================================================================
+# ÁRBOL POR DEFECTO Y APERTURA DEL ALMACÉN (sin Streamlit; app.py fija las rutas)
+# ==============================================================================
+def datos_por_defecto():
+    usuario = {"historial": {}, "meta_diaria": {}, "meta_cardio": {}, "ciclos_activos": {}, "descartados": {}, "planificados_adhoc": {}, "tratamientos_custom": [], "confirmaciones_diarias": {}, "tratamientos_ocultos": []}
+    datos = {"configuracion_rutina": copy.deepcopy({"semana": RUTINA_SEMANAL, "tags": TAGS_ACTIVIDADES})}
+    for user in USUARIOS: datos[user] = copy.deepcopy(usuario)
+    return datos
+
+def completar(datos):
+    # Rellena las claves que falten (archivos de versiones anteriores, o una configuración
+    # escrita solo en parte, p.ej. importando unos días de la rutina) sin tocar las existentes
+    default_db = datos_por_defecto()
+    if datos is None: return default_db
+    config = datos.setdefault("configuracion_rutina", default_db["configuracion_rutina"])
+    for k, v in default_db["configuracion_rutina"].items(): config.setdefault(k, v)
+    for dia, rutinas in default_db["configuracion_rutina"]["semana"].items(): config["semana"].setdefault(dia, rutinas)
+    for user in USUARIOS:
+        if user not in datos: datos[user] = default_db[user]
+        for k, v in default_db[user].items():
+            if k not in datos[user]: datos[user][k] = v
+    return datos
+
+def abrir(backend, archivo_json, archivo_sqlite):
+    if backend == "sqlite":
+        # Migración única la primera vez que se activa SQLite sobre datos JSON existentes
+        if not os.path.exists(archivo_sqlite) and almacen.hay_datos_json(archivo_json):
+            almacen.migrar_json_a_sqlite(archivo_json, archivo_sqlite)
+        return almacen.abrir_almacen("sqlite", archivo_sqlite)
+    return almacen.abrir_almacen("json", archivo_json)
+
+def cargar(cola):
+    # Un archivo dañado lanza almacen.ErrorAlmacen en vez de sustituirse en silencio por el árbol vacío
+    return completar(cola.cargar())
@@ -0,0 +1,146 @@
+import datetime
+from dataclasses import dataclass, field
+
+from .reglas import MOMENTOS, evaluar_bloqueos
+
+# ==============================================================================
+# PLANIFICACIÓN: RUTINA SEMANAL Y PLAN DE CADA DÍA
+# ==============================================================================
+# planificar_semana calcula de una pasada todo lo que pinta un día (rutina, tags,
+# tratamientos visibles, grupos y bloqueos) para varias fechas a la vez; la
+# interfaz solo recorre el resultado.
+
+RUTINA_SEMANAL = {
+    "0": ["FULLBODY I"],            # Lunes
+    "1": ["TORSO I"],               # Martes
+    "2": ["PREVENTIVO I"],          # Miércoles
+    "3": ["FULLBODY II"],           # Jueves
+    "4": ["TORSO II / CIRCUITO"],   # Viernes
+    "5": ["PREVENTIVO II"],         # Sábado
+    "6": ["Descanso Total"]         # Domingo
+}
+
+CARDIO_DEFAULTS_BY_DAY = {
+    "0": {"actividad": "Remo Ergómetro", "tiempo": 8, "ritmo": "Intenso"},
+    "2": {"actividad": "Cinta Inclinada", "tiempo": 20, "velocidad": 6.5, "inclinacion": 4.0},
+    "5": {"actividad": "Cinta Inclinada", "tiempo": 15, "velocidad": 6.5, "inclinacion": 4.0}
+}
+
+GENERIC_CARDIO_PARAMS = {
+    "Remo Ergómetro": {"tiempo": 8, "ritmo": "Intenso"},
+    "Cinta Inclinada": {"tiempo": 15, "velocidad": 6.5, "inclinacion": 4.0},
+    "Elíptica": {"tiempo": 15, "velocidad": 6.5},
+    "Andar": {"tiempo": 15},
+    "Andar (Pasos)": {"pasos": 10000},
+    "Descanso Cardio": {}
+}
+
+TAGS_ACTIVIDADES = {
+    "FULLBODY I": ["Upper", "Lower", "Active"], 
+    "TORSO I": ["Upper", "Active"],
+    "PREVENTIVO I": ["Active"], 
+    "FULLBODY II": ["Upper", "Lower", "Active"],
+    "TORSO + CIRCUITO": ["Upper", "Active", "Cardio"], 
+    "PREVENTIVO II": ["Active"],
+    "Descanso Total": [],
+    "Remo Ergómetro": ["Active", "Cardio", "Upper", "Lower"],
+    "Cinta Inclinada": ["Active", "Cardio", "Lower"],
+    "Elíptica": ["Active", "Cardio", "Lower"],
+    "Andar": ["Active", "Lower"],
+    "Andar (Pasos)": ["Active", "Lower"],
+    "Descanso Cardio": []
+}
+
+def obtener_rutina_completa(fecha_obj, db_global, db_usuario):
+    fecha_iso = fecha_obj.isoformat()
+    dia_str = str(fecha_obj.weekday())
+    rutina_manual = db_usuario.get("meta_diaria", {}).get(fecha_iso, None)
+    config_semana = db_global.get("configuracion_rutina", {}).get("semana", RUTINA_SEMANAL)
+    config_tags = db_global.get("configuracion_rutina", {}).get("tags", TAGS_ACTIVIDADES)
+    rutina_fuerza = rutina_manual if rutina_manual is not None else config_semana.get(dia_str, [])
+    es_manual_f = (rutina_manual is not None)
+    cardio_manual = db_usuario.get("meta_cardio", {}).get(fecha_iso, None)
+    if cardio_manual:
+        rutina_cardio = cardio_manual; es_manual_c = True
+    else:
+        rutina_cardio = CARDIO_DEFAULTS_BY_DAY.get(dia_str, {"actividad": "Descanso Cardio"})
+        es_manual_c = False
+    tags = set(['All'])
+    for r in rutina_fuerza:
+        if r in config_tags: tags.update(config_tags[r])
+    act = rutina_cardio.get("actividad", "Descanso Cardio")
+    if act in TAGS_ACTIVIDADES: tags.update(TAGS_ACTIVIDADES[act])
+    # Devuelve lista completa de posibles rutinas para el selector
+    todas_rutinas = list(config_tags.keys())
+    return rutina_fuerza, rutina_cardio, tags, es_manual_f, es_manual_c, todas_rutinas
+
+def obtener_tratamientos_presentes(fecha_str, db_usuario, lista_tratamientos, indice):
+    presentes = set()
+    presentes.update(indice.get(fecha_str, ()))
+    presentes.update(db_usuario["planificados_adhoc"].get(fecha_str, {}).keys())
+    for tid, ciclo in db_usuario["ciclos_activos"].items():
+        if ciclo and ciclo.get('activo') and tid in lista_tratamientos.por_id: presentes.add(tid)
+    return presentes
+
+GRUPOS = ("PRE", "POST", "MORNING", "NIGHT", "FLEX", "COMPLETED", "DISCARDED", "HIDDEN")
+
+def grupo_de_momento(momento):
+    # Momento elegido en la tarjeta (radio) -> grupo en el que se muestra
+    if "Pre" in momento: return "PRE"
+    if "Post" in momento: return "POST"
+    if "Noche" in momento: return "NIGHT"
+    return "FLEX"
+
+@dataclass
+class PlanDia:
+    fecha: datetime.date
+    fecha_str: str
+    rutina_fuerza: list
+    rutina_cardio: dict
+    tags: set
+    manual_f: bool
+    manual_c: bool
+    todas_rutinas: list
+    confirmado: bool
+    adhoc: dict
+    registros: dict
+    descartados: list
+    to_show: list = field(default_factory=list)   # [(Tratamiento, "adhoc" | "clinica")] en orden de catálogo
+    grupos: dict = field(default_factory=dict)
+    bloqueos: dict = field(default_factory=dict)  # (id, fecha, momento) -> (bloqueado, motivo), compartido por la semana
+    version: int = 0  # versión de los datos con la que se calculó (para saber si un fragmento lo tiene viejo)
+
+def grupo_de(plan, t, sesion):
+    if t.id in plan.descartados: return "DISCARDED"
+    if len(plan.registros.get(t.id, [])) >= t.max_diario: return "COMPLETED"
+    elegido = sesion.get(f"rad_{t.id}_{plan.fecha_str}")
+    if elegido is not None: return grupo_de_momento(elegido)
+    planned_code = plan.adhoc.get(t.id, "FLEX")
+    g = planned_code if planned_code in GRUPOS else t.default_visual_group
+    return g if g in GRUPOS else "FLEX"
+
+def planificar_semana(fechas, db_global, db_usuario, catalogo, indice, clave_usuario, sesion=None, version=0):
+    # sesion: estado de los widgets (st.session_state) para respetar el momento ya elegido en cada tarjeta
+    # indice: un IndiceHistorial o el propio historial (fecha -> registros); solo se consultan estas fechas y la semana previa
+    sesion = sesion if sesion is not None else {}
+    planes = []
+    for fecha in fechas:
+        fecha_str = fecha.isoformat()
+        rutina_fuerza, rutina_cardio, tags, manual_f, manual_c, todas = obtener_rutina_completa(fecha, db_global, db_usuario)
+        plan = PlanDia(fecha, fecha_str, rutina_fuerza, rutina_cardio, tags, manual_f, manual_c, todas,
+                       db_usuario.get("confirmaciones_diarias", {}).get(fecha_str, False),
+                       db_usuario.get("planificados_adhoc", {}).get(fecha_str, {}),
+                       db_usuario["historial"].get(fecha_str, {}),
+                       db_usuario.get("descartados", {}).get(fecha_str, []), version=version)
+        presentes = obtener_tratamientos_presentes(fecha_str, db_usuario, catalogo, indice)
+        for tid in sorted((tid for tid in presentes if tid in catalogo.posicion), key=catalogo.posicion.get):
+            t = catalogo.por_id[tid]
+            plan.to_show.append((t, "adhoc" if tid in plan.adhoc or tid in plan.registros else "clinica"))
+        plan.grupos = {g: [] for g in GRUPOS}
+        for t, origen in plan.to_show: plan.grupos[grupo_de(plan, t, sesion)].append((t, origen))
+        planes.append(plan)
+    # Bloqueos de todas las tarjetas de todos los días en una sola evaluación
+    visibles = {t.id: t for plan in planes for t, _ in plan.to_show}
+    bloqueos = evaluar_bloqueos(list(visibles.values()), [p.fecha for p in planes], indice, {p.fecha_str: p.tags for p in planes}, clave_usuario)
+    for plan in planes: plan.bloqueos = bloqueos
+    return planes
@@ -0,0 +1,61 @@
+import datetime
+from datetime import timedelta
+
+# ==============================================================================
+# REGLAS DE BLOQUEO
+# ==============================================================================
+# analizar_bloqueos evalúa un tratamiento en un día y momento concretos.
+# evaluar_bloqueos da exactamente los mismos resultados para todos los
+# (tratamiento, fecha, momento) de un rango de una pasada: cada día del historial
+# se consulta una vez y el uso semanal sale de un contador deslizante de 7 días.
+
+# Momentos que se eligen al añadir o registrar (etiqueta -> código de planificados_adhoc);
+# los bloqueos se evalúan para cada etiqueta
+MOMENTOS = {"🏋️ Entrenamiento (Pre)": "PRE", "🚿 Post-Entreno / Mañana": "POST", "⛅ Tarde": "FLEX", "🌙 Noche": "NIGHT"}
+VENTANA_SEMANAL = 7
+
+def analizar_bloqueos(tratamiento, momento, historial, registros_hoy, fecha_str, tags_dia, clave_usuario):
+    if clave_usuario == "usuario_rutina":
+        if 'Active' in tratamiento.tags_entreno and 'Active' not in tags_dia: return True, "⚠️ FALTA ACTIVIDAD"
+    if momento in tratamiento.momentos_prohibidos: return True, "⛔ HORARIO PROHIBIDO"
+    dias_hechos = 0
+    fecha_dt = datetime.date.fromisoformat(fecha_str)
+    for i in range(VENTANA_SEMANAL):
+        f = (fecha_dt - timedelta(days=i)).isoformat()
+        if f in historial and tratamiento.id in historial[f]: dias_hechos += 1
+    hecho_hoy = (fecha_str in historial and tratamiento.id in historial[fecha_str])
+    if not hecho_hoy and dias_hechos >= tratamiento.max_semanal: return True, "⛔ MAX SEMANAL"
+    for inc in tratamiento.incompatible_with:
+        if inc in registros_hoy: return True, "⛔ INCOMPATIBLE"
+    return False, ""
+
+def evaluar_bloqueos(tratamientos, fechas, historial, tags_por_fecha, clave_usuario, momentos=MOMENTOS):
+    # -> {(id, fecha_iso, momento): (bloqueado, motivo)} para cada fecha de `fechas` (date)
+    fechas = sorted(set(fechas))
+    if not fechas or not tratamientos: return {}
+    inicio, fin = fechas[0] - timedelta(days=VENTANA_SEMANAL - 1), fechas[-1]
+    # Un acceso al historial por día del rango ampliado
+    dias = [(inicio + timedelta(days=i)).isoformat() for i in range((fin - inicio).days + 1)]
+    registros = [historial[f] if f in historial else None for f in dias]
+    pedidas = {(f - inicio).days for f in fechas}
+    resultado = {}
+    for t in tratamientos:
+        semana = 0
+        for i, f in enumerate(dias):
+            semana += 1 if registros[i] is not None and t.id in registros[i] else 0
+            if i >= VENTANA_SEMANAL:
+                previo = registros[i - VENTANA_SEMANAL]
+                semana -= 1 if previo is not None and t.id in previo else 0
+            if i not in pedidas: continue
+            hoy = registros[i] if registros[i] is not None else {}
+            if clave_usuario == "usuario_rutina" and 'Active' in t.tags_entreno and 'Active' not in tags_por_fecha.get(f, []):
+                comun = (True, "⚠️ FALTA ACTIVIDAD")
+            else: comun = None
+            if t.id not in hoy and semana >= t.max_semanal: resto = (True, "⛔ MAX SEMANAL")
+            elif any(inc in hoy for inc in t.incompatible_with): resto = (True, "⛔ INCOMPATIBLE")
+            else: resto = (False, "")
+            for m in momentos:
+                if comun: resultado[(t.id, f, m)] = comun
+                elif m in t.momentos_prohibidos: resultado[(t.id, f, m)] = (True, "⛔ HORARIO PROHIBIDO")
+                else: resultado[(t.id, f, m)] = resto
+    return resultado
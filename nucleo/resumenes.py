@@ -0,0 +1,201 @@
+import bisect
+import datetime
+import heapq
+import threading
+from collections import Counter
+from itertools import groupby
+from operator import itemgetter
+
+from .almacen import MapaSegmentado
+
+# ==============================================================================
+# RESÚMENES DEL HISTORIAL
+# ==============================================================================
+# Por usuario y periodo (día, semana ISO, mes): sesiones y días con registro por
+# tratamiento, cuántos planificados de la agenda se hicieron y cuántos se
+# descartaron. Cada día guarda su aportación; al cambiar un día se resta la vieja
+# y se suma la nueva a su semana y a su mes, así que registrar o deshacer cuesta
+# lo mismo con un mes que con años de historial. Se mantiene al día observando
+# DatosCompartidos, igual que indice.py.
+#
+# La adherencia a la clínica no se acumula: depende de los ciclos activos ahora
+# mismo y se calcula al mostrar cada periodo (adherencia_clinica).
+
+PERIODOS = ("dia", "semana", "mes")
+SECCIONES = ("historial", "planificados_adhoc", "descartados")
+
+def clave_periodo(fecha, periodo):
+    if isinstance(fecha, str): fecha = datetime.date.fromisoformat(fecha)
+    if periodo == "semana":
+        anio, semana, _ = fecha.isocalendar()
+        return f"{anio}-S{semana:02d}"
+    if periodo == "mes": return fecha.strftime("%Y-%m")
+    return fecha.isoformat()
+
+def limites_periodo(clave, periodo):
+    # (primer día, último día) del periodo
+    if periodo == "semana":
+        anio, semana = clave.split("-S")
+        inicio = datetime.date.fromisocalendar(int(anio), int(semana), 1)
+        return inicio, inicio + datetime.timedelta(days=6)
+    if periodo == "mes":
+        inicio = datetime.date.fromisoformat(clave + "-01")
+        siguiente = (inicio + datetime.timedelta(days=32)).replace(day=1)
+        return inicio, siguiente - datetime.timedelta(days=1)
+    dia = datetime.date.fromisoformat(clave)
+    return dia, dia
+
+def _en_orden(seccion, i):
+    # (fecha, i, valor) por fecha; un mapa por segmentos ya itera en orden y no hay que materializarlo
+    for fecha, valor in (seccion.items() if isinstance(seccion, MapaSegmentado) else sorted(seccion.items())):
+        yield fecha, i, valor
+
+def _retirar(lista, valor):
+    i = bisect.bisect_left(lista, valor)
+    if i < len(lista) and lista[i] == valor: del lista[i]
+
+class Resumen:
+    __slots__ = ("sesiones", "dias", "planificados", "cumplidos", "descartados")
+
+    def __init__(self):
+        self.sesiones = Counter()  # id -> registros
+        self.dias = Counter()      # id -> días con al menos un registro
+        self.planificados = 0      # entradas de planificados_adhoc
+        self.cumplidos = 0         # de esas, las registradas el mismo día
+        self.descartados = 0
+
+    @classmethod
+    def de_dia(cls, historial_dia, adhoc_dia, descartados_dia):
+        r = cls()
+        for tid, entradas in (historial_dia or {}).items():
+            if entradas:
+                r.sesiones[tid] = len(entradas)
+                r.dias[tid] = 1
+        r.planificados = len(adhoc_dia or ())
+        r.cumplidos = sum(1 for tid in (adhoc_dia or ()) if tid in r.dias)
+        r.descartados = len(descartados_dia or ())
+        return r
+
+    def sumar(self, otro, signo=1):
+        for tid, n in otro.sesiones.items(): self.sesiones[tid] += signo * n
+        for tid, n in otro.dias.items(): self.dias[tid] += signo * n
+        if signo < 0:
+            self.sesiones = +self.sesiones; self.dias = +self.dias  # sin contadores a cero
+        self.planificados += signo * otro.planificados
+        self.cumplidos += signo * otro.cumplidos
+        self.descartados += signo * otro.descartados
+
+    @property
+    def total_sesiones(self): return sum(self.sesiones.values())
+
+    @property
+    def vacio(self): return not (self.sesiones or self.planificados or self.descartados)
+
+    @property
+    def adherencia_agenda(self):
+        return self.cumplidos / self.planificados if self.planificados else None
+
+def adherencia_clinica(resumen, desde, hasta, ciclos_activos, hoy=None):
+    # Días con sesión de cada ciclo activo frente a los días que llevaba en curso dentro del periodo
+    hoy = hoy or datetime.date.today()
+    esperados = hechos = 0
+    for tid, ciclo in ciclos_activos.items():
+        if not ciclo or not ciclo.get("activo"): continue
+        try: inicio = max(desde, datetime.date.fromisoformat(ciclo.get("fecha_inicio", "")))
+        except ValueError: inicio = desde
+        dias = (min(hasta, hoy) - inicio).days + 1
+        if dias <= 0: continue
+        esperados += dias
+        hechos += min(resumen.dias.get(tid, 0), dias)
+    return hechos / esperados if esperados else None
+
+class ResumenesUsuario:
+    def __init__(self, db_usuario=None):
+        self.dias = {}                             # fecha ISO -> Resumen del día
+        self.periodos = {"semana": {}, "mes": {}}  # clave -> Resumen acumulado
+        self.claves = {p: [] for p in PERIODOS}    # claves ordenadas por periodo
+        if db_usuario:
+            # Un recorrido ordenado por sección a la vez: en un mapa por segmentos cada mes se
+            # lee una sola vez, en vez de saltar entre meses y desalojarlos del LRU
+            flujos = [_en_orden(db_usuario[s], i) for i, s in enumerate(SECCIONES) if db_usuario.get(s) is not None]
+            for fecha, grupo in groupby(heapq.merge(*flujos, key=itemgetter(0, 1)), key=itemgetter(0)):
+                valores = [None] * len(SECCIONES)
+                for _, i, v in grupo: valores[i] = v
+                self._fijar_dia(fecha, Resumen.de_dia(*valores))
+
+    def actualizar_dia(self, fecha, db_usuario):
+        # Sin `or {}`: en un mapa por segmentos el valor de verdad cuenta (y carga) todo el historial
+        self._fijar_dia(fecha, Resumen.de_dia(*(db_usuario[s].get(fecha) if db_usuario.get(s) is not None else None for s in SECCIONES)))
+
+    def _fijar_dia(self, fecha, nuevo):
+        try: clave_periodo(fecha, "dia")
+        except (ValueError, TypeError): return  # claves que no son fechas
+        viejo = self.dias.pop(fecha, None)
+        if viejo is not None: _retirar(self.claves["dia"], fecha)
+        if not nuevo.vacio:
+            self.dias[fecha] = nuevo
+            bisect.insort(self.claves["dia"], fecha)
+        for periodo, acumulados in self.periodos.items():
+            clave = clave_periodo(fecha, periodo)
+            total = acumulados.get(clave)
+            if total is None: total = acumulados[clave] = Resumen(); bisect.insort(self.claves[periodo], clave)
+            if viejo is not None: total.sumar(viejo, -1)
+            total.sumar(nuevo)
+            if total.vacio:
+                del acumulados[clave]; _retirar(self.claves[periodo], clave)
+
+    def resumen(self, periodo, clave):
+        if periodo == "dia": return self.dias.get(clave) or Resumen()
+        return self.periodos[periodo].get(clave) or Resumen()
+
+class ResumenesHistorial:
+    # Un ResumenesUsuario por usuario sobre el árbol de un DatosCompartidos
+    def __init__(self, compartidos):
+        self.compartidos = compartidos
+        self._lock = threading.Lock()
+        self._lock_construccion = threading.Lock()
+        self._datos = None
+        self._resumenes = {}
+        self._pendientes = {}  # usuario en construcción -> fechas cambiadas mientras tanto (None: sección completa)
+        compartidos.observar(self.actualizar)
+
+    def actualizar(self, datos, ops):
+        with self._lock:
+            if ops is None or datos is not self._datos:
+                self._datos, self._resumenes = datos, {}
+                return
+            for op in ops:
+                usuario, ruta = op["ruta"][0], op["ruta"][1:]
+                if not ruta or ruta[0] not in SECCIONES: continue
+                if self._pendientes.get(usuario) is not None:
+                    if len(ruta) == 1: self._pendientes[usuario] = None
+                    else: self._pendientes[usuario].add(ruta[1])
+                if usuario not in self._resumenes: continue
+                if len(ruta) == 1: del self._resumenes[usuario]; continue  # sección completa: se reconstruye
+                self._resumenes[usuario].actualizar_dia(ruta[1], datos[usuario])
+
+    def listo(self, usuario):
+        # Ya construido para el árbol actual: acceder con [usuario] no tendrá que recorrer el historial
+        datos = self.compartidos.obtener()
+        with self._lock: return datos is self._datos and usuario in self._resumenes
+
+    def __getitem__(self, usuario):
+        datos = self.compartidos.obtener()
+        with self._lock:
+            if datos is not self._datos: self._datos, self._resumenes = datos, {}
+            if usuario in self._resumenes: return self._resumenes[usuario]
+        # El recorrido va fuera de self._lock para no frenar los mutar() de nadie; lo que
+        # cambie mientras tanto se anota y se rehace al final (un día cuesta poco)
+        with self._lock_construccion:
+            while True:
+                with self._lock:
+                    if datos is self._datos and usuario in self._resumenes: return self._resumenes[usuario]
+                    self._pendientes[usuario] = set()
+                resumenes = ResumenesUsuario(datos.get(usuario, {}))
+                with self._lock:
+                    pendientes = self._pendientes.pop(usuario)
+                    if datos is not self._datos: return resumenes  # se recargó el árbol: no se guarda
+                    if pendientes is None: continue  # se sustituyó una sección entera
+                    for fecha in sorted(pendientes): resumenes.actualizar_dia(fecha, datos[usuario])
+                    self._resumenes[usuario] = resumenes
+                    return resumenes
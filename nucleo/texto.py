@@ -0,0 +1,18 @@
+import re
+import unicodedata
+
+# ==============================================================================
+# NORMALIZACIÓN DE TEXTO
+# ==============================================================================
+# Comparaciones sin mayúsculas ni tildes: "Miércoles" == "miercoles".
+
+PALABRAS_VACIAS = frozenset("a al con de del el en la las lo los me mi mis muy para por que se su sus tengo un una y".split())
+_NO_PALABRA = re.compile(r"[^\w]+")
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).strip().casefold())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def terminos(texto):
+    # Palabras normalizadas sin puntuación ni palabras vacías
+    return [p for p in _NO_PALABRA.sub(" ", normalizar(texto)).split() if p not in PALABRAS_VACIAS]
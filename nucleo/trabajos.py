@@ -0,0 +1,103 @@
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait
+
+# ==============================================================================
+# TRABAJOS EN SEGUNDO PLANO
+# ==============================================================================
+# Un pool acotado por proceso para lo que no debe congelar el script de Streamlit
+# (consultas a la IA, exportaciones grandes, reconstruir resúmenes). Cada trabajo
+# tiene un id que la sesión guarda para consultar su estado y recoger el resultado
+# en un rerun posterior. El número de hilos y de trabajos sin terminar está
+# limitado para todo el proceso, así que muchas sesiones a la vez no lo desbordan.
+#
+# Cancelar quita de la cola lo que no ha empezado; lo que ya corre termina, pero
+# su resultado se descarta, y hasta que acaba sigue ocupando su hilo y contando
+# para el tope. Lo terminado que nadie recoge se olvida pasado RETENCION_TRABAJOS.
+
+MAX_HILOS_TRABAJOS = 4
+MAX_TRABAJOS_PENDIENTES = 32
+RETENCION_TRABAJOS = 600  # segundos
+
+class ErrorTrabajos(Exception):
+    pass
+
+class Trabajo:
+    def __init__(self, descripcion):
+        self.id = uuid.uuid4().hex[:12]
+        self.descripcion = descripcion
+        self.creado = time.monotonic()
+        self.terminado_en = None
+        self.cancelado = threading.Event()
+        self.futuro = None
+
+    @property
+    def terminado(self): return self.cancelado.is_set() or self.futuro.done()
+
+    @property
+    def estado(self):
+        if self.cancelado.is_set(): return "cancelado"
+        if not self.futuro.done(): return "en curso" if self.futuro.running() else "en cola"
+        return "error" if self.futuro.exception() is not None else "hecho"
+
+    @property
+    def segundos(self): return (self.terminado_en or time.monotonic()) - self.creado
+
+    def esperar(self, segundos=None):
+        # True si terminó dentro del plazo
+        if not self.cancelado.is_set(): wait([self.futuro], timeout=segundos)
+        return self.terminado
+
+    def resultado(self):
+        # Devuelve el resultado o relanza el error del trabajo (CancelledError si se canceló)
+        if self.cancelado.is_set(): raise CancelledError()
+        return self.futuro.result()
+
+class Ejecutor:
+    def __init__(self, hilos=MAX_HILOS_TRABAJOS, max_pendientes=MAX_TRABAJOS_PENDIENTES, retencion=RETENCION_TRABAJOS):
+        self.max_pendientes, self.retencion = max_pendientes, retencion
+        self._pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="trabajo")
+        self._lock = threading.Lock()
+        self._trabajos = {}
+
+    def _ejecutar(self, trabajo, fn, args, kwargs):
+        try:
+            if not trabajo.cancelado.is_set(): return fn(*args, **kwargs)
+        finally:
+            if trabajo.terminado_en is None: trabajo.terminado_en = time.monotonic()  # si se canceló, ya lo tiene
+
+    def _purgar(self):
+        # Solo lo que ya no ocupa un hilo: un cancelado que aún corre debe seguir contando
+        limite = time.monotonic() - self.retencion
+        for id_t in [i for i, t in self._trabajos.items() if t.futuro.done() and t.terminado_en is not None and t.terminado_en < limite]:
+            del self._trabajos[id_t]
+
+    def lanzar(self, descripcion, fn, *args, **kwargs):
+        with self._lock:
+            self._purgar()
+            if sum(1 for t in self._trabajos.values() if not t.futuro.done()) >= self.max_pendientes:
+                raise ErrorTrabajos("Hay demasiados trabajos en marcha; inténtalo de nuevo en un momento.")
+            trabajo = Trabajo(descripcion)
+            trabajo.futuro = self._pool.submit(self._ejecutar, trabajo, fn, args, kwargs)
+            self._trabajos[trabajo.id] = trabajo
+            return trabajo
+
+    def obtener(self, id_trabajo):
+        with self._lock: return self._trabajos.get(id_trabajo)
+
+    def cancelar(self, id_trabajo):
+        with self._lock: trabajo = self._trabajos.get(id_trabajo)
+        if trabajo is None or trabajo.terminado: return False
+        trabajo.terminado_en = time.monotonic()
+        trabajo.cancelado.set()
+        trabajo.futuro.cancel()  # solo surte efecto si no había empezado
+        return True
+
+    def retirar(self, id_trabajo):
+        # Lo que aún corre (cancelado) se queda hasta acabar para seguir contando en el tope
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is not None and trabajo.futuro.done(): del self._trabajos[id_trabajo]
+            return trabajo
+
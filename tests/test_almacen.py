@@ -0,0 +1,153 @@
+import json
+import os
+import time
+
+import pytest
+
+from nucleo import almacen
+
+USUARIO = "usuario_rutina"
+
+def registro(fecha, tid):
+    return almacen.op_anadir([USUARIO, "historial", fecha, tid], {"hora": "10:00", "detalle": "Pre"})
+
+def abrir(tmp_path):
+    destino = almacen.AlmacenJSON(str(tmp_path / "datos.json"), umbral_compactacion=10_000)
+    destino.cargar()
+    return destino
+
+def test_diario_cortado_no_pierde_lo_escrito_despues(tmp_path):
+    destino = abrir(tmp_path)
+    destino.registrar([registro("2024-01-01", "a"), registro("2024-01-02", "b")])
+    diario = destino.cuenta(USUARIO).ruta_diario
+    # Caída a mitad de escribir la tercera operación
+    with open(diario, "a") as f: f.write('{"op": "append", "ruta": ["usuario_rutina", "histo')
+
+    destino = abrir(tmp_path)  # reinicio
+    destino.registrar([registro("2024-01-03", "c")])
+    destino.registrar([registro("2024-01-04", "d")])
+
+    datos = abrir(tmp_path).cargar()
+    assert sorted(datos[USUARIO]["historial"]) == ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]
+    with open(diario) as f: seqs = [json.loads(linea)["seq"] for linea in f]
+    assert seqs == [1, 2, 3, 4]
+
+def test_diario_con_ultima_linea_completa_sin_salto(tmp_path):
+    destino = abrir(tmp_path)
+    destino.registrar([registro("2024-01-01", "a")])
+    diario = destino.cuenta(USUARIO).ruta_diario
+    # Se escribió la operación pero no el "\n": la operación vale y se conserva
+    with open(diario, "rb+") as f: f.seek(-1, 2); f.truncate()
+
+    destino = abrir(tmp_path)
+    destino.registrar([registro("2024-01-02", "b")])
+    datos = abrir(tmp_path).cargar()
+    assert sorted(datos[USUARIO]["historial"]) == ["2024-01-01", "2024-01-02"]
+    with open(diario) as f: assert [json.loads(linea)["seq"] for linea in f] == [1, 2]
+
+def test_json_y_sqlite_devuelven_los_mismos_registros(tmp_path):
+    from nucleo import persistencia
+    datos = persistencia.completar(None)
+    datos[USUARIO]["historial"]["2024-01-01"] = {"a": [{"hora": "10:00", "detalle": "Pre"}, {"hora": "21:00"}], "b": [{"detalle": "Batch"}, {}]}
+    extra = [almacen.op_anadir([USUARIO, "historial", "2024-01-02", "c"], {"hora": "09:00"})]
+    leidos = []
+    for clase, ruta in ((almacen.AlmacenJSON, str(tmp_path / "datos.json")), (almacen.AlmacenSQLite, str(tmp_path / "datos.sqlite"))):
+        destino = clase(ruta)
+        destino.guardar(datos)
+        destino.cargar(); destino.registrar(extra)
+        historial = clase(ruta).cargar()[USUARIO]["historial"]
+        leidos.append({f: historial[f] for f in historial})
+    assert leidos[0] == leidos[1] == {"2024-01-01": datos[USUARIO]["historial"]["2024-01-01"], "2024-01-02": {"c": [{"hora": "09:00"}]}}
+
+def test_instantanea_nunca_deja_la_ruta_sin_archivo(tmp_path, monkeypatch):
+    ruta = str(tmp_path / "perfil.json")
+    almacen._escribir_json(ruta, {"v": 1})
+    almacen._escribir_json(ruta, {"v": 2})
+    assert almacen._leer_json(ruta) == {"v": 2} and almacen._leer_json(ruta + ".bak") == {"v": 1}
+    # Caída entre escribir el temporal y renombrarlo: sigue el archivo anterior, no el .bak
+    original = os.replace
+    def caida(origen, destino):
+        if destino == ruta: raise OSError("caída")
+        original(origen, destino)
+    monkeypatch.setattr(almacen.os, "replace", caida)
+    with pytest.raises(OSError): almacen._escribir_json(ruta, {"v": 3})
+    monkeypatch.undo()
+    assert os.path.exists(ruta) and almacen._leer_json(ruta) == {"v": 2}
+    with open(ruta + ".tmp") as f: assert json.load(f) == {"v": 3}
+
+def test_cola_agrupa_los_cambios_seguidos_en_un_lote(tmp_path, monkeypatch):
+    destino = abrir(tmp_path)
+    lotes = []
+    original = destino.escribir
+    monkeypatch.setattr(destino, "escribir", lambda ops: lotes.append(len(ops)) or original(ops))
+    cola = almacen.ColaEscritura(destino, ventana=0.2, espera_maxima=5)
+    for i in range(5): cola.registrar([registro(f"2024-01-0{i + 1}", "a")])
+    time.sleep(0.6)
+    assert lotes == [5]
+
+def test_vaciar_escribe_lo_pendiente_sin_esperar_la_ventana(tmp_path):
+    cola = almacen.ColaEscritura(abrir(tmp_path), ventana=60, espera_maxima=60)
+    cola.registrar([registro("2024-01-01", "a"), registro("2024-01-02", "b")])
+    inicio = time.monotonic()
+    assert cola.vaciar(timeout=5) and time.monotonic() - inicio < 5
+    assert sorted(abrir(tmp_path).cargar()[USUARIO]["historial"]) == ["2024-01-01", "2024-01-02"]
+
+def test_aplicar_copia_en_escritura_sin_romper_recorridos(tmp_path):
+    from nucleo import persistencia
+    cola = almacen.ColaEscritura(abrir(tmp_path))
+    compartidos = almacen.DatosCompartidos(cola, lambda: persistencia.completar(cola.cargar()))
+    datos = compartidos.obtener()
+    compartidos.aplicar([almacen.op_fijar([USUARIO, "ciclos_activos", f"t{i}"], {"activo": True}) for i in range(3)] + [registro("2024-01-01", "a")])
+    ciclos, dia = datos[USUARIO]["ciclos_activos"], datos[USUARIO]["historial"]["2024-01-01"]
+    recorrido = iter(ciclos.items()); next(recorrido)
+    # Otra sesión muta mientras esta recorre: su versión no cambia bajo sus pies
+    compartidos.aplicar([almacen.op_fijar([USUARIO, "ciclos_activos", "t9"], {"activo": True}), registro("2024-01-01", "a"), registro("2024-01-01", "b")])
+    assert [k for k, _ in recorrido] == ["t1", "t2"]
+    assert dia == {"a": [{"hora": "10:00", "detalle": "Pre"}]}
+    assert compartidos.obtener() is datos and sorted(datos[USUARIO]["ciclos_activos"]) == ["t0", "t1", "t2", "t9"]
+    assert datos[USUARIO]["historial"]["2024-01-01"] == {"a": [{"hora": "10:00", "detalle": "Pre"}] * 2, "b": [{"hora": "10:00", "detalle": "Pre"}]}
+    cola.vaciar()
+
+def test_aplicar_op_copiando_equivale_a_aplicar_op():
+    ops = [almacen.op_fijar(["u", "a", "b"], 1), almacen.op_anadir(["u", "l"], 1), almacen.op_anadir(["u", "l"], 2),
+           almacen.op_quitar(["u", "l"], 1), almacen.op_borrar(["u", "a", "b"]), almacen.op_borrar(["x", "y"]),
+           almacen.op_quitar(["x", "y"], 1), almacen.op_fijar(["c"], {"d": 2}), almacen.op_anadir(["c", "e", "f"], 3)]
+    en_sitio, copiando = {}, {}
+    for op in ops:
+        almacen.aplicar_op(en_sitio, json.loads(json.dumps(op)))
+        almacen.aplicar_op_copiando(copiando, json.loads(json.dumps(op)))
+        assert copiando == en_sitio
+
+ALMACENES = [(almacen.AlmacenJSON, "datos.json"), (almacen.AlmacenSQLite, "datos.sqlite")]
+
+def dos_sesiones(clase, ruta):
+    clase(ruta).registrar([registro("2024-01-01", "a")])
+    sesiones = clase(ruta), clase(ruta)
+    for s in sesiones: s.cargar()
+    return sesiones
+
+@pytest.mark.parametrize("clase,nombre", ALMACENES)
+def test_set_en_conflicto_se_descarta_y_gana_el_remoto(tmp_path, clase, nombre):
+    a, b = dos_sesiones(clase, str(tmp_path / nombre))
+    ruta = [USUARIO, "meta_diaria", "2024-01-01"]
+    a.registrar([almacen.op_fijar(ruta, ["Mañana"])])
+    op = almacen.op_fijar(ruta, ["Noche"])
+    b.registrar([op])
+
+    assert op.get("descartada")
+    assert b.cambios_externos()
+    [conflicto] = b.tomar_conflictos(USUARIO)
+    assert conflicto["ruta"] == ruta and conflicto["remota"] == "set"
+    assert b.tomar_conflictos(USUARIO) == [] and a.tomar_conflictos(USUARIO) == []
+    for s in (clase(str(tmp_path / nombre)), b):
+        assert s.cargar()[USUARIO]["meta_diaria"]["2024-01-01"] == ["Mañana"]
+
+@pytest.mark.parametrize("clase,nombre", ALMACENES)
+def test_anadidos_en_otros_dias_se_fusionan(tmp_path, clase, nombre):
+    a, b = dos_sesiones(clase, str(tmp_path / nombre))
+    a.registrar([registro("2024-01-02", "b")])
+    b.registrar([registro("2024-01-03", "c"), registro("2024-01-01", "d")])
+
+    assert b.tomar_conflictos(USUARIO) == []
+    historial = clase(str(tmp_path / nombre)).cargar()[USUARIO]["historial"]
+    assert {f: sorted(dia) for f, dia in historial.items()} == {"2024-01-01": ["a", "d"], "2024-01-02": ["b"], "2024-01-03": ["c"]}
@@ -0,0 +1,44 @@
+import datetime
+
+import pandas as pd
+
+from nucleo import almacen, analitica, persistencia
+
+USUARIO = "usuario_rutina"
+
+def test_aplanar_desde_almacen_json_lee_cada_segmento_una_vez(tmp_path, monkeypatch):
+    datos = persistencia.completar(None)
+    db_u = datos[USUARIO]
+    inicio = datetime.date(2021, 1, 1)
+    for i in range(2 * 365):
+        f = (inicio + datetime.timedelta(days=i)).isoformat()
+        db_u["historial"][f] = {f"t{i % 5}": [{"hora": "10:00", "detalle": "🌙 Noche"}]}
+        db_u["planificados_adhoc"][f] = {f"t{i % 5}": "NIGHT", "t9": "PRE"}
+        if i % 3 == 0: db_u["descartados"][f] = ["t9"]
+        if i % 2 == 0: db_u["meta_cardio"][f] = {"actividad": "Andar", "tiempo": 15}
+    ruta = str(tmp_path / "datos.json")
+    almacen.AlmacenJSON(ruta).guardar(datos)
+    cargas = []
+    original = almacen.CuentaJSON._cargar_segmento
+    monkeypatch.setattr(almacen.CuentaJSON, "_cargar_segmento", lambda self, s, mes: cargas.append((s, mes)) or original(self, s, mes))
+
+    desde_almacen = analitica.aplanar(persistencia.cargar(almacen.AlmacenJSON(ruta, meses_residentes=3)))
+    assert len(cargas) == len(set(cargas))
+    en_memoria = analitica.aplanar(datos)
+    for nombre in ("sesiones", "planificados", "descartados", "cardio"):
+        pd.testing.assert_frame_equal(getattr(desde_almacen, nombre), getattr(en_memoria, nombre))
+
+def test_rachas_y_topes_con_fechas_anteriores_a_1970():
+    datos = persistencia.completar(None)
+    historial = datos[USUARIO]["historial"]
+    for f in ("1969-12-29", "1969-12-30", "1969-12-31", "1970-01-01"): historial[f] = {"b": [{"hora": "10:00"}]}
+    historial["1970-01-05"] = {"a": [{"hora": "10:00"}], "b": [{"hora": "10:00"}]}
+    tablas = analitica.aplanar(datos)
+    r = analitica.rachas(tablas, datetime.date(1970, 1, 6)).set_index("tratamiento")
+    assert (r.loc["b", "mejor"], r.loc["b", "actual"], r.loc["a", "mejor"]) == (4, 1, 1)
+    assert r.loc["b", "ultima"] == pd.Timestamp("1970-01-05")
+    catalogo = pd.DataFrame({"usuario": [USUARIO] * 2, "tratamiento": ["a", "b"], "max_semanal": [3, 3]})
+    catalogo = catalogo.astype({"usuario": tablas.sesiones["usuario"].dtype, "tratamiento": tablas.tratamientos})
+    topes = analitica.uso_topes_semanales(tablas, catalogo)
+    assert sorted(zip(topes["tratamiento"].astype(str), topes["semana"].astype(str), topes["dias"])) == [
+        ("a", "1970-01-05/1970-01-11", 1), ("b", "1969-12-29/1970-01-04", 4), ("b", "1970-01-05/1970-01-11", 1)]
@@ -0,0 +1,16 @@
+import pytest
+
+from nucleo.busqueda import UMBRAL_BUSQUEDA, BuscadorCatalogo
+from nucleo.catalogo import catalogo_usuario
+
+@pytest.mark.parametrize("consulta,esperado", [("codo de tenista", "cod_epic_d"), ("lumbalgia", "esp_lumb_g"), ("dolor de rodilla al subir escaleras", "rod_dolo_d")])
+def test_sintoma_conocido_supera_el_umbral(consulta, esperado):
+    resultados = BuscadorCatalogo().buscar(consulta, catalogo_usuario({}))
+    assert resultados and resultados[0][1] >= UMBRAL_BUSQUEDA
+    assert esperado in [t.id for t, _ in resultados]
+
+@pytest.mark.parametrize("consulta", ["tengo fiebre y tos", "ansiedad", "dolor de muelas"])
+def test_consulta_sin_relacion_pasa_a_la_ia(consulta):
+    buscador = BuscadorCatalogo()
+    assert buscador.buscar(consulta, catalogo_usuario({})) == []
+    assert buscador.indice.puntuar(consulta).most_common(1)[0][1] < UMBRAL_BUSQUEDA / 2
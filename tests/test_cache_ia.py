@@ -0,0 +1,57 @@
+from nucleo.cache_ia import CacheIA
+
+
+class Reloj:
+    def __init__(self): self.ahora = 1000.0
+    def __call__(self): return self.ahora
+
+
+def nueva(tmp_path, **kw):
+    reloj = Reloj()
+    return CacheIA(str(tmp_path / "cache_ia.sqlite"), reloj=reloj, **kw), reloj
+
+
+def test_aciertos_y_fallos_con_consulta_normalizada(tmp_path):
+    cache, _ = nueva(tmp_path)
+    assert cache.obtener("Dolor de rodilla.", 1) is None
+    cache.guardar("Dolor de rodilla.", 1, [{"nombre": "Rodilla"}])
+    assert cache.obtener("dolor  RODILLA", 1) == [{"nombre": "Rodilla"}]
+    assert cache.obtener("dolor rodilla", 2) is None  # otra versión del prompt
+    e = cache.estadisticas()
+    assert (e["consultas"], e["aciertos"], e["fallos"], e["entradas"]) == (3, 1, 2, 1)
+    assert e["tasa_aciertos"] == 1 / 3
+
+
+def test_caduca_pasado_el_ttl(tmp_path):
+    cache, reloj = nueva(tmp_path, ttl=60)
+    cache.guardar("hombro", 1, ["a"])
+    reloj.ahora += 60
+    assert cache.obtener("hombro", 1) == ["a"]
+    reloj.ahora += 1
+    assert cache.obtener("hombro", 1) is None
+    assert cache.estadisticas()["caducadas"] == 1 and cache.estadisticas()["entradas"] == 0
+    # Al guardar también se barren las caducadas aunque nadie las pida
+    cache.guardar("codo", 1, ["b"]); reloj.ahora += 61
+    cache.guardar("muñeca", 1, ["c"])
+    assert cache.estadisticas()["entradas"] == 1 and cache.estadisticas()["caducadas"] == 2
+
+
+def test_desaloja_la_menos_usada_recientemente(tmp_path):
+    cache, reloj = nueva(tmp_path, max_entradas=2)
+    for consulta in ("uno", "dos"):
+        cache.guardar(consulta, 1, [consulta]); reloj.ahora += 1
+    assert cache.obtener("uno", 1) == ["uno"]  # "dos" pasa a ser la más antigua en uso
+    reloj.ahora += 1
+    cache.guardar("tres", 1, ["tres"])
+    assert cache.obtener("dos", 1) is None
+    assert cache.obtener("uno", 1) == ["uno"] and cache.obtener("tres", 1) == ["tres"]
+    assert cache.estadisticas()["desalojadas"] == 1
+
+
+def test_persiste_entre_instancias(tmp_path):
+    cache, _ = nueva(tmp_path)
+    cache.guardar("espalda", 1, ["x"])
+    otra, _ = nueva(tmp_path)
+    assert otra.obtener("espalda", 1) == ["x"]
+    otra.vaciar()
+    assert cache.obtener("espalda", 1) is None
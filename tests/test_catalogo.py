@@ -0,0 +1,29 @@
+from dataclasses import fields
+
+from nucleo import catalogo
+from nucleo.catalogo import obtener_catalogo
+
+CUSTOM = {"id": "custom_1", "nombre": "Rodilla operada", "zona": "Rodilla", "ondas": "660+850", "energia": "660nm: 50% | 850nm: 100%",
+          "hz": "10Hz", "dist": "15cm", "dur": 12, "tipo": "LESION", "tips_ant": ["Piel limpia"], "tips_des": ["Hielo"],
+          "fases": [{"nombre": "Estándar", "dias_fin": 30}], "frecuencias": [[660, 50], [850, 100]],
+          "descripcion": "Tras cirugía.", "sintomas": "Dolor al flexionar.", "posicion": "Panel a 15 cm."}
+
+def valores(t): return {f.name: getattr(t, f.name) for f in fields(t)}
+
+def test_a_dict_de_un_personalizado_lo_reconstruye_igual():
+    t = obtener_catalogo([CUSTOM])[0]
+    assert t.a_dict() == CUSTOM
+    assert valores(obtener_catalogo([t.a_dict()])[0]) == valores(t)
+
+def test_a_dict_de_uno_base_sirve_como_personalizado():
+    base = next(t for t in obtener_catalogo() if t.zona == "Rodilla")
+    copia = obtener_catalogo([base.a_dict()])[0]
+    assert copia.id == base.id and copia.es_custom
+    assert copia.a_dict() == base.a_dict()
+
+def test_la_tabla_de_tuplas_compartidas_esta_acotada():
+    for i in range(catalogo.TUPLAS_COMPARTIDAS + 100): obtener_catalogo([dict(CUSTOM, id=f"c{i}", tips_ant=[f"Tip {i}"])])
+    assert catalogo._tupla_unica.cache_info().currsize <= catalogo.TUPLAS_COMPARTIDAS
+    # Lo del catálogo base sigue compartido entre variantes
+    d, i = (t for t in obtener_catalogo() if t.zona == "Rodilla" and t.lado_txt in ("Derecho", "Izquierdo") and t.patologia == next(iter(catalogo.DB_TRATAMIENTOS_BASE["Rodilla"])))
+    assert d.frecuencias is i.frecuencias
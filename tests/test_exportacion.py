@@ -0,0 +1,30 @@
+import datetime
+
+import pytest
+
+from nucleo import almacen, exportacion, persistencia
+
+USUARIO = "usuario_rutina"
+
+def abrir(backend, ruta):
+    return almacen.AlmacenSQLite(ruta) if backend == "sqlite" else almacen.AlmacenJSON(ruta)
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_rango_solo_carga_los_segmentos_que_toca(tmp_path, backend):
+    datos = persistencia.completar(None)
+    db_u = datos[USUARIO]
+    inicio = datetime.date(2024, 1, 1)
+    for i in range(365):
+        f = (inicio + datetime.timedelta(days=i)).isoformat()
+        if i % 3 == 0: db_u["descartados"][f] = ["t9"]
+        if i % 2 == 0: db_u["meta_cardio"][f] = {"actividad": "Andar", "tiempo": 15}
+    ruta = str(tmp_path / f"datos.{backend}")
+    abrir(backend, ruta).guardar(datos)
+    desde, hasta = datetime.date(2024, 3, 10), datetime.date(2024, 4, 5)
+
+    cargados = persistencia.cargar(abrir(backend, ruta))[USUARIO]
+    for hoja, seccion in (("Descartados", "descartados"), ("Cardio", "meta_cardio")):
+        filas = exportacion.HOJAS[hoja][1]
+        assert list(filas(cargados, {}, None, desde, hasta)) == list(filas(db_u, {}, None, desde, hasta))
+        residentes = cargados[seccion].residentes()
+        assert residentes and all(desde.isoformat()[:7] <= r[:7] <= hasta.isoformat()[:7] for r in residentes)
@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+
+import pytest
+
+from nucleo import ia
+
+OPCION = [{"nombre": "Rodilla", "zona": "Rodilla"}]
+
+
+class ClienteFalso:
+    # modelo -> (segundos de espera, texto o excepción); registra qué modelos se llamaron
+    def __init__(self, respuestas, soltar=None):
+        self.respuestas, self.soltar = respuestas, soltar
+        self.llamados, self.acabados = [], []
+
+    def generar(self, modelo, prompt, plazo):
+        self.llamados.append(modelo)
+        espera, respuesta = self.respuestas[modelo]
+        if self.soltar is not None and espera is None: self.soltar.wait(5)
+        else: time.sleep(espera)
+        self.acabados.append(modelo)
+        if isinstance(respuesta, Exception): raise respuesta
+        return respuesta
+
+
+def test_gana_la_primera_respuesta_valida():
+    cliente = ClienteFalso({"a": (0.3, json.dumps([{"nombre": "Lento"}])), "b": (0.01, json.dumps(OPCION)), "c": (0.3, "[]")})
+    assert ia.carrera(cliente, "p", ("a", "b", "c"), plazo=5) == ("b", OPCION)
+
+
+def test_respuesta_invalida_o_fallo_cede_al_siguiente():
+    cliente = ClienteFalso({"a": (0.01, "no es json"), "b": (0.02, RuntimeError("caído")), "c": (0.1, "```json\n" + json.dumps(OPCION) + "\n```")})
+    assert ia.carrera(cliente, "p", ("a", "b", "c"), plazo=5) == ("c", OPCION)
+
+
+def test_plazo_agotado_da_el_motivo_de_cada_modelo():
+    soltar = threading.Event()
+    cliente = ClienteFalso({"a": (0.01, "[]"), "b": (None, json.dumps(OPCION))}, soltar)
+    inicio = time.monotonic()
+    with pytest.raises(ia.ErrorIA) as error:
+        ia.carrera(cliente, "p", ("a", "b"), plazo=0.2)
+    soltar.set()
+    assert time.monotonic() - inicio < 1
+    assert error.value.motivos["a"].startswith("ValueError") and "sin respuesta" in error.value.motivos["b"]
+
+
+def test_los_perdedores_se_abandonan_sin_esperarlos():
+    soltar = threading.Event()
+    cliente = ClienteFalso({"a": (None, json.dumps([{"nombre": "Tarde"}])), "b": (0.01, json.dumps(OPCION))}, soltar)
+    inicio = time.monotonic()
+    assert ia.carrera(cliente, "p", ("a", "b"), plazo=5) == ("b", OPCION)
+    # Volvió sin que "a" terminase; su respuesta tardía no cambia nada
+    assert time.monotonic() - inicio < 1 and "a" not in cliente.acabados
+    soltar.set()
+
+
+def test_consultar_no_vuelve_a_la_ia_con_respuesta_en_cache():
+    class Cache:
+        def __init__(self): self.datos = {}
+        def obtener(self, consulta, version): return self.datos.get((consulta, version))
+        def guardar(self, consulta, version, opciones): self.datos[(consulta, version)] = opciones
+    cliente, cache = ClienteFalso({"b": (0, json.dumps(OPCION))}), Cache()
+    assert ia.consultar(cliente, "rodilla", cache, ("b",), plazo=5) == (OPCION, False)
+    assert ia.consultar(cliente, "rodilla", cache, ("b",), plazo=5) == (OPCION, True)
+    assert cliente.llamados == ["b"]
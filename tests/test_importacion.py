@@ -0,0 +1,59 @@
+import copy
+import datetime
+import io
+
+from openpyxl import Workbook
+
+from nucleo import importacion, persistencia
+from nucleo.almacen import aplicar_op
+from nucleo.catalogo import catalogo_usuario
+
+USUARIO = "usuario_rutina"
+
+def libro(filas, hoja=None):
+    wb = Workbook()
+    ws = wb.active
+    if hoja: ws.title = hoja
+    for fila in filas: ws.append(fila)
+    archivo = io.BytesIO()
+    wb.save(archivo); archivo.seek(0)
+    return archivo
+
+def test_historial_sin_duplicados_del_libro_ni_del_historial():
+    datos = persistencia.completar(None)
+    datos[USUARIO]["historial"]["2024-03-01"] = {"cod_epic_d": [{"hora": "10:00", "detalle": "Pre"}]}
+    archivo = libro([["Fecha", "Tratamiento", "Hora", "Detalle"],
+                     ["2024-03-01", "cod_epic_d", "10:00", "Pre"],                   # ya en el historial
+                     [datetime.date(2024, 3, 2), "Codo Derecho (Epicondilitis (Tenista))", datetime.time(9, 30), None],
+                     ["02/03/2024", "cod_epic_d", "09:30", ""],                     # la misma fila escrita de otra forma
+                     ["2024-03-03", "cod_calc_i", "18:00", "Post"]])
+    r = importacion.leer_historial(archivo, catalogo_usuario({}), datos[USUARIO], USUARIO)
+    assert r.errores == [] and r.leidas == 4 and r.duplicadas == 2
+    assert [(op["ruta"], op["valor"]) for op in r.ops] == [
+        ([USUARIO, "historial", "2024-03-02", "cod_epic_d"], {"hora": "09:30", "detalle": importacion.DETALLE_IMPORTADO}),
+        ([USUARIO, "historial", "2024-03-03", "cod_calc_i"], {"hora": "18:00", "detalle": "Post"})]
+
+def test_historial_fechas_e_ids_no_validos_van_a_errores():
+    archivo = libro([["fecha", "id"],
+                     ["2024-13-40", "cod_epic_d"],
+                     ["ayer", "cod_epic_d"],
+                     ["2024-03-05", "no_existe"],
+                     ["2024-03-06", "cod_epic_d"]])
+    r = importacion.leer_historial(archivo, catalogo_usuario({}), persistencia.completar(None)[USUARIO], USUARIO)
+    assert r.errores == [(2, "fecha no válida: 2024-13-40"), (3, "fecha no válida: ayer"), (4, "tratamiento desconocido: no_existe")]
+    assert [op["ruta"][2] for op in r.ops] == ["2024-03-06"]
+
+def test_rutina_parcial_deja_intactos_los_demas_dias():
+    datos = persistencia.completar(None)
+    antes = copy.deepcopy(datos["configuracion_rutina"]["semana"])
+    archivo = libro([["Día", "Rutinas"],
+                     ["Lunes", "Andar, Elíptica"],
+                     ["Miércoles", "PREVENTIVO II"],
+                     ["Juernes", "Andar"],
+                     ["Viernes", "Andar, Pilates"]], hoja="Semana")
+    semana, errores = importacion.leer_rutina(archivo, datos["configuracion_rutina"]["tags"])
+    assert errores == [(4, "día no válido: Juernes"), (5, "rutina desconocida: Pilates")]
+    for op in importacion.ops_rutina(semana): aplicar_op(datos, op)
+    despues = datos["configuracion_rutina"]["semana"]
+    assert despues["0"] == ["Andar", "Elíptica"] and despues["2"] == ["PREVENTIVO II"]
+    assert {d: v for d, v in despues.items() if d not in ("0", "2")} == {d: v for d, v in antes.items() if d not in ("0", "2")}
@@ -0,0 +1,22 @@
+import pytest
+
+from nucleo import almacen, importacion, persistencia
+from nucleo.planificacion import RUTINA_SEMANAL, TAGS_ACTIVIDADES
+
+def reabrir(backend, tmp_path):
+    # Como tras reiniciar el proceso: almacén nuevo, sin la caché de abrir_almacen
+    ruta_json, ruta_sqlite = str(tmp_path / "datos.json"), str(tmp_path / "datos.sqlite")
+    destino = almacen.AlmacenSQLite(ruta_sqlite) if backend == "sqlite" else almacen.AlmacenJSON(ruta_json)
+    return persistencia.cargar(destino)
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_importar_parte_de_la_rutina_conserva_el_resto_tras_reabrir(backend, tmp_path):
+    cola = persistencia.abrir(backend, str(tmp_path / "datos.json"), str(tmp_path / "datos.sqlite"))
+    compartidos = almacen.DatosCompartidos(cola, lambda: persistencia.cargar(cola))
+    compartidos.aplicar(importacion.ops_rutina({"0": ["TORSO I"], "3": ["PREVENTIVO I"]}))
+    assert cola.vaciar()
+
+    config = reabrir(backend, tmp_path)["configuracion_rutina"]
+    assert config["semana"] == dict(RUTINA_SEMANAL, **{"0": ["TORSO I"], "3": ["PREVENTIVO I"]})
+    assert config["tags"] == TAGS_ACTIVIDADES
+    assert RUTINA_SEMANAL["0"] == ["FULLBODY I"]  # los valores por defecto no se comparten con el árbol
@@ -0,0 +1,32 @@
+import datetime
+
+from nucleo import almacen, persistencia
+from nucleo.catalogo import catalogo_usuario
+from nucleo.indice import IndiceHistorial
+from nucleo.planificacion import planificar_semana
+
+USUARIO = "usuario_rutina"
+
+def test_planificar_con_el_historial_perezoso_solo_lee_la_semana(tmp_path, monkeypatch):
+    ids = [t.id for t in catalogo_usuario({})][:6]
+    inicio = datetime.date(2022, 1, 3)
+    datos = persistencia.completar(None)
+    for i in range(3 * 365):
+        f = (inicio + datetime.timedelta(days=i)).isoformat()
+        datos[USUARIO]["historial"][f] = {ids[i % len(ids)]: [{"hora": "10:00", "detalle": "Pre"}]}
+    almacen.AlmacenJSON(str(tmp_path / "datos.json")).guardar(datos)
+    cargados = persistencia.cargar(almacen.AlmacenJSON(str(tmp_path / "datos.json")))
+    db_u = cargados[USUARIO]
+    lunes = inicio + datetime.timedelta(weeks=80)
+    fechas = [lunes + datetime.timedelta(days=i) for i in range(7)]
+
+    cargas = []
+    original = almacen.CuentaJSON._cargar_segmento
+    monkeypatch.setattr(almacen.CuentaJSON, "_cargar_segmento", lambda self, s, mes: cargas.append((s, mes)) or original(self, s, mes))
+    perezoso = planificar_semana(fechas, cargados, db_u, catalogo_usuario(db_u), db_u["historial"], USUARIO)
+    assert {mes for s, mes in cargas if s == "historial"} <= {f.strftime("%Y-%m") for f in fechas + [lunes - datetime.timedelta(days=7)]}
+
+    con_indice = planificar_semana(fechas, cargados, db_u, catalogo_usuario(db_u), IndiceHistorial(datos[USUARIO]["historial"]), USUARIO)
+    for a, b in zip(perezoso, con_indice):
+        assert [t.id for t, _ in a.to_show] == [t.id for t, _ in b.to_show]
+        assert a.bloqueos == b.bloqueos
@@ -0,0 +1,29 @@
+import dataclasses
+import datetime
+import random
+
+from nucleo.catalogo import catalogo_usuario
+from nucleo.reglas import MOMENTOS, analizar_bloqueos, evaluar_bloqueos
+
+
+def test_evaluar_bloqueos_coincide_con_analizar_bloqueos():
+    azar = random.Random(0)
+    base = list(catalogo_usuario({}))
+    ids = [t.id for t in base]
+    # Topes semanales e incompatibilidades variados para que salgan todos los motivos
+    tratamientos = [dataclasses.replace(t, max_semanal=1 + i % 4, incompatible_with=tuple(azar.sample(ids, i % 3))) for i, t in enumerate(base)]
+    lunes = datetime.date(2026, 3, 2)
+    historial = {}
+    for i in range(-10, 7):
+        if azar.random() < 0.2: continue  # días sin registros
+        historial[(lunes + datetime.timedelta(days=i)).isoformat()] = {tid: [{"hora": "10:00"}] for tid in azar.sample(ids, len(ids) // 3)}
+    fechas = [lunes + datetime.timedelta(days=i) for i in range(7)]
+    tags = {f.isoformat(): (["Active"] if azar.random() < 0.5 else []) for f in fechas}
+    motivos = set()
+    for usuario in ("usuario_rutina", "usuario_libre"):
+        de_una_vez = evaluar_bloqueos(tratamientos, fechas, historial, tags, usuario)
+        esperado = {(t.id, f.isoformat(), m): analizar_bloqueos(t, m, historial, historial.get(f.isoformat(), {}), f.isoformat(), tags[f.isoformat()], usuario)
+                    for t in tratamientos for f in fechas for m in MOMENTOS}
+        assert de_una_vez == esperado
+        motivos |= {m for _, m in esperado.values()}
+    assert motivos == {"", "⚠️ FALTA ACTIVIDAD", "⛔ HORARIO PROHIBIDO", "⛔ MAX SEMANAL", "⛔ INCOMPATIBLE"}
@@ -0,0 +1,72 @@
+import datetime
+import random
+import threading
+
+from nucleo import almacen, resumenes
+from nucleo.resumenes import ResumenesHistorial, ResumenesUsuario
+
+USUARIO = "usuario_rutina"
+
+def datos_de_prueba(meses=30):
+    inicio = datetime.date(2022, 1, 1)
+    db_u = {"historial": {}, "planificados_adhoc": {}, "descartados": {}}
+    for i in range(meses * 30):
+        f = (inicio + datetime.timedelta(days=i)).isoformat()
+        db_u["historial"][f] = {f"t{i % 7}": [{"hora": "10:00", "detalle": "Pre"}]}
+        if i % 2: db_u["planificados_adhoc"][f] = {f"t{i % 7}": "PRE", "t9": "FLEX"}
+        if i % 5 == 0: db_u["descartados"][f] = ["t9"]
+    return {USUARIO: db_u}
+
+def compartidos_json(tmp_path, datos, meses_residentes=3):
+    destino = almacen.AlmacenJSON(str(tmp_path / "datos.json"), meses_residentes=meses_residentes)
+    destino.guardar(datos)
+    destino = almacen.AlmacenJSON(str(tmp_path / "datos.json"), meses_residentes=meses_residentes)
+    return almacen.DatosCompartidos(destino, destino.cargar)
+
+def mismo_resumen(a, b):
+    assert a.claves == b.claves
+    for periodo in ("dia", "semana", "mes"):
+        for clave in a.claves[periodo]:
+            x, y = a.resumen(periodo, clave), b.resumen(periodo, clave)
+            assert (x.sesiones, x.dias, x.planificados, x.cumplidos, x.descartados) == (y.sesiones, y.dias, y.planificados, y.cumplidos, y.descartados)
+
+def por_dias(db_usuario):
+    # Referencia: día a día, en desorden, por el camino incremental
+    r = ResumenesUsuario()
+    fechas = sorted({f for s in resumenes.SECCIONES for f in db_usuario[s]})
+    random.Random(0).shuffle(fechas)
+    for f in fechas: r.actualizar_dia(f, db_usuario)
+    return r
+
+def test_construir_desde_dict_desordenado():
+    db_u = datos_de_prueba(meses=4)[USUARIO]
+    desordenado = {s: dict(reversed(list(v.items()))) for s, v in db_u.items()}
+    mismo_resumen(ResumenesUsuario(desordenado), por_dias(db_u))
+
+def test_construir_sobre_almacen_json_lee_cada_segmento_pocas_veces(tmp_path, monkeypatch):
+    datos = datos_de_prueba()
+    compartidos = compartidos_json(tmp_path, datos)
+    cargas = []
+    original = almacen.CuentaJSON._cargar_segmento
+    monkeypatch.setattr(almacen.CuentaJSON, "_cargar_segmento", lambda self, s, mes: cargas.append((s, mes)) or original(self, s, mes))
+    construido = ResumenesHistorial(compartidos)[USUARIO]
+    mismo_resumen(construido, por_dias(datos[USUARIO]))
+    # Cada segmento mensual se lee una sola vez; en desorden, con 3 residentes, serían miles
+    assert len(cargas) == len(set(cargas))
+
+def test_construir_no_bloquea_mutar_y_recoge_sus_cambios(tmp_path, monkeypatch):
+    compartidos = compartidos_json(tmp_path, datos_de_prueba(meses=3))
+    historial = ResumenesHistorial(compartidos)
+    fecha = "2022-02-10"
+
+    class ConMutacion(ResumenesUsuario):
+        def __init__(self, db_usuario=None):
+            super().__init__(db_usuario)
+            # Otra sesión registra mientras se construye: con el lock tomado esto se quedaría esperando
+            hilo = threading.Thread(target=compartidos.aplicar, args=([almacen.op_anadir([USUARIO, "historial", fecha, "nuevo"], {"hora": "11:00"})],))
+            hilo.start(); hilo.join(5)
+            assert not hilo.is_alive()
+
+    monkeypatch.setattr(resumenes, "ResumenesUsuario", ConMutacion)
+    construido = historial[USUARIO]
+    assert construido.resumen("dia", fecha).sesiones["nuevo"] == 1
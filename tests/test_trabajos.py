@@ -0,0 +1,22 @@
+import threading
+
+import pytest
+
+from nucleo.trabajos import Ejecutor, ErrorTrabajos
+
+
+def test_cancelado_en_curso_sigue_contando_hasta_acabar():
+    e = Ejecutor(hilos=1, max_pendientes=1, retencion=0)
+    empezado, soltar = threading.Event(), threading.Event()
+    trabajo = e.lanzar("lento", lambda: (empezado.set(), soltar.wait(5)))
+    assert empezado.wait(5)
+    assert e.cancelar(trabajo.id) and trabajo.estado == "cancelado"
+    assert trabajo.terminado_en is not None
+    # Aún ocupa el único hilo: ni el tope lo ignora ni la purga ni retirar lo olvidan
+    with pytest.raises(ErrorTrabajos): e.lanzar("otro", lambda: None)
+    e.retirar(trabajo.id)
+    assert e.obtener(trabajo.id) is trabajo
+    soltar.set()
+    trabajo.futuro.result(timeout=5)
+    assert e.lanzar("otro", lambda: 1).esperar(5)
+    assert e.obtener(trabajo.id) is None